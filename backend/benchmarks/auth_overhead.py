@@ -0,0 +1,67 @@
+"""Micro-benchmark for per-request auth overhead in get_current_user.
+
+Compares the original path (JWT decode + users lookup on every request) with the
+principal cache and trusted role claims. The users collection is replaced by a stub
+that sleeps for --db-latency-ms to stand in for a Mongo round-trip.
+
+    python benchmarks/auth_overhead.py --requests 20000 --db-latency-ms 1.5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("OPENAI_API_KEY", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+class LatencyUsers:
+    def __init__(self, latency_s):
+        self.latency_s = latency_s
+        self.calls = 0
+
+    async def find_one(self, query, projection=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency_s)
+        return {"email": query["email"], "role": "student"}
+
+
+async def run(label, tokens, requests, trust_claims, cache_size):
+    main.settings.PRINCIPAL_TRUST_CLAIMS = trust_claims
+    main.principal_cache = main.PrincipalCache(cache_size, main.settings.PRINCIPAL_CACHE_TTL_SECONDS)
+    users = main.users_collection
+    users.calls = 0
+
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        await main.get_current_user(tokens[i % len(tokens)])
+        samples.append((time.perf_counter() - start) * 1e6)
+
+    samples.sort()
+    print(f"{label:<34} mean={statistics.mean(samples):8.1f}us  p50={samples[len(samples) // 2]:8.1f}us"
+          f"  p99={samples[int(len(samples) * 0.99)]:8.1f}us  db_calls={users.calls}")
+
+
+async def main_async(args):
+    main.users_collection = LatencyUsers(args.db_latency_ms / 1000.0)
+    tokens = [main.create_access_token({"sub": f"student{i}@example.com", "role": "student"})
+              for i in range(args.users)]
+
+    await run("before: decode + users lookup", tokens, args.requests, trust_claims=False, cache_size=0)
+    await run("trusted claims, no cache", tokens, args.requests, trust_claims=True, cache_size=0)
+    await run("trusted claims + principal cache", tokens, args.requests, trust_claims=True,
+              cache_size=main.settings.PRINCIPAL_CACHE_SIZE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200, help="distinct tokens to rotate through")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""Cold-start cost of the serverless entry point (main.handler).
+
+Each run starts a fresh interpreter, imports main and sends one request through
+the Mangum handler, the same path Vercel/Lambda takes on a cold container:
+
+    import_ms           time spent in `import main`
+    first_response_ms   the first handler() call (lazy clients and imports land here)
+    process_ms          interpreter start to exit, as seen from outside
+
+The default path, /metrics, needs neither MongoDB nor the LLM, so the numbers are
+reproducible offline. With --importtime the slowest modules imported directly by
+main are listed from `python -X importtime`. Results are compared with the
+"cold_start" entry of the baselines file; regenerate it with --update-baselines on
+the machine that runs the comparison.
+
+    python benchmarks/cold_start.py --runs 5 --importtime
+    python benchmarks/cold_start.py --update-baselines
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCH_DIR, "..")
+DEFAULT_BASELINES = os.path.join(BENCH_DIR, "baselines.json")
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+event = {
+    "version": "2.0", "routeKey": "$default", "rawPath": sys.argv[1], "rawQueryString": "",
+    "headers": {"host": "localhost"}, "isBase64Encoded": False,
+    "requestContext": {"http": {"method": "GET", "path": sys.argv[1], "protocol": "HTTP/1.1",
+                                "sourceIp": "127.0.0.1", "userAgent": "cold-start"}, "stage": "$default"},
+}
+response = main.handler(event, None)
+done = time.perf_counter()
+print(json.dumps({"status": response["statusCode"], "import_ms": (imported - started) * 1000,
+                  "first_response_ms": (done - imported) * 1000}))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark-secret")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["ACCESS_LOG"] = "false"
+    return env
+
+
+def cold_start(path):
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", CHILD, path], cwd=BACKEND_DIR, env=child_env(),
+                          capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_ms"] = elapsed
+    return result
+
+
+def importtime(top):
+    """Cumulative import time (ms) of the modules main imports directly, slowest first."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                          env=child_env(), capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            rows.append((name.strip(), int(cumulative) / 1000))
+    return sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/metrics", help="Route for the first request")
+    parser.add_argument("--importtime", action="store_true", help="Also list the slowest direct imports")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression")
+    parser.add_argument("--update-baselines", action="store_true")
+    args = parser.parse_args()
+
+    runs = [cold_start(args.path) for _ in range(args.runs)]
+    statuses = {r["status"] for r in runs}
+    result = {key: round(statistics.median(r[key] for r in runs), 1)
+              for key in ("import_ms", "first_response_ms", "process_ms")}
+    print(f"{args.runs} cold starts, GET {args.path} -> {sorted(statuses)}")
+    for key, value in result.items():
+        print(f"  {key:<18}{value:>9.1f}")
+
+    if args.importtime:
+        print(f"\n{'module':<40}{'cumulative ms':>14}")
+        for name, ms in importtime(args.top):
+            print(f"{name:<40}{ms:>14.1f}")
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    if args.update_baselines:
+        baselines["cold_start"] = result
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baselines written to {args.baselines}")
+        return 0
+
+    failures = []
+    for key, base in baselines.get("cold_start", {}).items():
+        if result[key] > base * (1 + args.tolerance):
+            failures.append(f"{key} {result[key]} ms > baseline {base}")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
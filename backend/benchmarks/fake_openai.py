@@ -0,0 +1,117 @@
+"""Local stand-in for the Azure OpenAI chat completions API.
+
+Serves POST /openai/deployments/{deployment}/chat/completions with a canned
+analysis (plain or streamed as SSE chunks) so the backend can be exercised offline. Latency, jitter and injected
+failures are configurable to test timeouts, retries and the circuit breaker.
+
+    python benchmarks/fake_openai.py --port 8100 --latency-ms 800 --error-rate 0.1
+    OPENAI_ENDPOINT=http://127.0.0.1:8100 OPENAI_API_KEY=fake OPENAI_API_VERSION=2024-02-01 python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CANNED_ANALYSIS = {
+    "is_valid_code": True,
+    "plagiarism_detected": False,
+    "confidence_score": 35,
+    "likely_source": "Original student work",
+    "explanation": "Canned response from the local fake OpenAI server.",
+    "suspicious_elements": [],
+    "red_flags": [],
+    "verification_questions": ["Can you explain how this code works?"],
+    "recommendations": ["Add more comments to improve readability"],
+    "evaluation_metrics": {
+        "code_correctness": {"status": "Passed", "test_cases": "1", "failed_cases": "0"},
+        "code_efficiency": {"time_complexity": "O(n)", "memory_usage": "8MB", "execution_time": "10ms"},
+        "code_security": {"issues_found": [], "recommendations": []},
+        "code_readability": {"score": 7.0, "suggestions": []},
+    },
+}
+
+
+def _stream_chunks(deployment, content, chunk_chars, token_delay):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    async def body():
+        for start in range(0, len(content), chunk_chars):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"content": content[start:start + chunk_chars]}}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(token_delay)
+        final = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": deployment, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream")
+
+
+def create_app(latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+               error_status: int = 503, stream_chunk_chars: int = 16, stream_delay_ms: float = 5.0) -> FastAPI:
+    app = FastAPI(title="Fake Azure OpenAI")
+    app.state.calls = 0
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        app.state.calls += 1
+        body = await request.json()
+        delay = max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000.0
+        await asyncio.sleep(delay)
+
+        if random.random() < error_rate:
+            return JSONResponse(status_code=error_status, headers={"retry-after": "0"},
+                                content={"error": {"message": "injected failure", "code": str(error_status)}})
+
+        prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+        content = json.dumps(CANNED_ANALYSIS, indent=2)
+        if body.get("stream"):
+            return _stream_chunks(deployment, content, stream_chunk_chars, stream_delay_ms / 1000.0)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_chars // 4 + len(content) // 4,
+            },
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--stream-chunk-chars", type=int, default=16)
+    parser.add_argument("--stream-delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                           args.stream_chunk_chars, args.stream_delay_ms),
+                host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,317 @@
+"""Offline load-test suite: how many concurrent students one worker can serve.
+
+Boots benchmarks/fake_openai.py and benchmarks/offline_server.py (main:app on
+mongomock-motor) as subprocesses, then replays four scenarios over real HTTP:
+
+    login_storm         every student POSTs /auth/login at once
+    contest_start       teacher starts the contest, students hit /contest/by-code/{code}
+                        and /contest/active
+    submission_burst    every student submits, analysis goes to the fake LLM
+    teacher_polling     --viewers open dashboards page through /submissions/by-contest
+
+Each scenario reports throughput, p50/p95/p99 latency, errors and the server's
+resident memory. Results are compared with a baselines file and the run exits
+non-zero when throughput drops, p95 grows or memory grows by more than
+--tolerance. Baselines are machine-specific; regenerate them with
+--update-baselines on the machine that runs the comparison.
+
+    python benchmarks/load_suite.py --students 100 --concurrency 50
+    python benchmarks/load_suite.py --scenario contest_start --update-baselines
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINES = os.path.join(BENCH_DIR, "baselines.json")
+SCENARIOS = ("login_storm", "contest_start", "submission_burst", "teacher_polling")
+
+SOLUTION = "a, b = map(int, input().split())\nprint(a + b)\n"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid):
+    """Current and peak resident memory of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        return None, None
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def start_process(args, env):
+    return subprocess.Popen(
+        [sys.executable] + args, cwd=os.path.join(BENCH_DIR, ".."), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+
+
+async def wait_ready(url, proc, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited: {proc.stderr.read().decode()[-2000:]}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Recorder:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.errors = 0
+        self.started = None
+        self.elapsed = 0.0
+
+    async def timed(self, coro):
+        started = time.perf_counter()
+        try:
+            response = await coro
+            if response.status_code >= 400:
+                self.errors += 1
+            return response
+        except httpx.HTTPError:
+            self.errors += 1
+            return None
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self, server_pid):
+        samples = sorted(self.samples)
+        rss, peak = rss_mb(server_pid)
+        return {
+            "requests": len(samples),
+            "errors": self.errors,
+            "throughput_rps": round(len(samples) / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        }
+
+
+async def gather_limited(concurrency, coros):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+class LoadSuite:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.password = "benchmark-pw"
+        self.teacher = "teacher@bench.example.com"
+        self.students = [f"student{i}@bench.example.com" for i in range(args.students)]
+        self.tokens = {}
+        self.contest_id = None
+        self.contest_code = None
+
+    def auth(self, email):
+        return {"Authorization": f"Bearer {self.tokens[email]}"}
+
+    async def setup(self):
+        """Accounts and a contest; not measured."""
+        async def signup(email, role):
+            r = await self.client.post("/auth/signup", json={
+                "email": email, "username": email.split("@")[0], "password": self.password, "role": role,
+            })
+            r.raise_for_status()
+            self.tokens[email] = r.json()["access_token"]
+
+        await signup(self.teacher, "teacher")
+        await gather_limited(self.args.concurrency, [signup(e, "student") for e in self.students])
+        r = await self.client.post("/contest/create", headers=self.auth(self.teacher), json={
+            "title": "Load test contest",
+            "description": "Offline benchmark",
+            "questions": [{"title": f"Q{i}", "description": f"Question {i}: add two numbers",
+                           "sample_input": "1 2", "sample_output": "3"} for i in range(self.args.questions)],
+        })
+        r.raise_for_status()
+        self.contest_id = r.json()["id"]
+        self.contest_code = r.json()["contest_code"]
+
+    async def login_storm(self, rec):
+        await gather_limited(self.args.concurrency, [
+            rec.timed(self.client.post("/auth/login", json={"email": e, "password": self.password, "role": "student"}))
+            for e in self.students
+        ])
+
+    async def contest_start(self, rec):
+        await rec.timed(self.client.post(f"/contest/start/{self.contest_id}", headers=self.auth(self.teacher)))
+        coros = []
+        for _ in range(self.args.repeat):
+            for e in self.students:
+                coros.append(rec.timed(self.client.get(f"/contest/by-code/{self.contest_code}", headers=self.auth(e))))
+                coros.append(rec.timed(self.client.get("/contest/active")))
+        await gather_limited(self.args.concurrency, coros)
+
+    async def submission_burst(self, rec):
+        await gather_limited(self.args.concurrency, [
+            rec.timed(self.client.post("/submissions/submit", headers=self.auth(e), json={
+                "contest_id": self.contest_id,
+                "question_title": f"Q{i % self.args.questions}",
+                # Distinct code per student so the analysis cache does not absorb the burst
+                "code": f"# {e}\n{SOLUTION}",
+                "language": "python",
+            }))
+            for i, e in enumerate(self.students)
+        ])
+
+    async def teacher_polling(self, rec):
+        async def poll():
+            for _ in range(self.args.repeat):
+                cursor = None
+                while True:
+                    params = {"limit": 50}
+                    if cursor:
+                        params["cursor"] = cursor
+                    r = await rec.timed(self.client.get(
+                        f"/submissions/by-contest/{self.contest_id}", headers=self.auth(self.teacher), params=params))
+                    cursor = r.json().get("next_cursor") if r is not None and r.status_code == 200 else None
+                    if not cursor:
+                        break
+
+        # Only the owning teacher sees every submission; each viewer is one of their open dashboards
+        await gather_limited(self.args.concurrency, [poll() for _ in range(self.args.viewers)])
+
+
+def compare(results, baselines, tolerance):
+    failures = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if not base:
+            continue
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            failures.append(f"{name}: throughput {result['throughput_rps']} rps < baseline {base['throughput_rps']}")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p95 {result['p95_ms']} ms > baseline {base['p95_ms']}")
+        if result["rss_mb"] and base.get("rss_mb") and result["rss_mb"] > base["rss_mb"] * (1 + tolerance):
+            failures.append(f"{name}: rss {result['rss_mb']} MB > baseline {base['rss_mb']}")
+        if result["errors"] > base.get("errors", 0):
+            failures.append(f"{name}: {result['errors']} errors (baseline {base.get('errors', 0)})")
+    return failures
+
+
+async def run(args):
+    openai_port, app_port = free_port(), free_port()
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_ENDPOINT": f"http://127.0.0.1:{openai_port}",
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+    })
+    fake = start_process([os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(openai_port),
+                          "--latency-ms", str(args.llm_latency_ms)], env)
+    server = start_process([os.path.join(BENCH_DIR, "offline_server.py"), "--port", str(app_port)], env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{openai_port}/docs", fake)
+        await wait_ready(f"http://127.0.0.1:{app_port}/", server)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", limits=limits, timeout=120) as client:
+            suite = LoadSuite(client, args)
+            await suite.setup()
+            results = {}
+            for name in args.scenario or SCENARIOS:
+                with Recorder(name) as rec:
+                    await getattr(suite, name)(rec)
+                results[name] = rec.summary(server.pid)
+        return results
+    finally:
+        for proc in (server, fake):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Repeat to pick several; default all")
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--viewers", type=int, default=5, help="Concurrent teacher dashboards polling submissions")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3, help="Rounds of contest fetches / teacher polls")
+    parser.add_argument("--llm-latency-ms", type=int, default=400)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression")
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<18}{'reqs':>7}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}")
+        for name, r in results.items():
+            print(f"{name:<18}{r['requests']:>7}{r['errors']:>5}{r['throughput_rps']:>9}"
+                  f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['rss_mb'] or '-':>9}")
+
+    # Numbers are only comparable for the same load shape
+    config = {k: getattr(args, k) for k in ("students", "viewers", "questions", "concurrency", "repeat",
+                                            "llm_latency_ms", "bcrypt_rounds")}
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    if args.update_baselines:
+        baselines.update(results)
+        baselines["_config"] = config
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baselines written to {args.baselines}")
+        return 0
+
+    if baselines.get("_config", config) != config:
+        print(f"warning: baselines were recorded with {baselines['_config']}")
+    failures = compare(results, baselines, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
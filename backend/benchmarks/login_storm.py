@@ -0,0 +1,111 @@
+"""Login-storm benchmark: N concurrent POST /auth/login calls against main.app.
+
+Requests go through the real ASGI app via httpx; the users collection is an
+in-memory stand-in so only hashing and request handling are measured. Reports
+login throughput, p50/p99 latency and the worst event-loop stall seen by a
+heartbeat task. --inline runs bcrypt on the event loop, as the handlers used to.
+
+    python benchmarks/login_storm.py --logins 200 --concurrency 50 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("OPENAI_API_KEY", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+
+
+class MemoryUsers:
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query.get("email"))
+        if doc and all(doc.get(k) == v for k, v in query.items()):
+            return dict(doc)
+        return None
+
+    async def insert_one(self, doc):
+        self.docs[doc["email"]] = dict(doc, _id=doc["email"])
+
+    async def update_one(self, query, update):
+        doc = self.docs.get(query["_id"])
+        if doc:
+            doc.update(update.get("$set", {}))
+
+
+async def heartbeat(stop, interval=0.005):
+    worst = 0.0
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - start - interval)
+    return worst
+
+
+async def run(args):
+    users = MemoryUsers()
+    main.users_collection = users
+    password = "correct horse battery staple"
+    hashed = main.pwd_context.hash(password)
+    for i in range(args.users):
+        await users.insert_one({"email": f"student{i}@example.com", "username": f"student{i}",
+                                "hashed_password": hashed, "role": "student"})
+
+    if args.inline:
+        async def inline(fn, *fn_args):
+            return fn(*fn_args)
+        main.password_hasher._run = inline
+
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post("/auth/login", json={
+                    "email": f"student{i % args.users}@example.com", "password": password, "role": "student"})
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    failures += 1
+
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        worst_stall = await beat
+
+    latencies.sort()
+    mode = "inline (event loop)" if args.inline else f"executor ({main.password_hasher.workers} workers)"
+    print(f"mode={mode} rounds={args.rounds} logins={args.logins} concurrency={args.concurrency}")
+    print(f"throughput={args.logins / elapsed:.1f} logins/s  p50={latencies[len(latencies) // 2] * 1000:.1f}ms"
+          f"  p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms  failures={failures}"
+          f"  max_loop_stall={worst_stall * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS to benchmark with")
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop (pre-executor behaviour)")
+    args = parser.parse_args()
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    main.settings.BCRYPT_ROUNDS = args.rounds
+    main.pwd_context.update(bcrypt__default_rounds=args.rounds, bcrypt__min_rounds=args.rounds,
+                            bcrypt__max_rounds=args.rounds)
+    asyncio.run(run(args))
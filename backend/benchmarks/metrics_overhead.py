@@ -0,0 +1,87 @@
+"""Measures the per-request cost of RequestMetricsMiddleware.
+
+Builds two minimal apps with the same route, one bare and one wrapped in the
+middleware, and drives both in-process through httpx's ASGI transport so
+network noise stays out of the numbers. Exits non-zero when the added median
+latency exceeds --budget-us. Access logging is measured only with --access-log,
+since JSON formatting runs on the listener thread and mostly shows up as GIL
+contention rather than handler time.
+
+    python benchmarks/metrics_overhead.py --requests 5000 --budget-us 150
+    python benchmarks/metrics_overhead.py --access-log --budget-us 250
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("OPENAI_API_KEY", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+from fastapi import APIRouter, FastAPI  # noqa: E402
+
+import main  # noqa: E402
+
+
+def build_app(instrumented):
+    router = APIRouter()
+
+    @router.get("/item/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(main.RequestMetricsMiddleware)
+    app.include_router(router, prefix="/bench")
+    return app
+
+
+async def measure(app, requests):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):
+            await client.get(f"/bench/item/{i}")
+        samples = []
+        for i in range(requests):
+            started = time.perf_counter()
+            await client.get(f"/bench/item/{i}")
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1e6
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1e6
+    print(f"{label:<14} p50={p50:8.1f}us  p99={p99:8.1f}us")
+    return p50
+
+
+async def main_async(args):
+    # Alternate runs so CPU frequency drift hits both variants equally
+    bare, instrumented = [], []
+    for _ in range(args.rounds):
+        bare += await measure(build_app(False), args.requests // args.rounds)
+        instrumented += await measure(build_app(True), args.requests // args.rounds)
+
+    bare_p50 = summarize("bare", bare)
+    inst_p50 = summarize("instrumented", instrumented)
+    overhead = inst_p50 - bare_p50
+    print(f"overhead p50={overhead:.1f}us (budget {args.budget_us:.0f}us)")
+    return 0 if overhead <= args.budget_us else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--budget-us", type=float, default=150.0)
+    parser.add_argument("--access-log", action="store_true", help="Keep per-request access logging on")
+    parsed = parser.parse_args()
+    main.settings.ACCESS_LOG = parsed.access_log
+    sys.exit(asyncio.run(main_async(parsed)))
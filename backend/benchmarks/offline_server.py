@@ -0,0 +1,41 @@
+"""Runs main:app under uvicorn with MongoDB replaced by mongomock-motor.
+
+Nothing leaves the machine: the Motor client is swapped for an in-memory
+mongomock client before main is imported, so every collection, index bootstrap
+and job store works unchanged. Point OPENAI_ENDPOINT at benchmarks/fake_openai.py
+to keep the LLM offline too. Requires `pip install mongomock-motor`.
+
+    OPENAI_ENDPOINT=http://127.0.0.1:8100 OPENAI_API_KEY=fake OPENAI_API_VERSION=2024-02-01 \
+        python benchmarks/offline_server.py --port 8200
+"""
+import argparse
+import os
+import sys
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("MONGODB_URI", "mongodb://offline")
+os.environ.setdefault("ACCESS_LOG", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import motor.motor_asyncio  # noqa: E402
+import uvicorn  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+
+class OfflineMotorClient(AsyncMongoMockClient):
+    def __init__(self, *args, event_listeners=None, **kwargs):
+        # mongomock emits no command events, so the Mongo metrics listener has nothing to observe
+        super().__init__(*args, **kwargs)
+
+
+motor.motor_asyncio.AsyncIOMotorClient = OfflineMotorClient
+
+import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    args = parser.parse_args()
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,116 @@
+"""Serialization throughput of the list endpoints for a 10k-submission contest.
+
+Builds --submissions synthetic submission documents, encodes them to BSON as a
+cursor batch would arrive off the wire, and times each path from BSON bytes to
+the HTTP response body:
+
+    legacy      decode to dicts, rename _id and isoformat() datetimes in a Python
+                loop, jsonable_encoder, json.dumps (the pre-FastJSONResponse path)
+    fast        decode to dicts, rename _id, render_json (orjson when installed)
+    raw_bson    decode as RawBSONDocument, then inflate each one to a dict for the
+                encoder; shows what lazily-decoded documents cost when every field
+                ends up in the response anyway
+
+All paths must produce the same JSON. Exits non-zero when `fast` is not at least
+--min-speedup times faster than `legacy`.
+
+    python benchmarks/serialization.py --submissions 10000 --rounds 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("OPENAI_API_KEY", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bson  # noqa: E402
+from bson import ObjectId  # noqa: E402
+from bson.codec_options import CodecOptions  # noqa: E402
+from bson.raw_bson import RawBSONDocument  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import main  # noqa: E402
+
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def build_batch(count, code_bytes):
+    started = datetime(2026, 1, 1, 9, 0, 0)
+    code = ("total = sum(int(x) for x in input().split())\nprint(total)\n" * (code_bytes // 60 + 1))[:code_bytes]
+    docs = [{
+        "_id": ObjectId(),
+        "contest_id": "6ad49e296caf8827b40a7940",
+        "student_email": f"student{i}@example.com",
+        "question_title": f"Q{i % 5}",
+        "code": code,
+        "language": "python",
+        "submitted_at": started + timedelta(seconds=i, milliseconds=i % 1000),
+    } for i in range(count)]
+    return b"".join(bson.encode(d) for d in docs)
+
+
+def legacy(data):
+    docs = bson.decode_all(data)
+    for doc in docs:
+        doc["id"] = str(doc["_id"])
+        del doc["_id"]
+        for key, value in doc.items():
+            if isinstance(value, datetime):
+                doc[key] = value.isoformat()
+    content = jsonable_encoder(docs)
+    # starlette.responses.JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast(data):
+    return main.render_json([main.serialize_doc(d) for d in bson.decode_all(data)])
+
+
+def raw_bson(data):
+    docs = bson.decode_all(data, RAW_OPTIONS)
+    return main.render_json([main.serialize_doc(dict(d.items())) for d in docs])
+
+
+PATHS = {"legacy": legacy, "fast": fast, "raw_bson": raw_bson}
+
+
+def run(args):
+    data = build_batch(args.submissions, args.code_bytes)
+    outputs = {name: fn(data) for name, fn in PATHS.items()}
+    reference = json.loads(outputs["legacy"])
+    for name, body in outputs.items():
+        if json.loads(body) != reference:
+            print(f"{name} output differs from legacy")
+            return 1
+
+    print(f"{args.submissions} submissions, {len(data) / 1e6:.1f} MB BSON, "
+          f"encoder={'orjson' if main.orjson is not None else 'json'}")
+    print(f"{'path':<10}{'median ms':>11}{'docs/s':>12}{'MB/s out':>10}")
+    medians = {}
+    for name, fn in PATHS.items():
+        samples = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            body = fn(data)
+            samples.append(time.perf_counter() - started)
+        medians[name] = statistics.median(samples)
+        print(f"{name:<10}{medians[name] * 1000:>11.1f}{args.submissions / medians[name]:>12.0f}"
+              f"{len(body) / 1e6 / medians[name]:>10.1f}")
+
+    speedup = medians["legacy"] / medians["fast"]
+    print(f"fast vs legacy: {speedup:.2f}x")
+    return 0 if speedup >= args.min_speedup else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--submissions", type=int, default=10000)
+    parser.add_argument("--code-bytes", type=int, default=400, help="Size of each submission's code body")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=2.0)
+    sys.exit(run(parser.parse_args()))
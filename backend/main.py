@@ -1,23 +1,57 @@
-from fastapi import FastAPI, HTTPException, Depends, APIRouter, Request, status
+from fastapi import FastAPI, HTTPException, Depends, APIRouter, Request, Query, WebSocket, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pymongo import MongoClient
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import OperationFailure
+from bson import ObjectId, Binary
 from pydantic import BaseModel, EmailStr, Field
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from typing import List, Optional, Literal, Dict, Any
 from datetime import datetime, timedelta
 import os
+import sys
+import importlib.util
 import random
 import string
 import json
+import asyncio
+import hashlib
+import hmac
+import re
+import time
+import zlib
+import bisect
+import difflib
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+import math
+import operator
+import shutil
+import signal
+import subprocess
+import tempfile
+import contextvars
+import cProfile
+from array import array
+from contextlib import asynccontextmanager, contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from mangum import Mangum
-import bcrypt
-import uvicorn
+
+try:
+    import orjson
+except ImportError:  # list endpoints fall back to the stdlib encoder without orjson
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # code blobs are compressed with zlib without zstandard
+    zstandard = None
 # Load environment variables
 load_dotenv()
 
@@ -37,13 +71,498 @@ class Settings:
     OPENAI_ENDPOINT = os.getenv("OPENAI_ENDPOINT")
     OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION")
     OPENAI_DEPLOYMENT_NAME = os.getenv("OPENAI_DEPLOYMENT_NAME", "gpt-35-turbo")
+    OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+    OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "8"))
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+    OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+    OPENAI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("OPENAI_BREAKER_COOLDOWN_SECONDS", "30"))
+    PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "6000"))
+    PROMPT_MAX_OUTPUT_TOKENS = int(os.getenv("PROMPT_MAX_OUTPUT_TOKENS", "1500"))
+    PROMPT_MIN_CODE_TOKENS = int(os.getenv("PROMPT_MIN_CODE_TOKENS", "500"))
+    SECTIONED_ANALYSIS_MIN_TOKENS = int(os.getenv("SECTIONED_ANALYSIS_MIN_TOKENS", "1500"))
+    SECTION_MAX_TOKENS = int(os.getenv("SECTION_MAX_TOKENS", "1200"))
+    SECTION_MAX_COUNT = int(os.getenv("SECTION_MAX_COUNT", "12"))
+    SECTION_CONCURRENCY = int(os.getenv("SECTION_CONCURRENCY", "4"))
+    SECTION_MAX_OUTPUT_TOKENS = int(os.getenv("SECTION_MAX_OUTPUT_TOKENS", "800"))
+    INCREMENTAL_ANALYSIS = os.getenv("INCREMENTAL_ANALYSIS", "true").lower() == "true"
+    INCREMENTAL_MAX_CHANGE_RATIO = float(os.getenv("INCREMENTAL_MAX_CHANGE_RATIO", "0.3"))  # of lines
+    INCREMENTAL_SECTION_MAX_TOKENS = int(os.getenv("INCREMENTAL_SECTION_MAX_TOKENS", "300"))
+    ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+    ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "200"))
+    ANALYSIS_JOB_STORE = os.getenv("ANALYSIS_JOB_STORE", "mongo")  # "mongo" or "memory"
+    ANALYSIS_MEMORY_JOB_LIMIT = int(os.getenv("ANALYSIS_MEMORY_JOB_LIMIT", "10000"))
+    ANALYSIS_MEMORY_JOB_TTL_SECONDS = int(os.getenv("ANALYSIS_MEMORY_JOB_TTL_SECONDS", str(24 * 3600)))
+    # A job queued or running this long was left behind by a worker that stopped; startup requeues it
+    ANALYSIS_JOB_RECOVERY_SECONDS = float(os.getenv("ANALYSIS_JOB_RECOVERY_SECONDS", "900"))
+    ANALYSIS_JOB_MAX_RECOVERIES = int(os.getenv("ANALYSIS_JOB_MAX_RECOVERIES", "2"))
+    ANALYSIS_WAIT_TIMEOUT = float(os.getenv("ANALYSIS_WAIT_TIMEOUT", "60"))
+    ANALYSIS_SERVICE_TIME_SECONDS = float(os.getenv("ANALYSIS_SERVICE_TIME_SECONDS", "10"))  # until jobs are observed
+    ANALYSIS_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("ANALYSIS_MAX_QUEUE_WAIT_SECONDS", "120"))
+    RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")  # "memory" (per process) or "mongo" (shared)
+    RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "6"))
+    RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "10"))
+    RATE_LIMIT_CONTEST_PER_MINUTE = float(os.getenv("RATE_LIMIT_CONTEST_PER_MINUTE", "300"))
+    RATE_LIMIT_CONTEST_BURST = float(os.getenv("RATE_LIMIT_CONTEST_BURST", "600"))
+    ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+    ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    SIMILARITY_KGRAM = int(os.getenv("SIMILARITY_KGRAM", "5"))
+    SIMILARITY_WINDOW = int(os.getenv("SIMILARITY_WINDOW", "4"))
+    MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+    LSH_BANDS = int(os.getenv("LSH_BANDS", "32"))
+    SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "5"))
+    SIMILARITY_MAX_INDEXES = int(os.getenv("SIMILARITY_MAX_INDEXES", "256"))
+    SIMILARITY_REFRESH_SECONDS = float(os.getenv("SIMILARITY_REFRESH_SECONDS", "5"))
+    STYLE_PROFILES_ENABLED = os.getenv("STYLE_PROFILES_ENABLED", "true").lower() == "true"
+    STYLE_MIN_SUBMISSIONS = int(os.getenv("STYLE_MIN_SUBMISSIONS", "3"))  # before drift is scored
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+    PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    # How often each worker picks up revocations made by other workers (their staleness bound)
+    PRINCIPAL_REVOCATION_SYNC_SECONDS = float(os.getenv("PRINCIPAL_REVOCATION_SYNC_SECONDS", "5"))
+    # Trust the signed `role` claim instead of re-reading it from users on every request
+    PRINCIPAL_TRUST_CLAIMS = os.getenv("PRINCIPAL_TRUST_CLAIMS", "true").lower() == "true"
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    ACCESS_LOG = os.getenv("ACCESS_LOG", "true").lower() == "true"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # /metrics requires "Authorization: Bearer <token>"
+    METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"  # serve /metrics without a token
+    # Create indexes before a process serves its first request when no lifespan startup ran (Mangum)
+    BOOTSTRAP_ON_FIRST_REQUEST = os.getenv("BOOTSTRAP_ON_FIRST_REQUEST", "true").lower() == "true"
+    FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "256"))  # events buffered per WebSocket before it is dropped
+    # Needs a root Linux worker (see sandbox_runner.py); without one every execution reports "Unavailable"
+    EXECUTION_ENABLED = os.getenv("EXECUTION_ENABLED", "false").lower() == "true"
+    EXECUTION_WORKERS = int(os.getenv("EXECUTION_WORKERS", str(os.cpu_count() or 2)))
+    EXECUTION_TIME_LIMIT_SECONDS = float(os.getenv("EXECUTION_TIME_LIMIT_SECONDS", "2"))
+    EXECUTION_MEMORY_LIMIT_MB = int(os.getenv("EXECUTION_MEMORY_LIMIT_MB", "256"))
+    EXECUTION_OUTPUT_LIMIT_KB = int(os.getenv("EXECUTION_OUTPUT_LIMIT_KB", "1024"))
+    EXECUTION_MAX_PROCESSES = int(os.getenv("EXECUTION_MAX_PROCESSES", "64"))
+    EXECUTION_COMPILE_TIMEOUT_SECONDS = float(os.getenv("EXECUTION_COMPILE_TIMEOUT_SECONDS", "15"))
+    EXECUTION_REQUIRE_NETWORK_ISOLATION = os.getenv("EXECUTION_REQUIRE_NETWORK_ISOLATION", "true").lower() == "true"
+    EXECUTION_TMP_DIR = os.getenv("EXECUTION_TMP_DIR")  # defaults to the system temp dir
+    EXECUTION_CACHE_SIZE = int(os.getenv("EXECUTION_CACHE_SIZE", "2048"))
+    EXECUTION_CACHE_TTL_SECONDS = int(os.getenv("EXECUTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+    CODE_BLOB_CODEC = os.getenv("CODE_BLOB_CODEC", "zstd")  # "zstd" (zlib without zstandard), "zlib" or "none"
+    CODE_BLOB_GRIDFS_THRESHOLD_KB = int(os.getenv("CODE_BLOB_GRIDFS_THRESHOLD_KB", "1024"))  # compressed size
+    CODE_BLOB_CACHE_SIZE = int(os.getenv("CODE_BLOB_CACHE_SIZE", "2048"))
+    CODE_BLOB_CACHE_BYTES = int(os.getenv("CODE_BLOB_CACHE_BYTES", str(64 * 1024 * 1024)))  # decoded bodies in memory
+    CONTEST_CACHE_SIZE = int(os.getenv("CONTEST_CACHE_SIZE", "1024"))
+    CONTEST_CACHE_TTL_SECONDS = float(os.getenv("CONTEST_CACHE_TTL_SECONDS", "5"))
+    CONTEST_CACHE_WATCH = os.getenv("CONTEST_CACHE_WATCH", "true").lower() == "true"
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # when set, X-Profile must carry this value
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/meridian-profiles")
 
 settings = Settings()
 
+# =========================
+# Logging & Metrics
+# =========================
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging() -> logging.Logger:
+    """JSON logs written by a background QueueListener so request handlers never block on stdout."""
+    log = logging.getLogger("meridian")
+    if log.handlers:
+        return log
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(settings.LOG_LEVEL)
+    log.propagate = False
+    return log
+
+logger = setup_logging()
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                out.append((f"{self.name}_bucket", labels + (("le", repr(bound)),), cumulative))
+            out.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), series[-1]))
+            out.append((f"{self.name}_sum", labels, series[-2]))
+            out.append((f"{self.name}_count", labels, series[-1]))
+        return out
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    @staticmethod
+    def _format_labels(metric: _Metric, labels: tuple) -> str:
+        pairs = []
+        for i, value in enumerate(labels):
+            if isinstance(value, tuple):
+                key, value = value
+            else:
+                key = metric.label_names[i]
+            escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{key}="{escaped}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{self._format_labels(metric, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+HTTP_LATENCY = metrics.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+HTTP_IN_FLIGHT = metrics.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"))
+MONGO_LATENCY = metrics.register(Histogram(
+    "mongo_operation_duration_seconds", "MongoDB command latency", ("collection", "command"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+MONGO_ERRORS = metrics.register(Counter(
+    "mongo_operation_errors_total", "Failed MongoDB commands", ("collection", "command")))
+LLM_LATENCY = metrics.register(Histogram(
+    "llm_request_duration_seconds", "LLM call latency including retries", ("purpose",)))
+LLM_TOKENS = metrics.register(Counter(
+    "llm_tokens_total", "LLM tokens consumed", ("purpose", "kind")))
+LLM_ERRORS = metrics.register(Counter(
+    "llm_errors_total", "Failed LLM calls", ("purpose",)))
+FEED_SUBSCRIBERS = metrics.register(Gauge(
+    "feed_subscribers", "Open live submission feed connections"))
+CONTEST_CACHE_REQUESTS = metrics.register(Counter(
+    "contest_cache_requests_total", "Contest cache lookups by result", ("result",)))
+ADMISSION_REJECTIONS = metrics.register(Counter(
+    "admission_rejections_total", "LLM-backed requests refused with 429, by reason", ("reason",)))
+INCREMENTAL_ANALYSES = metrics.register(Counter(
+    "incremental_analyses_total", "Resubmissions with a previous analysis, by outcome (reused, partial, full)",
+    ("outcome",)))
+CODE_BLOB_WRITES = metrics.register(Counter(
+    "code_blob_writes_total", "Code bodies stored, by result (stored or deduplicated)", ("result",)))
+CODE_BLOB_BYTES = metrics.register(Counter(
+    "code_blob_bytes_total", "Code bytes submitted (logical) and written (stored)", ("kind",)))
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command per collection. Runs on the driver's threads."""
+    def __init__(self):
+        self._inflight: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        with self._lock:
+            self._inflight[event.request_id] = (collection, event.command_name)
+
+    def _finished(self, event) -> tuple:
+        with self._lock:
+            return self._inflight.pop(event.request_id, ("-", event.command_name))
+
+    def succeeded(self, event):
+        collection, command = self._finished(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, command)
+
+    def failed(self, event):
+        collection, command = self._finished(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, command)
+        MONGO_ERRORS.inc(collection, command)
+
+def route_template(scope: dict) -> str:
+    """Route template (/contest/by-code/{code}) rather than the raw path, so label cardinality stays bounded."""
+    route_path = getattr(scope.get("route"), "path", None)
+    if route_path is None:
+        return "unmatched"
+    # Routes inside an included router only know their own path; the router prefix is whatever precedes it
+    segments = scope["path"].split("/")
+    return "/".join(segments[:len(segments) - route_path.count("/")]) + route_path
+
+class RequestMetricsMiddleware:
+    """Per-request metrics plus one structured access-log line.
+
+    Plain ASGI rather than @app.middleware("http"): BaseHTTPMiddleware wraps every
+    response in an extra task and stream, which costs more than the metrics themselves.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            route_path = route_template(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, route_path, str(status_code))
+            HTTP_LATENCY.observe(elapsed, method, route_path)
+            if settings.ACCESS_LOG and logger.isEnabledFor(logging.INFO):
+                logger.info("request", extra={"fields": {
+                    "method": method,
+                    "route": route_path,
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 2),
+                }})
+
+
+# =========================
+# Request Timing & Profiling
+# =========================
+_request_spans: contextvars.ContextVar = contextvars.ContextVar("request_spans", default=None)
+
+def record_span(name: str, seconds: float):
+    """Adds a phase duration to the current request's Server-Timing header; a no-op outside a request."""
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+@contextmanager
+def span(name: str):
+    if _request_spans.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+def server_timing_header(spans: List[tuple], total: float) -> str:
+    # Repeated phases (two users lookups, retried LLM calls) are summed under one name
+    totals: Dict[str, float] = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+class RequestProfiler:
+    """Per-request profile capture written to PROFILE_DIR for offline analysis.
+
+    pyinstrument (async-aware, HTML output) when installed, otherwise cProfile
+    (.prof, open with snakeviz or pstats). cProfile sees every coroutine on the loop,
+    so only one capture runs at a time.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._active = False
+
+    def wanted(self, headers: dict) -> bool:
+        if not settings.PROFILING_ENABLED or self._active:
+            return False
+        requested = headers.get(b"x-profile")
+        if requested is not None:
+            return not settings.PROFILE_TOKEN or requested.decode("latin-1") == settings.PROFILE_TOKEN
+        return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def start(self):
+        self._active = True
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode="enabled")
+        except ImportError:
+            profiler = cProfile.Profile()
+        profiler.enable() if isinstance(profiler, cProfile.Profile) else profiler.start()
+        return profiler
+
+    def stop(self, profiler, scope: dict) -> str:
+        """Stops the capture and returns the profile's file name."""
+        self._active = False
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{scope['method']}-{slug}"
+        os.makedirs(self.directory, exist_ok=True)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            name += ".prof"
+            profiler.dump_stats(os.path.join(self.directory, name))
+        else:
+            profiler.stop()
+            name += ".html"
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write(profiler.output_html())
+        return name
+
+request_profiler = RequestProfiler(settings.PROFILE_DIR)
+
+class ServerTimingMiddleware:
+    """Collects span() phases per request into a Server-Timing header, and runs opt-in profiles.
+
+    Headers go out with http.response.start, so phases that finish after the body
+    starts (streamed responses, background tasks) are not reported.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.SERVER_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        spans: List[tuple] = []
+        token = _request_spans.set(spans)
+        started = time.perf_counter()
+        profiler = request_profiler.start() if request_profiler.wanted(dict(scope["headers"])) else None
+        profile_name = None
+
+        async def send_wrapper(message):
+            nonlocal profile_name
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(spans, time.perf_counter() - started).encode()))
+                if profiler is not None:
+                    profile_name = request_profiler.stop(profiler, scope)
+                    headers.append((b"x-profile-id", profile_name.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_spans.reset(token)
+            if profiler is not None and profile_name is None:
+                request_profiler.stop(profiler, scope)
+
+
+class Bootstrap:
+    """Per-process startup: index creation and, on long-lived servers, analysis job recovery.
+
+    uvicorn runs it from the lifespan handler. The Mangum handler runs with lifespan
+    off, so BootstrapMiddleware runs the index half before the first request instead.
+    Job recovery is left to `python main.py recover-jobs` there: a frozen function
+    would only strand the requeued jobs again.
+    """
+    def __init__(self):
+        self.done = False
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def run(self, recover_jobs: bool):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.done:
+                return
+            await ensure_indexes()  # reports failures instead of raising
+            if recover_jobs:
+                try:
+                    await analysis_queue.recover(settings.ANALYSIS_JOB_RECOVERY_SECONDS,
+                                                 settings.ANALYSIS_JOB_MAX_RECOVERIES)
+                except Exception:
+                    logger.exception("Analysis job recovery failed")
+            self.done = True
+
+bootstrap = Bootstrap()
+
+class BootstrapMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not bootstrap.done and scope["type"] != "lifespan" and settings.BOOTSTRAP_ON_FIRST_REQUEST:
+            await bootstrap.run(recover_jobs=False)
+        await self.app(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await bootstrap.run(recover_jobs=True)
+    yield
+
 # =========================
 # FastAPI Application Setup - DEFINE APP ONCE
 # =========================
-app = FastAPI(title="Coding Contest Platform API with Plagiarism Detection")
+app = FastAPI(title="Coding Contest Platform API with Plagiarism Detection", lifespan=lifespan)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -57,99 +576,805 @@ app.add_middleware(
 #     return JSONResponse(content={"message": "Hello from FastAPI on Vercel!"})
 
 
-# Add your custom logging middleware next
-# app.add_middleware(LoggingMiddleware)
-# Debug middleware to log requests - using a simple middleware function instead of class
-# Replace this:
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    print(f"Request: {request.method} {request.url}")
-    response = await call_next(request)
-    print(f"Response Status: {response.status_code}")
-    return response
+app.add_middleware(BootstrapMiddleware)
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
 # =========================
 # Database Setup
 # =========================
 MONGODB_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("DB_NAME", "coding_platform")
 
-client = AsyncIOMotorClient(MONGODB_URI)
-db = client[DB_NAME]
+_client = None
+
+def get_client():
+    """The process-wide Motor client, created on first use.
+
+    Module state survives between warm serverless invocations, so a container pays
+    for the client (URI parsing, mongodb+srv lookups, connection pool) once, and
+    invocations that never touch the database do not pay for it at all.
+    """
+    global _client
+    if _client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[MongoMetricsListener()])
+        init_db()
+    return _client
+
+class LazyDatabase:
+    """Handle for `get_client()[name]` that defers creating the client until it is used."""
+    def __init__(self, name: str):
+        self.name = name
+
+    def resolve(self):
+        return get_client()[self.name]
+
+    def __getitem__(self, name: str) -> "LazyCollection":
+        return LazyCollection(self, name)
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+class LazyCollection:
+    """Collection handle bound at import time; resolves to the Motor collection on first use."""
+    def __init__(self, database: LazyDatabase, name: str):
+        self._database = database
+        self.name = name
+        self._collection = None
+
+    def __getattr__(self, attr):
+        if self._collection is None:
+            self._collection = self._database.resolve()[self.name]
+        return getattr(self._collection, attr)
+
+db = LazyDatabase(DB_NAME)
 
 # Database collections
 users_collection = db["users"]
 contests_collection = db["contests"]
 submissions_collection = db["submissions"]
 codes_collection = db["codes"]  # For plagiarism check submissions
+analysis_cache_collection = db["analysis_cache"]  # Content-addressed LLM analyses
+similarity_collection = db["submission_fingerprints"]  # MinHash signatures per submission
+llm_usage_collection = db["llm_usage"]  # Token usage and latency per LLM call
+execution_cache_collection = db["execution_results"]  # Test-case verdicts keyed by (code, test set)
+question_tests_collection = db["question_tests"]  # Hidden test cases, kept out of contest documents
+code_blobs_collection = db["code_blobs"]  # Compressed code bodies keyed by content hash
+rate_limits_collection = db["rate_limits"]  # Token buckets shared by workers (RATE_LIMIT_STORE=mongo)
+style_profiles_collection = db["style_profiles"]  # Running stylometry feature sums per student and language
+contest_stats_collection = db["contest_stats"]  # Submission/analysis counters per contest and question
+contest_participants_collection = db["contest_participants"]  # Questions each student has submitted to
+token_revocations_collection = db["token_revocations"]  # Per-user cutoff: tokens issued earlier are rejected
 
 def get_db():
     return db
 
 def init_db():
-    print("Database initialized")
+    logger.info("Database initialized")
+
+# =========================
+# Index Bootstrap
+# =========================
+# One entry per collection; every filter/sort the routers issue must be covered (see QUERY_SHAPES)
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "contests": [
+        IndexModel([("contest_code", ASCENDING)], unique=True, name="contest_code_unique"),
+        IndexModel([("is_active", ASCENDING), ("_id", ASCENDING)], name="is_active_id"),
+        IndexModel([("teacher_email", ASCENDING), ("_id", ASCENDING)], name="teacher_email_id"),
+    ],
+    "submissions": [
+        IndexModel([("contest_id", ASCENDING), ("_id", ASCENDING)], name="contest_id_id"),
+        IndexModel([("contest_id", ASCENDING), ("student_email", ASCENDING), ("_id", ASCENDING)],
+                   name="contest_id_student_email_id"),
+    ],
+    "submission_fingerprints": [
+        IndexModel([("contest_id", ASCENDING), ("question_title", ASCENDING), ("_id", ASCENDING)],
+                   name="contest_id_question_title_id"),
+    ],
+    "style_profiles": [
+        IndexModel([("student_email", ASCENDING), ("language", ASCENDING), ("version", ASCENDING)], unique=True,
+                   name="student_email_language_version_unique"),
+    ],
+    "contest_participants": [
+        IndexModel([("_id.contest_id", ASCENDING)], name="contest_id"),
+    ],
+    "codes": [
+        IndexModel([("submission_id", ASCENDING)], name="submission_id"),
+        IndexModel([("submitter_email", ASCENDING), ("assignment_id", ASCENDING), ("_id", ASCENDING)],
+                   name="submitter_email_assignment_id_id"),
+        IndexModel([("status", ASCENDING), ("queued_at", ASCENDING)], name="status_queued_at"),
+        IndexModel([("status", ASCENDING), ("started_at", ASCENDING)], name="status_started_at"),
+    ],
+    "analysis_cache": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "execution_results": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "question_tests": [
+        # Partial so it builds before migrate-question-tests has keyed the title-keyed documents
+        IndexModel([("contest_id", ASCENDING), ("question_id", ASCENDING)], unique=True,
+                   partialFilterExpression={"question_id": {"$exists": True}}, name="contest_id_question_id_unique"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "llm_usage": [
+        IndexModel([("contest_id", ASCENDING), ("created_at", ASCENDING)], name="contest_id_created_at"),
+    ],
+    "token_revocations": [
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+}
+
+# Representative query shapes issued by the routers: (collection, filter, sort)
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+QUERY_SHAPES = [
+    ("users", {"email": "student@example.com"}, None),
+    ("users", {"email": "student@example.com", "role": "student"}, None),
+    ("contests", {"_id": _SAMPLE_ID}, None),
+    ("contests", {"_id": _SAMPLE_ID, "teacher_email": "teacher@example.com"}, None),
+    ("contests", {"contest_code": "ABC123"}, None),
+    ("contests", {}, [("_id", ASCENDING)]),
+    ("contests", {"is_active": True}, [("_id", ASCENDING)]),
+    ("contests", {"is_active": True, "_id": {"$gt": _SAMPLE_ID}}, [("_id", ASCENDING)]),
+    ("contests", {"teacher_email": "teacher@example.com"}, [("_id", ASCENDING)]),
+    ("submissions", {"contest_id": str(_SAMPLE_ID)}, [("_id", ASCENDING)]),
+    ("submissions", {"contest_id": str(_SAMPLE_ID), "_id": {"$gt": _SAMPLE_ID}}, [("_id", ASCENDING)]),
+    ("submissions", {"contest_id": str(_SAMPLE_ID), "student_email": "student@example.com"}, [("_id", ASCENDING)]),
+    ("codes", {"_id": _SAMPLE_ID}, None),
+    ("codes", {"submission_id": {"$in": [str(_SAMPLE_ID)]}}, None),
+    ("codes", {"submitter_email": "student@example.com", "assignment_id": f"{_SAMPLE_ID}_Q1",
+               "status": "completed"}, [("_id", -1)]),
+    ("codes", {"$or": [{"status": "queued", "queued_at": {"$lt": datetime(2000, 1, 1)}},
+                       {"status": "running", "started_at": {"$lt": datetime(2000, 1, 1)}}]}, None),
+    ("analysis_cache", {"_id": "0" * 64}, None),
+    ("execution_results", {"_id": "0" * 64}, None),
+    ("question_tests", {"contest_id": str(_SAMPLE_ID), "question_id": "q1"}, None),
+    ("llm_usage", {"contest_id": str(_SAMPLE_ID)}, None),
+    ("style_profiles", {"student_email": "student@example.com", "language": "python", "version": 1}, None),
+    ("submission_fingerprints", {"contest_id": str(_SAMPLE_ID), "question_title": "Q1",
+                                 "_id": {"$gt": _SAMPLE_ID}}, [("_id", ASCENDING)]),
+    ("token_revocations", {"revoked_at": {"$gt": 0.0}}, None),
+]
+
+async def ensure_indexes(database=None) -> Dict[str, List[str]]:
+    """Create every index in INDEX_SPECS. Safe to run repeatedly; failures are reported, not raised."""
+    database = database if database is not None else db
+    created = {}
+    for collection_name, indexes in INDEX_SPECS.items():
+        try:
+            created[collection_name] = await database[collection_name].create_indexes(indexes)
+        except Exception as e:
+            logger.error("Failed to create indexes", extra={"fields": {"collection": collection_name, "error": str(e)}})
+            created[collection_name] = []
+    return created
+
+def _plan_stages(plan: dict):
+    """Yield every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def audit_query_plans(database=None) -> List[dict]:
+    """Explain every query shape in QUERY_SHAPES and report the winning plan's stages."""
+    database = database if database is not None else db
+    report = []
+    for collection_name, query, sort in QUERY_SHAPES:
+        cursor = database[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        planner = explain.get("queryPlanner", {})
+        stages = list(_plan_stages(planner.get("winningPlan", {})))
+        stats = explain.get("executionStats", {})
+        report.append({
+            "collection": collection_name,
+            "filter": query,
+            "sort": sort,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "execution_time_ms": stats.get("executionTimeMillis"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "keys_examined": stats.get("totalKeysExamined"),
+        })
+    return report
+
+async def run_index_audit() -> int:
+    await ensure_indexes()
+    report = await audit_query_plans()
+    failures = 0
+    for row in report:
+        status_label = "COLLSCAN" if row["collscan"] else "ok"
+        if row["collscan"]:
+            failures += 1
+        print(f"[{status_label:>8}] {row['collection']:<24} {json.dumps(row['filter'], default=str)}"
+              f" sort={row['sort']} stages={'>'.join(row['stages'])}"
+              f" time={row['execution_time_ms']}ms docs={row['docs_examined']} keys={row['keys_examined']}")
+    print(f"{len(report)} query shapes audited, {failures} collection scan(s)")
+    return 1 if failures else 0
 
 # =========================
 # OpenAI Setup
 # =========================
-try:
-    from openai import AzureOpenAI
-    
-    openai_api_key = settings.OPENAI_API_KEY
-    openai_endpoint = settings.OPENAI_ENDPOINT
-    openai_api_version = settings.OPENAI_API_VERSION
-    
-    if all([openai_api_key, openai_endpoint, openai_api_version]):
-        openai_client = AzureOpenAI(
-            api_key=openai_api_key,
-            api_version=openai_api_version,
-            azure_endpoint=openai_endpoint
+# The SDK is the largest import in the app (most of a cold start), so it is loaded
+# by the first LLM call rather than at import
+openai = None
+OPENAI_SDK_INSTALLED = importlib.util.find_spec("openai") is not None
+
+def _load_openai():
+    global openai
+    if openai is None:
+        import openai as sdk
+        openai = sdk
+    return openai
+
+class LLMUnavailableError(Exception):
+    """The upstream model is degraded (circuit open or retries exhausted); callers should fall back."""
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds lets one trial call through."""
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._trials = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            self._trials += 1
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    @property
+    def current_trial(self) -> Optional[int]:
+        """Token for the trial call in flight, if any; pass it back to `abandon_trial`."""
+        return self._trials if self._trial_in_flight else None
+
+    def abandon_trial(self, trial: int):
+        """The trial call ended without a verdict (cancelled); the next call becomes the trial."""
+        if self._trial_in_flight and self._trials == trial:
+            self._trial_in_flight = False
+
+class LLMUsageRecorder:
+    """Token usage and latency per LLM call.
+
+    Keeps running totals per contest in memory and writes one llm_usage document per
+    call in the background, so recording never delays the response.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.totals: Dict[str, dict] = {}
+        self._pending: set = set()
+
+    def record(self, entry: dict):
+        key = entry.get("contest_id") or "_none"
+        totals = self.totals.setdefault(key, {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms_total": 0.0
+        })
+        totals["calls"] += 1
+        totals["errors"] += 1 if entry.get("error") else 0
+        totals["prompt_tokens"] += entry.get("prompt_tokens") or 0
+        totals["completion_tokens"] += entry.get("completion_tokens") or 0
+        totals["latency_ms_total"] += entry.get("latency_ms") or 0.0
+
+        task = asyncio.create_task(self._write(dict(entry, created_at=datetime.utcnow())))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _write(self, entry: dict):
+        try:
+            await self.collection.insert_one(entry)
+        except Exception as e:
+            logger.warning("Failed to record LLM usage", extra={"fields": {"error": str(e)}})
+
+llm_usage_recorder = LLMUsageRecorder(llm_usage_collection)
+
+class LLMService:
+    """Single async entry point for Azure OpenAI chat completions.
+
+    Shares one pooled HTTP transport, bounds concurrency with a semaphore, applies a
+    per-call timeout, retries 429/5xx/timeouts with jittered exponential backoff and
+    trips a circuit breaker when the upstream keeps failing.
+    """
+    def __init__(self, api_key, endpoint, api_version, deployment, timeout: float, max_retries: int,
+                 backoff_base: float, backoff_max: float, max_concurrency: int, pool_size: int,
+                 breaker_threshold: int, breaker_cooldown: float):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.api_version = api_version
+        self.deployment = deployment
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def available(self) -> bool:
+        return OPENAI_SDK_INSTALLED and all([self.api_key, self.endpoint, self.api_version])
+
+    def _ensure_client(self):
+        # The HTTP pool and semaphore belong to the running loop, so rebuild them if it changes
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._loop is loop:
+            return
+        import httpx
+        sdk = _load_openai()
+        http_client = sdk.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            timeout=httpx.Timeout(self.timeout, connect=min(10.0, self.timeout)),
         )
-        print("Azure OpenAI client initialized successfully!")
-    else:
-        openai_client = None
-        print("OpenAI environment variables missing - AI features disabled")
-except Exception as e:
-    print(f"Error initializing OpenAI: {e}")
-    openai_client = None
+        self._client = sdk.AsyncAzureOpenAI(
+            api_key=self.api_key,
+            api_version=self.api_version,
+            azure_endpoint=self.endpoint,
+            http_client=http_client,
+            max_retries=0,  # retries are handled here so they share the breaker and semaphore
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop = loop
+
+    @staticmethod
+    def _is_retryable(exc: Exception) -> bool:
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+            return True
+        if isinstance(exc, openai.APIStatusError):
+            return exc.status_code == 429 or exc.status_code >= 500
+        return False
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        response = getattr(exc, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: uniform over [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record_usage(self, usage_context: Optional[dict], started: float, messages: List[dict],
+                      usage=None, completion_text: Optional[str] = None, error: Optional[str] = None):
+        elapsed = time.perf_counter() - started
+        purpose = (usage_context or {}).get("purpose", "other")
+        entry = dict(usage_context or {}, model=self.deployment, prompt_version=PROMPT_VERSION,
+                     latency_ms=round(elapsed * 1000, 1), error=error)
+        if usage is not None:
+            entry.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                         usage_estimated=False)
+        elif error is None:
+            # Streams without a usage chunk are counted locally
+            entry.update(prompt_tokens=sum(count_tokens(m["content"]) for m in messages),
+                         completion_tokens=count_tokens(completion_text or ""), usage_estimated=True)
+
+        LLM_LATENCY.observe(elapsed, purpose)
+        record_span("llm", elapsed)
+        if error:
+            LLM_ERRORS.inc(purpose)
+        else:
+            LLM_TOKENS.inc(purpose, "prompt", amount=entry["prompt_tokens"])
+            LLM_TOKENS.inc(purpose, "completion", amount=entry["completion_tokens"])
+        if usage_context is not None:
+            llm_usage_recorder.record(entry)
+
+    async def chat(self, messages: List[dict], usage_context: Optional[dict] = None, **kwargs):
+        """One chat completion. `usage_context` (purpose, contest_id, ...) is recorded with the call's usage."""
+        if not self.available:
+            raise LLMUnavailableError("OpenAI is not configured")
+        if not self.breaker.allow():
+            raise LLMUnavailableError("OpenAI circuit breaker is open")
+
+        # Set right after allow() only for the half-open trial call
+        trial = self.breaker.current_trial
+        try:
+            return await self._chat(messages, usage_context, **kwargs)
+        finally:
+            # Cancellation (client gone, wait_for timeout) skips record_success/record_failure;
+            # a trial left in flight would keep the breaker half-open and refusing forever
+            if trial is not None:
+                self.breaker.abandon_trial(trial)
+
+    async def _chat(self, messages: List[dict], usage_context: Optional[dict], **kwargs):
+        self._ensure_client()
+        started = time.perf_counter()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await self._client.chat.completions.create(
+                        model=self.deployment,
+                        messages=messages,
+                        timeout=self.timeout,
+                        **kwargs
+                    )
+                self.breaker.record_success()
+                self._record_usage(usage_context, started, messages, usage=getattr(response, "usage", None))
+                return response
+            except Exception as e:
+                if not self._is_retryable(e):
+                    # Client errors say nothing about upstream health: the breaker is left as it
+                    # was, and chat() releases a half-open trial so the next call probes instead
+                    self._record_usage(usage_context, started, messages, error=str(e))
+                    raise
+                last_error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt, e))
+
+        self.breaker.record_failure()
+        self._record_usage(usage_context, started, messages, error=str(last_error))
+        raise LLMUnavailableError(f"OpenAI unavailable after {self.max_retries + 1} attempts: {last_error}")
+
+    async def stream_chat(self, messages: List[dict], usage_context: Optional[dict] = None, **kwargs):
+        """Async generator of content deltas. Retries apply only until the stream is open."""
+        if not self.available:
+            raise LLMUnavailableError("OpenAI is not configured")
+        if not self.breaker.allow():
+            raise LLMUnavailableError("OpenAI circuit breaker is open")
+
+        trial = self.breaker.current_trial
+        deltas = self._stream_chat(messages, usage_context, **kwargs)
+        try:
+            async for delta in deltas:
+                yield delta
+        finally:
+            # Also runs on GeneratorExit when the SSE client disconnects mid-stream
+            await deltas.aclose()
+            if trial is not None:
+                self.breaker.abandon_trial(trial)
+
+    async def _stream_chat(self, messages: List[dict], usage_context: Optional[dict], **kwargs):
+        self._ensure_client()
+        started = time.perf_counter()
+        stream = None
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            await self._semaphore.acquire()
+            try:
+                stream = await self._client.chat.completions.create(
+                    model=self.deployment,
+                    messages=messages,
+                    timeout=self.timeout,
+                    stream=True,
+                    **kwargs
+                )
+                break
+            except Exception as e:
+                self._semaphore.release()
+                if not self._is_retryable(e):
+                    self._record_usage(usage_context, started, messages, error=str(e))
+                    raise
+                last_error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt, e))
+
+        if stream is None:
+            self.breaker.record_failure()
+            self._record_usage(usage_context, started, messages, error=str(last_error))
+            raise LLMUnavailableError(f"OpenAI unavailable after {self.max_retries + 1} attempts: {last_error}")
+
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                # Azure sends a leading chunk with no choices (content filter results)
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            self.breaker.record_success()
+            self._record_usage(usage_context, started, messages, usage=usage, completion_text="".join(parts))
+        except Exception as e:
+            self.breaker.record_failure()
+            self._record_usage(usage_context, started, messages, error=str(e))
+            raise
+        finally:
+            self._semaphore.release()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    pass
+
+    def status(self) -> dict:
+        return {
+            "available": self.available,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "max_concurrency": self.max_concurrency,
+        }
+
+llm_service = LLMService(
+    api_key=settings.OPENAI_API_KEY,
+    endpoint=settings.OPENAI_ENDPOINT,
+    api_version=settings.OPENAI_API_VERSION,
+    deployment=settings.OPENAI_DEPLOYMENT_NAME,
+    timeout=settings.OPENAI_TIMEOUT_SECONDS,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+    backoff_base=settings.OPENAI_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.OPENAI_BACKOFF_MAX_SECONDS,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+    pool_size=settings.OPENAI_POOL_SIZE,
+    breaker_threshold=settings.OPENAI_BREAKER_THRESHOLD,
+    breaker_cooldown=settings.OPENAI_BREAKER_COOLDOWN_SECONDS,
+)
+if llm_service.available:
+    logger.info("Azure OpenAI client configured successfully!")
+else:
+    logger.warning("OpenAI environment variables missing - AI features disabled")
 
 # =========================
 # Security Functions
 # =========================
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min/max to the configured cost makes verify_and_update() flag hashes made
+# with any other cost, so changing BCRYPT_ROUNDS upgrades users as they log in
+_pwd_context = None
+
+def get_pwd_context():
+    # passlib is only needed by signup and login, so it is imported on first use
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+            bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+            bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+        )
+    return _pwd_context
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+class PasswordHasher:
+    """Runs bcrypt in a dedicated thread pool so logins never block the event loop.
+
+    At most `queue_limit` operations may be pending; beyond that callers get a 503
+    with Retry-After instead of piling up behind a login storm.
+    """
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.queue_limit:
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service busy, please retry",
+                headers={"Retry-After": "1"}
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_pwd_context().hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+        return await self._run(get_pwd_context().verify_and_update, password, hashed_password)
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+class PrincipalCache:
+    """Verified token -> principal, bounded by size and TTL (never beyond the token's own expiry).
+
+    revoke() must be called wherever a user's role changes or the account is deleted:
+    it drops cached entries and rejects tokens issued before the call. Revocations are
+    written to `revocations` (one cutoff per user, kept for a token lifetime) and every
+    worker pulls new ones at most `sync_seconds` apart, on its next request. Another
+    worker can therefore keep honouring a revoked token, cached or not, for up to
+    `sync_seconds`; the revoking worker stops at once.
+    """
+    # Re-read this far back on each sync: a revocation written by a worker with a lagging
+    # clock, or committed after a later one was read, is still picked up
+    SYNC_OVERLAP_SECONDS = 60.0
+
+    def __init__(self, max_entries: int, ttl_seconds: float, revocations=None, sync_seconds: float = 5.0,
+                 token_lifetime_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.revocations = revocations
+        self.sync_seconds = sync_seconds
+        self.token_lifetime_seconds = token_lifetime_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_email: Dict[str, set] = {}
+        self._revoked_at: Dict[str, float] = {}
+        self._next_sync = float("-inf")
+        self._synced_through = 0.0
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        principal, expires_at = entry
+        if expires_at <= time.time():
+            self._drop(token)
+            return None
+        self._entries.move_to_end(token)
+        return principal
+
+    def put(self, token: str, principal: dict, token_exp: Optional[float] = None):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        self._entries[token] = (principal, expires_at)
+        self._entries.move_to_end(token)
+        self._tokens_by_email.setdefault(principal["email"], set()).add(token)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        email = entry[0]["email"]
+        tokens = self._tokens_by_email.get(email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[email]
+
+    def invalidate_user(self, email: str, revoked_at: Optional[float] = None):
+        """Local half of revoke(); also applies revocations synced from other workers."""
+        for token in list(self._tokens_by_email.get(email, ())):
+            self._drop(token)
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        self._revoked_at[email] = max(revoked_at, self._revoked_at.get(email, revoked_at))
+
+    async def revoke(self, email: str):
+        revoked_at = time.time()
+        self.invalidate_user(email, revoked_at)
+        if self.revocations is None:
+            return
+        # Tokens issued before the cutoff are all expired once a token lifetime has passed
+        await self.revocations.update_one(
+            {"_id": email},
+            {"$max": {"revoked_at": revoked_at},
+             "$set": {"expires_at": datetime.utcnow() + timedelta(seconds=self.token_lifetime_seconds)}},
+            upsert=True
+        )
+
+    async def sync(self):
+        """Apply revocations made by other workers, if the last sync is `sync_seconds` old."""
+        if self.revocations is None or time.monotonic() < self._next_sync:
+            return
+        # Claimed before awaiting, so concurrent requests do not all query
+        self._next_sync = time.monotonic() + self.sync_seconds
+        since = self._synced_through - self.SYNC_OVERLAP_SECONDS
+        try:
+            async for doc in self.revocations.find({"revoked_at": {"$gt": since}}, {"revoked_at": 1}):
+                self.invalidate_user(doc["_id"], doc["revoked_at"])
+                self._synced_through = max(self._synced_through, doc["revoked_at"])
+        except Exception as e:
+            logger.warning("Token revocation sync failed", extra={"fields": {"error": str(e)}})
+
+    def is_revoked(self, email: str, issued_at: Optional[float]) -> bool:
+        revoked_at = self._revoked_at.get(email)
+        if revoked_at is None:
+            return False
+        # iat has one-second resolution; a token from the revocation second itself stays valid
+        return issued_at is None or float(issued_at) < int(revoked_at)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_email.clear()
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS,
+                                 token_revocations_collection, settings.PRINCIPAL_REVOCATION_SYNC_SECONDS,
+                                 settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+async def invalidate_principal(email: str):
+    """Call after changing a user's role or deleting the account; every worker honours it within the sync interval."""
+    await principal_cache.revoke(email)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await resolve_principal(token)
+
+async def resolve_principal(token: str) -> dict:
+    """{"email", "role"} for a bearer token; raises 401 when it is invalid or revoked."""
+    await principal_cache.sync()
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return dict(principal)
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        with span("jwt"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = await users_collection.find_one({"email": email})
-    if user is None:
+
+    if principal_cache.is_revoked(email, payload.get("iat")):
         raise credentials_exception
-    
-    return {"email": email, "role": user["role"]}
+
+    # The role claim is signed by create_access_token; only older tokens need the users lookup
+    role = payload.get("role") if settings.PRINCIPAL_TRUST_CLAIMS else None
+    if role is None:
+        with span("users"):
+            user = await users_collection.find_one({"email": email}, {"role": 1})
+        if user is None:
+            raise credentials_exception
+        role = user["role"]
+
+    principal = {"email": email, "role": role}
+    principal_cache.put(token, principal, payload.get("exp"))
+    return dict(principal)
     
 # =========================
 # Helper Functions
@@ -164,6 +1389,7 @@ def generate_mock_analysis(code, language):
         "confidence_score": 75,
         "likely_source": "Original student work",
         "explanation": "This is a mock analysis as OpenAI is unavailable",
+        "analysis_mode": "mock",
         "suspicious_elements": [],
         "red_flags": [],
         "verification_questions": ["Can you explain how this code works?"],
@@ -190,6 +1416,177 @@ def generate_mock_analysis(code, language):
         }
     }
 
+def _brackets_balanced(code: str) -> bool:
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack = []
+    for ch in code:
+        if ch in "([{":
+            stack.append(ch)
+        elif ch in pairs:
+            if not stack or stack.pop() != pairs[ch]:
+                return False
+    return not stack
+
+# Heuristic analysis used when the LLM is degraded - no plagiarism verdict, just cheap metrics
+def generate_local_analysis(code, language, reason=""):
+    lines = code.splitlines()
+    non_empty = [l for l in lines if l.strip()]
+    comment_prefixes = ("#", "//", "/*", "*", "--")
+    comment_lines = [l for l in non_empty if l.strip().startswith(comment_prefixes)]
+    comment_ratio = len(comment_lines) / len(non_empty) if non_empty else 0.0
+    long_lines = [l for l in non_empty if len(l) > 100]
+    max_indent = max((len(l) - len(l.lstrip()) for l in non_empty), default=0)
+
+    if (language or "").lower() in ("python", "py"):
+        try:
+            import ast
+            ast.parse(code)
+            is_valid = True
+        except SyntaxError:
+            is_valid = False
+    else:
+        is_valid = bool(non_empty) and _brackets_balanced(code)
+
+    suggestions = []
+    score = 8.0
+    if comment_ratio < 0.05:
+        score -= 1.0
+        suggestions.append("Add comments explaining the non-obvious parts")
+    if long_lines:
+        score -= 0.5
+        suggestions.append(f"{len(long_lines)} line(s) exceed 100 characters")
+    if max_indent > 16:
+        score -= 1.0
+        suggestions.append("Deep nesting - consider extracting helper functions")
+
+    return {
+        "is_valid_code": is_valid,
+        "plagiarism_detected": False,
+        "confidence_score": 0,
+        "likely_source": "Undetermined",
+        "explanation": "AI analysis is temporarily unavailable; only local heuristics were applied."
+                       + (f" ({reason})" if reason else ""),
+        "analysis_mode": "local_fallback",
+        "suspicious_elements": [],
+        "red_flags": [],
+        "verification_questions": ["Can you explain how this code works?"],
+        "recommendations": suggestions,
+        "evaluation_metrics": {
+            "code_correctness": {
+                "status": "Passed" if is_valid else "Failed",
+                "test_cases": "0",
+                "failed_cases": "0"
+            },
+            "code_efficiency": {
+                "time_complexity": "Unknown",
+                "memory_usage": "Unknown",
+                "execution_time": "Unknown"
+            },
+            "code_security": {
+                "issues_found": [],
+                "recommendations": []
+            },
+            "code_readability": {
+                "score": max(score, 0.0),
+                "suggestions": suggestions
+            }
+        }
+    }
+
+# =========================
+# List Endpoint Helpers
+# =========================
+# List endpoints page with a keyset on _id: ObjectIds are created at insert time, so
+# _id order is submission order and "next page" is a single index range scan.
+#
+# Their responses skip FastAPI's jsonable_encoder: documents come off the cursor as
+# dicts (decoded by the bson C extension), get their `_id` renamed, and are encoded
+# once by render_json, which handles datetimes and ObjectIds itself.
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):  # orjson encodes datetimes natively
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def render_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default)
+    return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return render_json(content)
+
+def serialize_doc(doc: dict) -> dict:
+    """Expose `_id` as a string `id`; everything else is left to render_json."""
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+def build_projection(fields: Optional[str], exclude: Optional[str]) -> Optional[dict]:
+    """Turn `fields=a,b` (include) or `exclude=c,d` into a Mongo projection; _id is always kept."""
+    include = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    omit = [f.strip() for f in (exclude or "").split(",") if f.strip() and f.strip() != "_id"]
+    if include and omit:
+        raise HTTPException(status_code=400, detail="Use either fields or exclude, not both")
+    if include:
+        return {f: 1 for f in include}
+    if omit:
+        return {f: 0 for f in omit}
+    return None
+
+async def _ndjson_lines(cursor, hydrate=None, batch_size: int = 100):
+    if hydrate is None:
+        async for doc in cursor:
+            yield render_json(serialize_doc(doc)) + b"\n"
+        return
+    while True:
+        docs = await cursor.to_list(length=batch_size)
+        if not docs:
+            return
+        for doc in await hydrate(docs):
+            yield render_json(serialize_doc(doc)) + b"\n"
+
+async def list_documents(collection, query: dict, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         fields: Optional[str] = None, exclude: Optional[str] = None, format: str = "json",
+                         hydrate=None):
+    """Shared implementation of the list endpoints.
+
+    - no `limit`: the full list, as before
+    - `limit`: {"items": [...], "next_cursor": "<id or null>"}; pass next_cursor back as `cursor`
+    - json responses are returned already rendered (FastJSONResponse)
+    - `format=ndjson`: one JSON document per line, streamed as the cursor yields them
+    - `hydrate`: `async hydrate(docs) -> docs`, applied to each batch before serialization
+    """
+    query = dict(query)
+    if cursor:
+        if not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(cursor)}
+
+    db_cursor = collection.find(query, build_projection(fields, exclude)).sort("_id", ASCENDING)
+    if limit:
+        # Fetch one extra document to know whether another page exists
+        db_cursor = db_cursor.limit(limit + 1)
+
+    if format == "ndjson":
+        if limit:
+            db_cursor = db_cursor.limit(limit)
+        return StreamingResponse(_ndjson_lines(db_cursor, hydrate), media_type="application/x-ndjson")
+
+    docs = await db_cursor.to_list(length=None)
+    has_more = bool(limit) and len(docs) > limit
+    if limit:
+        docs = docs[:limit]
+    if hydrate is not None:
+        docs = await hydrate(docs)
+    if not limit:
+        return FastJSONResponse([serialize_doc(d) for d in docs])
+
+    next_cursor = str(docs[-1]["_id"]) if has_more else None
+    return FastJSONResponse({"items": [serialize_doc(d) for d in docs], "next_cursor": next_cursor})
+
 # =========================
 # Model Classes
 # =========================
@@ -198,15 +1595,16 @@ class UserModel(BaseModel):
     username: str
     hashed_password: str
     role: Literal["teacher", "student"]
-    created_at: datetime = datetime.utcnow()
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class SubmissionModel(BaseModel):
     contest_id: str
     student_email: str
     question_title: str
-    code: str
+    question_id: Optional[str] = None
+    code_hash: str  # body lives in code_blobs
     language: str
-    submitted_at: datetime = datetime.utcnow()
+    submitted_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ContestModel(BaseModel):
     teacher_email: str
@@ -215,15 +1613,25 @@ class ContestModel(BaseModel):
     contest_code: str = Field(default_factory=generate_code)
     is_active: bool = False
     questions: List[dict] = []
+    question_revision: int = 0  # bumped by every write to `questions`
+
+def new_question_id() -> str:
+    return str(ObjectId())
 
 # =========================
 # Schema Classes
 # =========================
+class TestCase(BaseModel):
+    input: str
+    output: str
+
 class Question(BaseModel):
+    id: Optional[str] = None  # assigned on creation when omitted; stable across renames
     title: str
     description: str
     sample_input: str
     sample_output: str
+    test_cases: List[TestCase] = []  # hidden; never returned with the contest
 
 class ContestCreate(BaseModel):
     title: str
@@ -243,10 +1651,17 @@ class QuestionCreate(BaseModel):
     description: str
     sample_input: str
     sample_output: str
+    test_cases: List[TestCase] = []
+
+class QuestionBulkUpsert(BaseModel):
+    contest_id: str
+    # Matched by id when given, else by title; unmatched questions are appended
+    questions: List[Question]
 
 class SubmissionCreate(BaseModel):
     contest_id: str
-    question_title: str
+    question_title: Optional[str] = None
+    question_id: Optional[str] = None  # either one identifies the question
     code: str
     language: str
 
@@ -281,14 +1696,3179 @@ class Token(BaseModel):
     role: str
     email: str
 
-class CodeSubmission(BaseModel):
-    code: str
-    language: str
-    course_level: Optional[str] = None
-    assignment_description: Optional[str] = None
-    student_id: Optional[str] = None
-    assignment_id: Optional[str] = None
-    previous_submissions: Optional[List[str]] = None
+class CodeSubmission(BaseModel):
+    code: str
+    language: str
+    course_level: Optional[str] = None
+    assignment_description: Optional[str] = None
+    student_id: Optional[str] = None
+    assignment_id: Optional[str] = None
+    previous_submissions: Optional[List[str]] = None
+
+# =========================
+# Plagiarism Analysis
+# =========================
+def count_tokens(text: str) -> int:
+    """Local token count: tiktoken when installed, otherwise a word/punctuation estimate."""
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # BPE vocabularies split long identifiers; roughly one token per 4 characters of a word
+    return sum(max(1, (len(piece) + 3) // 4) for piece in _TOKEN_ESTIMATE_RE.findall(text))
+
+_TOKEN_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+_token_encoding = None
+_token_encoding_loaded = False
+
+def _get_token_encoding():
+    global _token_encoding, _token_encoding_loaded
+    if not _token_encoding_loaded:
+        _token_encoding_loaded = True
+        try:
+            import tiktoken
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _token_encoding = None
+    return _token_encoding
+
+class PromptTemplate:
+    """A named, versioned prompt parsed once at import; render() only substitutes values."""
+    def __init__(self, name: str, version: str, text: str):
+        self.name = name
+        self.version = version
+        self._template = string.Template(text)
+        self.placeholders = sorted({m.group("named") or m.group("braced")
+                                    for m in self._template.pattern.finditer(text)
+                                    if m.group("named") or m.group("braced")})
+        self._static_tokens: Optional[int] = None
+
+    @property
+    def static_tokens(self) -> int:
+        """Tokens contributed by the template text itself, excluding substituted values."""
+        # Counted on first use: loading the tokenizer is too slow for import time
+        if self._static_tokens is None:
+            self._static_tokens = count_tokens(self._template.safe_substitute({p: "" for p in self.placeholders}))
+        return self._static_tokens
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def render(self, **values) -> str:
+        return self._template.substitute(values)
+
+PLAGIARISM_SYSTEM_TEMPLATE = PromptTemplate("plagiarism-system", "1", """
+You are an advanced, highly trained AI model specialized in detecting plagiarism in code submissions. Your expertise includes identifying AI-generated code, copied code from online sources, and assessing the originality of student work. Your analysis must be thorough, precise, and context-aware. Follow these guidelines:
+
+---
+
+### *Key Responsibilities*
+
+1. *Validate Input*:
+   - Check if the input is valid code in the specified programming language.
+   - If the input is not valid code, return a response indicating that no analysis can be performed.
+
+2. *Detect AI-Generated Code*:
+   - Identify patterns typical of AI-generated code (e.g., ChatGPT, Claude, GitHub Copilot).
+   - Look for overly consistent formatting, excessive or unnatural comments, and generic variable/function names.
+   - Detect code that is overly optimized or uses advanced techniques inconsistent with the student's course level.
+   - Flag code that lacks common mistakes or shows an unnatural level of perfection.
+
+3. *Identify Copied Code*:
+   - Recognize code snippets copied from common online sources (e.g., Stack Overflow, GitHub, GeeksforGeeks).
+   - Compare the code against known algorithms, functions, or solutions from tutorials or public repositories.
+   - Detect inconsistent coding styles, mixed conventions, or abrupt changes in logic that suggest multiple sources.
+   - Use contextual clues (e.g., comments, variable names) to trace potential sources.
+
+4. *Assess Originality*:
+   - Evaluate the likelihood that the code was written by the student based on the course level and assignment description.
+   - Identify common mistakes, incomplete implementations, or lack of understanding in the code.
+   - Check for code that is too simplistic, overly generic, or lacks originality.
+   - Consider the student's coding style, if previously available, for consistency.
+
+5. *Provide Detailed Analysis*:
+   - Break down the code into logical sections (e.g., functions, loops, classes) and analyze each part for plagiarism.
+   - Provide a confidence score (0-100) for your assessment, considering the strength of evidence.
+   - Highlight specific lines or blocks of code that are suspicious, with clear explanations.
+
+6. *Generate Recommendations*:
+   - Suggest follow-up questions to verify the student's understanding of the code.
+   - Provide actionable recommendations for improving the originality and quality of the code.
+
+---
+
+### *Evaluation Parameters*
+
+Your analysis should also consider the following evaluation parameters from the AI-based Code Evaluator:
+
+1. *Code Correctness*:
+   - Check if the code executes correctly without errors.
+   - Verify if the code handles exceptions properly.
+   - Compare expected vs. actual output for given test cases.
+
+2. *Code Efficiency & Performance*:
+   - Estimate time complexity using Big-O notation.
+   - Measure memory consumption and execution time.
+   - Identify performance bottlenecks.
+
+3. *Code Security Analysis*:
+   - Detect SQL injection vulnerabilities.
+   - Check for cross-site scripting (XSS) risks.
+   - Identify hardcoded secrets (e.g., API keys, passwords).
+   - Scan for outdated or vulnerable dependencies.
+
+4. *Code Readability & Maintainability*:
+   - Assess code style and documentation.
+   - Evaluate function and variable naming conventions.
+   - Analyze cyclomatic complexity and suggest improvements.
+
+5. *Plagiarism Detection & Code Similarity Analysis*:
+   - Perform exact code matching using hashes.
+   - Analyze structural similarity using AST (Abstract Syntax Tree).
+   - Use NLP-based similarity detection (e.g., SimHash, MinHash) to detect paraphrased code.
+
+---
+
+### *Output Format*
+
+Your response must be a structured JSON object with the following fields:
+
+json
+{
+    "is_valid_code": true/false,
+    "plagiarism_detected": true/false,
+    "confidence_score": 0-100,
+    "likely_source": "AI-generated" or "Online resource" or "Original student work",
+    "explanation": "Detailed reasoning for your conclusion",
+    "suspicious_elements": [
+        {
+            "code_section": "Specific lines or blocks of code",
+            "likely_source": "AI-generated" or "Online resource",
+            "confidence": 0-100,
+            "explanation": "Why this section is suspicious"
+        }
+    ],
+    "red_flags": [
+        "List of key concerns (e.g., inconsistent style, advanced techniques, lack of originality)"
+    ],
+    "verification_questions": [
+        "Suggested questions to ask the student to verify authorship"
+    ],
+    "recommendations": [
+        "Suggestions for improving originality and understanding"
+    ],
+    "evaluation_metrics": {
+        "code_correctness": {
+            "status": "Passed/Failed",
+            "test_cases": "Number of test cases executed",
+            "failed_cases": "Number of failed test cases"
+        },
+        "code_efficiency": {
+            "time_complexity": "O(n log n)",
+            "memory_usage": "12MB",
+            "execution_time": "120ms"
+        },
+        "code_security": {
+            "issues_found": ["SQL Injection", "Hardcoded API Key"],
+            "recommendations": ["Use parameterized queries", "Store API keys securely"]
+        },
+        "code_readability": {
+            "score": 8.5,
+            "suggestions": ["Improve documentation"]
+        }
+    }
+}
+""")
+
+PLAGIARISM_USER_TEMPLATE = PromptTemplate("plagiarism-user", "1", """
+Analyze this code for plagiarism and evaluate it based on the following parameters:
+
+$code
+
+*Context*:
+- Language: $language
+- Course Level: $course_level
+- Assignment Description: $assignment_description
+
+*Instructions*:
+1. Validate the input to ensure it is valid code in the specified programming language.
+2. If the input is not valid code, return a response indicating that no analysis can be performed.
+3. If the input is valid code, break down the code into sections and analyze each part for plagiarism.
+4. Provide a confidence score (0-100) for your assessment.
+5. Highlight specific lines or blocks of code that are suspicious.
+6. Evaluate the code based on the following parameters:
+   - Code Correctness: Check if the code executes correctly and handles exceptions.
+   - Code Efficiency: Estimate time complexity, memory usage, and execution time.
+   - Code Security: Detect vulnerabilities such as SQL injection, XSS, and hardcoded secrets.
+   - Code Readability: Assess code style, documentation, and naming conventions.
+7. Suggest follow-up questions to verify the student's understanding.
+8. Provide recommendations for improving originality, security, and code quality.
+
+*Output Format*:
+Your response should be in the structured JSON format provided in the system prompt.
+""")
+
+PLAGIARISM_SECTION_TEMPLATE = PromptTemplate("plagiarism-section", "1", """
+Analyze this section of a larger submission for plagiarism and evaluate it based on the following parameters.
+It is section $section_index of $section_count: `$section_name` (lines $start_line-$end_line of the file).
+Judge only this section; other sections are analyzed separately and the results are merged.
+
+$code
+
+*Context*:
+- Language: $language
+- Course Level: $course_level
+- Assignment Description: $assignment_description
+
+*Instructions*:
+1. Validate the input to ensure it is valid code in the specified programming language (it may reference code defined in other sections).
+2. Provide a confidence score (0-100) for your assessment of this section.
+3. Highlight specific lines or blocks of code in this section that are suspicious.
+4. Evaluate correctness, efficiency, security and readability of this section.
+5. Suggest follow-up questions and recommendations specific to this section.
+
+*Output Format*:
+Your response should be in the structured JSON format provided in the system prompt. Keep it concise.
+""")
+
+# Part of every analysis cache key, so editing a template invalidates cached analyses
+PROMPT_VERSION = "+".join(t.id for t in (PLAGIARISM_SYSTEM_TEMPLATE, PLAGIARISM_USER_TEMPLATE,
+                                         PLAGIARISM_SECTION_TEMPLATE))
+PLAGIARISM_SYSTEM_PROMPT = PLAGIARISM_SYSTEM_TEMPLATE.render()
+
+def _fit_tokens(text: str, max_tokens: int, from_end: bool = False) -> str:
+    """Longest prefix (or suffix) of text within max_tokens, found by bisecting on length."""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[len(text) - mid:] if from_end else text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[len(text) - low:] if from_end else text[:low]
+
+def truncate_code(code: str, max_tokens: int):
+    """Fit code into max_tokens by dropping whole lines from the middle.
+
+    The head (signatures, imports) and tail (main logic, output) carry most of the
+    signal, so roughly two thirds of the budget goes to the head and the rest to the tail.
+    When not even the first or last line fits, that line is cut instead (minified
+    or generated code can be a single line). Returns (code, omitted_line_count),
+    where lines that were cut count as omitted.
+    """
+    if count_tokens(code) <= max_tokens:
+        return code, 0
+
+    lines = code.splitlines()
+    line_tokens = [count_tokens(l) + 1 for l in lines]
+    marker = "... [{} lines omitted{} to fit the analysis budget] ..."
+    marker_tokens = count_tokens(marker.format(len(lines), " or cut short")) + 2
+    budget = max(0, max_tokens - marker_tokens)
+    head_budget = budget * 2 // 3
+
+    head, used = [], 0
+    for line, cost in zip(lines, line_tokens):
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+    kept = len(head)
+    rest = lines[kept:]
+    if not head:
+        # A first line longer than the head's share is cut inside the line
+        head = [_fit_tokens(lines[0], head_budget)]
+        used = count_tokens(head[0]) + 1
+        rest = [lines[0][len(head[0]):]] + lines[1:]
+
+    tail = []
+    # The remainder of a cut first line is never a whole line, so it is not a candidate
+    for line, cost in zip(reversed(rest[1:] if not kept else rest), reversed(line_tokens[max(kept, 1):])):
+        if used + cost > budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+    kept += len(tail)
+    if not tail:
+        # Likewise a last line longer than what is left of the budget
+        tail = [_fit_tokens("\n".join(rest), max(0, budget - used), from_end=True)]
+
+    omitted = len(lines) - kept
+    marker = marker.format(omitted, "" if kept == len(head) + len(tail) else " or cut short")
+    return "\n".join(head + [marker] + tail), omitted
+
+def build_user_message(code, language, course_level=None, assignment_description=None):
+    return PLAGIARISM_USER_TEMPLATE.render(
+        code=code,
+        language=language,
+        course_level=course_level if course_level else "Not provided",
+        assignment_description=assignment_description if assignment_description else "Not provided"
+    )
+
+def build_analysis_messages(code, language, course_level=None, assignment_description=None):
+    """Render the analysis prompt within PROMPT_MAX_INPUT_TOKENS. Returns (messages, budget_info)."""
+    context_tokens = sum(count_tokens(v or "") for v in (language, course_level, assignment_description))
+    code_budget = (settings.PROMPT_MAX_INPUT_TOKENS - PLAGIARISM_SYSTEM_TEMPLATE.static_tokens
+                   - PLAGIARISM_USER_TEMPLATE.static_tokens - context_tokens)
+    code, omitted = truncate_code(code, max(code_budget, settings.PROMPT_MIN_CODE_TOKENS))
+
+    messages = [
+        {"role": "system", "content": PLAGIARISM_SYSTEM_PROMPT},
+        {"role": "user", "content": build_user_message(code, language, course_level, assignment_description)}
+    ]
+    return messages, {"truncated": omitted > 0, "omitted_lines": omitted}
+
+class AnalysisError(Exception):
+    """Raised when an analysis cannot be produced; carries the HTTP status to surface."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+async def request_analysis(messages: List[dict], usage_context: dict, max_tokens: int) -> dict:
+    """One LLM analysis call parsed as JSON. LLMUnavailableError passes through for fallback handling."""
+    try:
+        response = await llm_service.chat(
+            messages,
+            usage_context=usage_context,
+            response_format={"type": "json_object"},
+            max_tokens=max_tokens,
+            temperature=0.2
+        )
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        raise AnalysisError(502, f"OpenAI API error: {str(e)}")
+
+    try:
+        return json.loads(response.choices[0].message.content)
+    except json.JSONDecodeError:
+        raise AnalysisError(500, "Failed to parse plagiarism analysis result")
+
+async def run_plagiarism_analysis(code, language, course_level=None, assignment_description=None, contest_id=None,
+                                  previous=None):
+    """`previous` ({"job_id", "code", "analysis"}) allows an incremental analysis of a resubmission."""
+    if not llm_service.available:
+        return generate_mock_analysis(code, language)
+
+    # Jobs were already looked up once when queued; this catches duplicates that finished meanwhile
+    cache_key = analysis_cache_key(code, language, course_level, assignment_description)
+    cached = await analysis_cache.get(cache_key, count_miss=False)
+    if cached is not None:
+        return cached
+
+    try:
+        if previous is not None:
+            result = await run_incremental_analysis(previous, code, language, course_level, assignment_description,
+                                                    contest_id)
+            # Built on one student's earlier analysis, so not cached under the code-only key
+            if result is not None:
+                return result
+        result = await run_full_analysis(code, language, course_level, assignment_description, contest_id)
+    except LLMUnavailableError as e:
+        # Upstream degraded - answer locally rather than failing; not cached
+        return generate_local_analysis(code, language, reason=str(e))
+
+    await analysis_cache.set(cache_key, result)
+    return result
+
+async def run_full_analysis(code, language, course_level=None, assignment_description=None, contest_id=None) -> dict:
+    sections = None
+    if count_tokens(code) > settings.SECTIONED_ANALYSIS_MIN_TOKENS:
+        sections = split_code_sections(code, language, settings.SECTION_MAX_TOKENS, settings.SECTION_MAX_COUNT)
+    if sections and len(sections) > 1:
+        return await run_sectioned_analysis(sections, language, course_level, assignment_description, contest_id)
+    messages, budget = build_analysis_messages(code, language, course_level, assignment_description)
+    return await request_analysis(
+        messages,
+        {"purpose": "plagiarism_analysis", "contest_id": contest_id, **budget},
+        settings.PROMPT_MAX_OUTPUT_TOKENS
+    )
+
+# =========================
+# Sectioned Analysis
+# =========================
+# Large submissions are split into functions/classes/top-level blocks and analysed
+# concurrently, so wall-clock time follows the largest section rather than the file.
+def _python_sections(code: str) -> Optional[List[dict]]:
+    import ast
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    lines = code.splitlines()
+    sections = []
+    pending_start = None
+    pending_end = None
+
+    def flush_block():
+        if pending_start is not None:
+            sections.append({"name": "top-level code", "kind": "block",
+                             "start_line": pending_start, "end_line": pending_end})
+
+    for node in tree.body:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        end = getattr(node, "end_lineno", None) or start
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            flush_block()
+            pending_start = pending_end = None
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            sections.append({"name": node.name, "kind": kind, "start_line": start, "end_line": end})
+        else:
+            if pending_start is None:
+                pending_start = start
+            pending_end = end
+    flush_block()
+
+    for s in sections:
+        s["code"] = "\n".join(lines[s["start_line"] - 1:s["end_line"]])
+    return sections
+
+def _mask_literals(code: str) -> str:
+    """Blank out strings and comments (keeping length and newlines) so braces inside them are ignored."""
+    def blank(m):
+        return "".join(ch if ch == "\n" else " " for ch in m.group(0))
+    return re.sub(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|#[^\n]*|/\*.*?\*/', blank, code, flags=re.S)
+
+_BLOCK_NAME_RE = re.compile(r"\b(?:class|struct|interface|enum|def|fn|func|function)\s+([A-Za-z_]\w*)|([A-Za-z_]\w*)\s*\([^;{}]*\)\s*(?:const\s*)?(?:throws\s+[\w., ]+)?\s*\{?\s*$")
+
+def _brace_sections(code: str) -> List[dict]:
+    """Language-agnostic split: cut wherever brace depth returns to zero at a line end,
+    or at a blank line between unindented blocks for brace-less languages."""
+    stripped = _mask_literals(code)
+    lines = code.splitlines()
+    stripped_lines = stripped.splitlines()
+    sections = []
+    depth = 0
+    start = 0
+    opened = False
+    for i, line in enumerate(stripped_lines):
+        for ch in line:
+            if ch == "{":
+                depth += 1
+                opened = True
+            elif ch == "}":
+                depth = max(0, depth - 1)
+        at_boundary = depth == 0 and (
+            opened or (not line.strip() and i + 1 < len(lines) and lines[i + 1][:1] not in (" ", "\t", ""))
+        )
+        if at_boundary and any(l.strip() for l in lines[start:i + 1]):
+            sections.append((start, i))
+            start = i + 1
+            opened = False
+    if start < len(lines) and any(l.strip() for l in lines[start:]):
+        sections.append((start, len(lines) - 1))
+
+    out = []
+    for s, e in sections:
+        body = "\n".join(lines[s:e + 1])
+        first = next((l for l in lines[s:e + 1] if l.strip()), "")
+        match = _BLOCK_NAME_RE.search(first)
+        name = (match.group(1) or match.group(2)) if match else "top-level code"
+        out.append({"name": name, "kind": "block", "start_line": s + 1, "end_line": e + 1, "code": body})
+    return out
+
+def split_code_sections(code: str, language: str, max_section_tokens: int, max_sections: int) -> List[dict]:
+    """Split code into analysable sections of at most max_section_tokens, at most max_sections of them."""
+    sections = None
+    if (language or "").lower() in ("python", "py"):
+        sections = _python_sections(code)
+    if not sections:
+        sections = _brace_sections(code)
+    for s in sections:
+        s["tokens"] = count_tokens(s["code"])
+
+    # Oversized sections are cut into line chunks that fit the per-section budget
+    sized = []
+    for s in sections:
+        if s["tokens"] <= max_section_tokens:
+            sized.append(s)
+            continue
+        parts = []
+        chunk, chunk_tokens, chunk_start = [], 0, s["start_line"]
+        for offset, line in enumerate(s["code"].splitlines()):
+            cost = count_tokens(line) + 1
+            if chunk and chunk_tokens + cost > max_section_tokens:
+                parts.append((chunk, chunk_tokens, chunk_start, s["start_line"] + offset - 1))
+                chunk, chunk_tokens, chunk_start = [], 0, s["start_line"] + offset
+            chunk.append(line)
+            chunk_tokens += cost
+        if chunk:
+            parts.append((chunk, chunk_tokens, chunk_start, s["end_line"]))
+        for n, (chunk, chunk_tokens, start, end) in enumerate(parts, 1):
+            sized.append({"name": f"{s['name']} (part {n})", "kind": s["kind"], "start_line": start,
+                          "end_line": end, "code": "\n".join(chunk), "tokens": chunk_tokens})
+
+    # Merge neighbours (smallest pair first) until the count and minimum sizes are reasonable
+    lines = code.splitlines()
+    min_tokens = max_section_tokens // 4
+    while len(sized) > 1:
+        too_many = len(sized) > max_sections
+        best = None
+        for i in range(len(sized) - 1):
+            combined = sized[i]["tokens"] + sized[i + 1]["tokens"]
+            small = min(sized[i]["tokens"], sized[i + 1]["tokens"]) < min_tokens
+            if combined <= max_section_tokens and (small or too_many) and (best is None or combined < best[1]):
+                best = (i, combined)
+        if best is None:
+            if not too_many:
+                break
+            # Nothing fits the budget any more; merge the smallest pair regardless
+            best = min(((i, sized[i]["tokens"] + sized[i + 1]["tokens"]) for i in range(len(sized) - 1)),
+                       key=lambda x: x[1])
+        i = best[0]
+        a, b = sized[i], sized[i + 1]
+        sized[i:i + 2] = [{
+            "name": a["name"] if a["name"] == b["name"] else f"{a['name']}, {b['name']}",
+            "kind": "block",
+            "start_line": a["start_line"],
+            "end_line": b["end_line"],
+            # Taken from the source so blank lines between the two stay and line numbers line up
+            "code": "\n".join(lines[a["start_line"] - 1:b["end_line"]]),
+            "tokens": a["tokens"] + b["tokens"],
+        }]
+    return sized
+
+def _dedupe(items, limit: int = 10) -> list:
+    seen, out = set(), []
+    for item in items:
+        key = json.dumps(item, sort_keys=True, default=str)
+        if key not in seen:
+            seen.add(key)
+            out.append(item)
+    return out[:limit]
+
+def _as_number(value) -> float:
+    # Model output mixes 85, "85", 85.5 and "0.9"; anything unparseable (or NaN) counts as 0
+    try:
+        number = float(str(value).strip())
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+def _as_int(value) -> int:
+    return round(_as_number(value))
+
+def merge_section_analyses(sections: List[dict], results: List[dict]) -> dict:
+    """Combine per-section analyses into the single-document response schema."""
+    weights = [max(1, s["tokens"]) for s in sections]
+    total = sum(weights)
+    detected = [(s, r) for s, r in zip(sections, results) if r.get("plagiarism_detected")]
+
+    if detected:
+        top_section, top = max(detected, key=lambda sr: _as_number(sr[1].get("confidence_score")))
+        confidence = _as_int(top.get("confidence_score"))
+        likely_source = top.get("likely_source", "Online resource")
+    else:
+        confidence = round(sum(_as_number(r.get("confidence_score")) * w for r, w in zip(results, weights)) / total)
+        likely_source = "Original student work"
+
+    suspicious = []
+    for s, r in zip(sections, results):
+        for element in r.get("suspicious_elements") or []:
+            element = dict(element)
+            element["section"] = f"{s['name']} (lines {s['start_line']}-{s['end_line']})"
+            suspicious.append(element)
+
+    metrics = [r.get("evaluation_metrics") or {} for r in results]
+    correctness = [m.get("code_correctness") or {} for m in metrics]
+    readability = [(m.get("code_readability") or {}, w) for m, w in zip(metrics, weights)]
+    largest = max(range(len(sections)), key=lambda i: weights[i])
+
+    return {
+        "is_valid_code": all(r.get("is_valid_code", True) for r in results),
+        "plagiarism_detected": bool(detected),
+        "confidence_score": confidence,
+        "likely_source": likely_source,
+        "explanation": " ".join(
+            f"[{s['name']}, lines {s['start_line']}-{s['end_line']}] {r.get('explanation', '')}".strip()
+            for s, r in zip(sections, results)
+        ),
+        "suspicious_elements": suspicious,
+        "red_flags": _dedupe(f for r in results for f in (r.get("red_flags") or [])),
+        "verification_questions": _dedupe(q for r in results for q in (r.get("verification_questions") or [])),
+        "recommendations": _dedupe(q for r in results for q in (r.get("recommendations") or [])),
+        "evaluation_metrics": {
+            "code_correctness": {
+                "status": "Failed" if any(c.get("status") == "Failed" for c in correctness) else "Passed",
+                "test_cases": str(sum(_as_int(c.get("test_cases")) for c in correctness)),
+                "failed_cases": str(sum(_as_int(c.get("failed_cases")) for c in correctness)),
+            },
+            "code_efficiency": metrics[largest].get("code_efficiency") or {},
+            "code_security": {
+                "issues_found": _dedupe(i for m in metrics for i in ((m.get("code_security") or {}).get("issues_found") or [])),
+                "recommendations": _dedupe(i for m in metrics for i in ((m.get("code_security") or {}).get("recommendations") or [])),
+            },
+            "code_readability": {
+                "score": round(sum(_as_number(r.get("score")) * w for r, w in readability) / total, 1),
+                "suggestions": _dedupe(x for r, _ in readability for x in (r.get("suggestions") or [])),
+            },
+        },
+        "analysis_mode": "sectioned",
+        "sections": [{
+            "name": s["name"],
+            "kind": s["kind"],
+            "start_line": s["start_line"],
+            "end_line": s["end_line"],
+            "plagiarism_detected": bool(r.get("plagiarism_detected")),
+            "confidence_score": r.get("confidence_score"),
+        } for s, r in zip(sections, results)],
+    }
+
+async def analyze_sections(sections: List[dict], language, course_level=None, assignment_description=None,
+                           contest_id=None, purpose: str = "plagiarism_section") -> List[Any]:
+    """One LLM call per section, concurrently; failed sections come back as their exception."""
+    semaphore = asyncio.Semaphore(settings.SECTION_CONCURRENCY)
+
+    async def analyze(index: int, section: dict):
+        messages = [
+            {"role": "system", "content": PLAGIARISM_SYSTEM_PROMPT},
+            {"role": "user", "content": PLAGIARISM_SECTION_TEMPLATE.render(
+                code=section["code"],
+                language=language,
+                course_level=course_level if course_level else "Not provided",
+                assignment_description=assignment_description if assignment_description else "Not provided",
+                section_name=section["name"],
+                section_index=index + 1,
+                section_count=len(sections),
+                start_line=section["start_line"],
+                end_line=section["end_line"],
+            )}
+        ]
+        async with semaphore:
+            return await request_analysis(
+                messages,
+                {"purpose": purpose, "contest_id": contest_id, "section": section["name"]},
+                settings.SECTION_MAX_OUTPUT_TOKENS
+            )
+
+    return await asyncio.gather(*(analyze(i, s) for i, s in enumerate(sections)), return_exceptions=True)
+
+async def run_sectioned_analysis(sections: List[dict], language, course_level=None, assignment_description=None,
+                                 contest_id=None) -> dict:
+    outcomes = await analyze_sections(sections, language, course_level, assignment_description, contest_id)
+
+    for outcome in outcomes:
+        if isinstance(outcome, LLMUnavailableError):
+            raise outcome
+    ok = [(s, r) for s, r in zip(sections, outcomes) if not isinstance(r, BaseException)]
+    if not ok:
+        first = outcomes[0]
+        raise first if isinstance(first, AnalysisError) else AnalysisError(502, f"OpenAI API error: {first}")
+
+    merged = merge_section_analyses([s for s, _ in ok], [r for _, r in ok])
+    failed = [s["name"] for s, r in zip(sections, outcomes) if isinstance(r, BaseException)]
+    if failed:
+        merged["failed_sections"] = failed
+    return merged
+
+# =========================
+# Incremental Analysis
+# =========================
+# A resubmission is diffed line by line against the student's last analysed submission
+# for the same assignment. When few lines changed, only the sections containing them
+# go to the LLM and the previous analysis stands in for the rest of the file.
+def diff_changed_lines(previous: str, code: str) -> tuple:
+    """(1-based lines of `code` that differ from `previous`, fraction of lines changed)."""
+    old, new = previous.splitlines(), code.splitlines()
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    changed = set()
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        # A pure deletion has no new lines; the line after the gap stands in for it
+        first = min(j1 + 1, max(len(new), 1))
+        changed.update(range(first, max(j2, first) + 1))
+    matched = sum(block.size for block in matcher.get_matching_blocks())
+    return changed, 1 - matched / max(len(old), len(new), 1)
+
+def plan_incremental_analysis(previous_code: str, code: str, language: str) -> Optional[dict]:
+    """Sections of `code` to re-analyse, or None when a full analysis is the better deal."""
+    changed, change_ratio = diff_changed_lines(previous_code, code)
+    if change_ratio > settings.INCREMENTAL_MAX_CHANGE_RATIO:
+        return None
+    sections = split_code_sections(code, language, settings.INCREMENTAL_SECTION_MAX_TOKENS, settings.SECTION_MAX_COUNT)
+    dirty = [s for s in sections if any(s["start_line"] <= line <= s["end_line"] for line in changed)]
+    if sections and len(dirty) == len(sections):
+        return None
+    return {
+        "sections": dirty,
+        "changed_lines": len(changed),
+        "change_ratio": round(change_ratio, 3),
+        "total_tokens": sum(s["tokens"] for s in sections),
+        "line_count": max(len(code.splitlines()), 1),
+    }
+
+async def run_incremental_analysis(previous: dict, code, language, course_level=None, assignment_description=None,
+                                   contest_id=None) -> Optional[dict]:
+    """Merge the previous analysis with fresh analyses of the changed sections.
+
+    Returns None when a full analysis is due: too much changed, the previous verdict
+    was plagiarism (it has to be re-judged as a whole), or a changed section failed.
+    """
+    prior = {k: v for k, v in previous["analysis"].items() if k not in ("execution", "incremental")}
+    plan = None
+    if not prior.get("plagiarism_detected"):
+        plan = plan_incremental_analysis(previous["code"], code, language)
+    if plan is None:
+        INCREMENTAL_ANALYSES.inc("full")
+        return None
+
+    dirty = plan["sections"]
+    reanalyzed_tokens = sum(s["tokens"] for s in dirty)
+    if dirty:
+        outcomes = await analyze_sections(dirty, language, course_level, assignment_description, contest_id,
+                                          purpose="plagiarism_incremental")
+        for outcome in outcomes:
+            if isinstance(outcome, LLMUnavailableError):
+                raise outcome
+        if any(isinstance(outcome, BaseException) for outcome in outcomes):
+            INCREMENTAL_ANALYSES.inc("full")
+            return None
+        unchanged = {"name": "unchanged code", "kind": "previous", "start_line": 1, "end_line": plan["line_count"],
+                     "tokens": max(1, plan["total_tokens"] - reanalyzed_tokens)}
+        result = merge_section_analyses([unchanged] + dirty, [prior] + list(outcomes))
+        INCREMENTAL_ANALYSES.inc("partial")
+    else:
+        result = dict(prior)
+        INCREMENTAL_ANALYSES.inc("reused")
+
+    result["analysis_mode"] = "incremental"
+    result["incremental"] = {
+        "previous_job_id": previous["job_id"],
+        "changed_lines": plan["changed_lines"],
+        "change_ratio": plan["change_ratio"],
+        "reanalyzed_sections": [
+            {"name": s["name"], "start_line": s["start_line"], "end_line": s["end_line"]} for s in dirty
+        ],
+        "reanalyzed_tokens": reanalyzed_tokens,
+        "reused_tokens": plan["total_tokens"] - reanalyzed_tokens,
+    }
+    return result
+
+# =========================
+# Code Blob Store
+# =========================
+# Code bodies are stored once, compressed, under the SHA-256 of their text. Submission
+# and analysis documents carry only `code_hash`, so a submission no longer writes its
+# body twice and an unchanged resubmission writes no body at all. Bodies whose
+# compressed size passes CODE_BLOB_GRIDFS_THRESHOLD_KB go to GridFS instead of the
+# blob document, which keeps every document well under Mongo's 16MB limit.
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+CODEC_RAW = "raw"
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def compress_code(data: bytes, codec: str) -> tuple:
+    """Return (codec, payload); falls back to raw when compression does not pay off."""
+    if codec == CODEC_ZSTD and zstandard is not None:
+        payload = zstandard.ZstdCompressor(level=9).compress(data)
+    elif codec in (CODEC_ZSTD, CODEC_ZLIB):
+        codec, payload = CODEC_ZLIB, zlib.compress(data, 9)
+    else:
+        codec, payload = CODEC_RAW, data
+    if len(payload) >= len(data):
+        return CODEC_RAW, data
+    return codec, payload
+
+def decompress_code(codec: str, payload: bytes) -> str:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Code blob is zstd-compressed but zstandard is not installed")
+        data = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == CODEC_ZLIB:
+        data = zlib.decompress(payload)
+    else:
+        data = payload
+    return data.decode("utf-8")
+
+class CodeBlobStore:
+    """Content-addressed code storage with an LRU of decoded bodies.
+
+    Blob documents are `{_id: sha256, codec, size, stored_size, data | gridfs_id}`.
+    Blobs are immutable and never deleted by the app, so the hashes this process has
+    already written or read can skip the upsert round trip.
+
+    The LRU is bounded by entry count and by the memory its bodies hold; a body
+    larger than a quarter of the byte budget is not cached at all, so one huge
+    upload cannot flush everything else.
+    """
+    def __init__(self, collection, codec: str, gridfs_threshold_bytes: int, cache_size: int, cache_bytes: int):
+        self.collection = collection
+        self.codec = codec
+        self.gridfs_threshold_bytes = gridfs_threshold_bytes
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self._bodies: "OrderedDict[str, str]" = OrderedDict()
+        self._cached_bytes = 0
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+            self._bucket = AsyncIOMotorGridFSBucket(self.collection.database, bucket_name=self.collection.name)
+        return self._bucket
+
+    def _remember(self, key: str, code: str):
+        if key in self._bodies:
+            self._bodies.move_to_end(key)
+            return
+        size = sys.getsizeof(code)
+        if size > self.cache_bytes // 4:
+            return
+        self._bodies[key] = code
+        self._cached_bytes += size
+        while len(self._bodies) > self.cache_size or self._cached_bytes > self.cache_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self._cached_bytes -= sys.getsizeof(evicted)
+
+    async def put(self, code: str) -> str:
+        """Store `code` if it is new and return its hash."""
+        key, _ = await self.put_with_size(code)
+        return key
+
+    async def put_with_size(self, code: str) -> tuple:
+        """Like put(); also returns the bytes written (0 when the body was already stored)."""
+        key = code_hash(code)
+        data = code.encode("utf-8")
+        CODE_BLOB_BYTES.inc("logical", amount=len(data))
+        if key in self._bodies:
+            self._bodies.move_to_end(key)
+            CODE_BLOB_WRITES.inc("deduplicated")
+            return key, 0
+
+        codec, payload = compress_code(data, self.codec)
+        doc = {"codec": codec, "size": len(data), "stored_size": len(payload), "created_at": datetime.utcnow()}
+        if len(payload) > self.gridfs_threshold_bytes:
+            # Check first so a resubmitted large body is not uploaded to GridFS again
+            if await self.collection.find_one({"_id": key}, {"_id": 1}):
+                self._remember(key, code)
+                CODE_BLOB_WRITES.inc("deduplicated")
+                return key, 0
+            doc["gridfs_id"] = await self.bucket.upload_from_stream(key, payload, metadata={"codec": codec})
+        else:
+            doc["data"] = Binary(payload)
+
+        result = await self.collection.update_one({"_id": key}, {"$setOnInsert": doc}, upsert=True)
+        self._remember(key, code)
+        if result.upserted_id is None:
+            CODE_BLOB_WRITES.inc("deduplicated")
+            return key, 0
+        CODE_BLOB_WRITES.inc("stored")
+        CODE_BLOB_BYTES.inc("stored", amount=len(payload))
+        return key, len(payload)
+
+    async def _decode(self, doc: dict) -> str:
+        if "gridfs_id" in doc:
+            stream = await self.bucket.open_download_stream(doc["gridfs_id"])
+            payload = await stream.read()
+        else:
+            payload = bytes(doc["data"])
+        return decompress_code(doc["codec"], payload)
+
+    async def get(self, key: str) -> Optional[str]:
+        bodies = await self.get_many([key])
+        return bodies.get(key)
+
+    async def get_many(self, keys) -> Dict[str, str]:
+        """Bodies for the given hashes in one query; unknown hashes are left out."""
+        found = {}
+        missing = []
+        for key in set(keys):
+            if key in self._bodies:
+                self._bodies.move_to_end(key)
+                found[key] = self._bodies[key]
+            else:
+                missing.append(key)
+        if missing:
+            async for doc in self.collection.find({"_id": {"$in": missing}}):
+                code = await self._decode(doc)
+                self._remember(doc["_id"], code)
+                found[doc["_id"]] = code
+        return found
+
+    async def hydrate(self, docs: List[dict]) -> List[dict]:
+        """Replace `code_hash` with the decoded `code`. Documents still holding inline code pass through."""
+        bodies = await self.get_many(d["code_hash"] for d in docs if d.get("code_hash"))
+        for doc in docs:
+            key = doc.pop("code_hash", None)
+            if key is not None and "code" not in doc:
+                doc["code"] = bodies.get(key)
+        return docs
+
+def with_code_hash(spec: Optional[str]) -> Optional[str]:
+    """A `fields`/`exclude` list naming `code` must also name `code_hash`, which is what the document holds."""
+    if spec and "code" in [f.strip() for f in spec.split(",")]:
+        return spec + ",code_hash"
+    return spec
+
+async def externalize_code(doc: dict) -> dict:
+    """Copy of an analysis document with its `code` moved to the blob store."""
+    doc = dict(doc)
+    doc["code_hash"] = await code_blobs.put(doc.pop("code"))
+    return doc
+
+code_blobs = CodeBlobStore(code_blobs_collection, settings.CODE_BLOB_CODEC,
+                           settings.CODE_BLOB_GRIDFS_THRESHOLD_KB * 1024, settings.CODE_BLOB_CACHE_SIZE,
+                           settings.CODE_BLOB_CACHE_BYTES)
+
+async def migrate_code_blobs(dry_run: bool = False, batch_size: int = 500) -> dict:
+    """Move inline `code` fields of submissions and analysis jobs into the blob store.
+
+    Idempotent: only documents still holding a string `code` are touched. The report
+    compares bytes written per byte of distinct code (write amplification) before the
+    migration - every document carried its own copy - and after, where each distinct
+    body is written once, compressed.
+    """
+    seen: Dict[str, int] = {}
+    report = {"dry_run": dry_run, "collections": {}}
+    blob_bytes = 0
+    for collection in (submissions_collection, codes_collection):
+        documents = inline_bytes = 0
+        db_cursor = collection.find({"code": {"$type": "string"}}, {"code": 1})
+        while True:
+            docs = await db_cursor.to_list(length=batch_size)
+            if not docs:
+                break
+            updates = []
+            for doc in docs:
+                data = doc["code"].encode("utf-8")
+                key = code_hash(doc["code"])
+                documents += 1
+                inline_bytes += len(data)
+                if key not in seen:
+                    seen[key] = len(data)
+                    blob_bytes += len(compress_code(data, code_blobs.codec)[1])
+                    if not dry_run:
+                        await code_blobs.put(doc["code"])
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"code_hash": key}, "$unset": {"code": ""}}))
+            if not dry_run:
+                await collection.bulk_write(updates, ordered=False)
+        report["collections"][collection.name] = {"documents": documents, "inline_bytes": inline_bytes}
+
+    inline_total = sum(c["inline_bytes"] for c in report["collections"].values())
+    distinct_bytes = sum(seen.values())
+    report.update({
+        "documents": sum(c["documents"] for c in report["collections"].values()),
+        "distinct_bodies": len(seen),
+        "inline_bytes": inline_total,
+        "distinct_bytes": distinct_bytes,
+        "blob_bytes": blob_bytes,
+        "saved_bytes": inline_total - blob_bytes,
+        "saved_ratio": round(1 - blob_bytes / inline_total, 4) if inline_total else 0.0,
+        "write_amplification_before": round(inline_total / distinct_bytes, 3) if distinct_bytes else 0.0,
+        "write_amplification_after": round(blob_bytes / distinct_bytes, 3) if distinct_bytes else 0.0,
+    })
+    return report
+
+# =========================
+# Analysis Cache
+# =========================
+# Strings are matched first so comment markers inside literals are left alone
+_COMMENT_PATTERNS = {
+    "hash": re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|#[^\n]*'),
+    "c": re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`)|//[^\n]*|/\*.*?\*/', re.S),
+    "sql": re.compile(r'(\'(?:\'\'|[^\'])*\')|--[^\n]*|/\*.*?\*/', re.S),
+}
+_HASH_COMMENT_LANGUAGES = {"python", "py", "ruby", "rb", "r", "bash", "shell", "sh", "perl"}
+_SQL_LANGUAGES = {"sql", "mysql", "postgresql"}
+# Indentation is syntax in these: re-indenting a line changes the program
+_INDENT_LANGUAGES = {"python", "py", "python3"}
+
+def comment_pattern(language: str):
+    """Regex whose matches are comments, or string literals captured in group 1."""
+    lang = (language or "").strip().lower()
+    if lang in _HASH_COMMENT_LANGUAGES:
+        return _COMMENT_PATTERNS["hash"]
+    if lang in _SQL_LANGUAGES:
+        return _COMMENT_PATTERNS["sql"]
+    return _COMMENT_PATTERNS["c"]
+
+def normalize_code(code: str, language: str) -> str:
+    """Strip comments and collapse whitespace so formatting-only edits hash identically.
+
+    Leading indentation is kept for languages where it is syntax; only runs of
+    whitespace within a line are collapsed there.
+    """
+    stripped = comment_pattern(language).sub(lambda m: m.group(1) or "", code)
+    keep_indent = (language or "").strip().lower() in _INDENT_LANGUAGES
+
+    lines = []
+    for line in stripped.splitlines():
+        body = " ".join(line.split())
+        if body:
+            lines.append(line[:len(line) - len(line.lstrip())] + body if keep_indent else body)
+    return "\n".join(lines)
+
+def analysis_cache_key(code, language, course_level=None, assignment_description=None) -> str:
+    """Analyses are only reused for the same model deployment and prompt templates."""
+    h = hashlib.sha256()
+    for part in (llm_service.deployment, PROMPT_VERSION, (language or "").lower(), course_level or "",
+                 assignment_description or "", normalize_code(code, language)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+class AnalysisCache:
+    """Two-tier cache of analysis results (LLM analyses, test executions): an in-process LRU in front of a Mongo collection.
+
+    Mongo entries expire through the expires_at TTL index created by ensure_indexes().
+    """
+    def __init__(self, collection, max_entries: int, ttl_seconds: int):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, analysis: dict, expires_at: float):
+        self._entries[key] = (analysis, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str, count_miss: bool = True) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            analysis, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return analysis
+            del self._entries[key]
+            self.evictions += 1
+
+        try:
+            doc = await self.collection.find_one({"_id": key})
+        except Exception as e:
+            logger.warning("Analysis cache lookup failed", extra={"fields": {"error": str(e)}})
+            doc = None
+        # The TTL monitor only runs once a minute, so check expiry ourselves as well
+        if doc and doc.get("expires_at") and doc["expires_at"] > datetime.utcnow():
+            expires_at = time.time() + (doc["expires_at"] - datetime.utcnow()).total_seconds()
+            self._remember(key, doc["analysis"], expires_at)
+            self.hits += 1
+            self.mongo_hits += 1
+            return doc["analysis"]
+
+        if count_miss:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, analysis: dict):
+        self._remember(key, analysis, time.time() + self.ttl_seconds)
+        now = datetime.utcnow()
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"analysis": analysis, "created_at": now,
+                 "expires_at": now + timedelta(seconds=self.ttl_seconds)},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning("Analysis cache write failed", extra={"fields": {"error": str(e)}})
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "prompt_version": PROMPT_VERSION
+        }
+
+analysis_cache = AnalysisCache(analysis_cache_collection, settings.ANALYSIS_CACHE_SIZE, settings.ANALYSIS_CACHE_TTL_SECONDS)
+
+# =========================
+# Test Case Execution
+# =========================
+# Student code runs in throwaway processes forked by sandbox_runner.py: its own session,
+# rlimits on CPU, address space, file size (output) and process count, a private network
+# namespace, a private root filesystem with the working directory at /work, and the
+# `nobody` account. The runner fails closed (status "Error", not cached) wherever that
+# isolation cannot be set up.
+#
+# Deployment: execution is off unless EXECUTION_ENABLED=true, and then needs a long-lived
+# Linux worker running as root (e.g. the render.yaml service in a container). Serverless
+# deployments (Vercel/Mangum) can't fork the sandbox; there it stays off, and a server
+# that enables it without root reports every run as status "Unavailable" with the reason
+# instead of attempting it. Compilation happens once per submission; test cases then run
+# in parallel.
+LANGUAGE_RUNTIMES = {
+    "python": {"source": "main.py", "compile": None,
+               "run": ["python3", "-I", "-S", "main.py"], "overhead_mb": 0},
+    # V8 reserves ~1GB of address space up front; the heap itself is capped by the flag
+    "javascript": {"source": "main.js", "compile": None,
+                   "run": ["node", "--max-old-space-size={memory_mb}", "main.js"], "overhead_mb": 1536},
+    "c": {"source": "main.c", "compile": ["gcc", "-O2", "-std=c11", "-o", "main", "main.c", "-lm"],
+          "run": ["./main"], "overhead_mb": 0},
+    "cpp": {"source": "main.cpp", "compile": ["g++", "-O2", "-std=c++17", "-o", "main", "main.cpp"],
+            "run": ["./main"], "overhead_mb": 0},
+    "java": {"source": "Main.java", "compile": ["javac", "Main.java"],
+             "run": ["java", "-Xmx{memory_mb}m", "-XX:+UseSerialGC", "Main"], "overhead_mb": 2048},
+}
+LANGUAGE_ALIASES = {"py": "python", "python3": "python", "js": "javascript", "node": "javascript",
+                    "c++": "cpp", "cc": "cpp"}
+
+VERDICT_ACCEPTED = "AC"
+VERDICT_WRONG_ANSWER = "WA"
+VERDICT_TIME_LIMIT = "TLE"
+VERDICT_MEMORY_LIMIT = "MLE"
+VERDICT_OUTPUT_LIMIT = "OLE"
+VERDICT_RUNTIME_ERROR = "RE"
+
+SANDBOX_PATH = "/usr/local/bin:/usr/bin:/bin"
+SANDBOX_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_runner.py")
+NOBODY_ID = 65534
+
+class SandboxPool:
+    """Pool of sandbox_runner.py processes; each forks and supervises one run at a time.
+
+    Runs are forked from the small runner rather than from this server so that the
+    peak RSS reported by wait4 measures the student program, not a copy of the API
+    process. Blocking calls happen on the engine's thread pool.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = 0
+
+    def _spawn(self) -> subprocess.Popen:
+        return subprocess.Popen(
+            [sys.executable, "-I", "-S", SANDBOX_RUNNER],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+        )
+
+    def _acquire(self) -> subprocess.Popen:
+        with self._lock:
+            if self._idle.empty() and self._started < self.size:
+                self._started += 1
+                return self._spawn()
+        return self._idle.get()
+
+    def run(self, request: dict) -> dict:
+        runner = self._acquire()
+        try:
+            runner.stdin.write(json.dumps(request) + "\n")
+            line = runner.stdout.readline()
+        except OSError:
+            line = ""
+        if not line:
+            # The runner died; replace it so the pool keeps its size
+            runner.kill()
+            runner.wait()
+            self._idle.put(self._spawn())
+            return {"error": "sandbox runner exited unexpectedly"}
+        self._idle.put(runner)
+        return json.loads(line)
+
+def _sandbox_run(pool: SandboxPool, argv: List[str], cwd: str, stdin_data: str, limits: dict,
+                 wall_seconds: float) -> dict:
+    """Run one sandboxed process to completion and collect its output. Blocking."""
+    io_dir = tempfile.mkdtemp(prefix="meridian-io-")
+    try:
+        paths = {name: os.path.join(io_dir, name) for name in ("stdin", "stdout", "stderr")}
+        with open(paths["stdin"], "w") as f:
+            f.write(stdin_data)
+        run = pool.run({
+            "argv": argv,
+            "cwd": cwd,
+            # Paths as the program sees them inside the sandbox root
+            "env": {"PATH": SANDBOX_PATH, "HOME": "/work", "TMPDIR": "/tmp", "LANG": "C.UTF-8"},
+            "limits": limits,
+            "wall_seconds": wall_seconds,
+            "require_network_isolation": settings.EXECUTION_REQUIRE_NETWORK_ISOLATION,
+            **paths,
+        })
+        if run.get("error"):
+            return run
+        with open(paths["stdout"], "rb") as f:
+            stdout = f.read(limits["output_bytes"] + 1)
+        with open(paths["stderr"], "rb") as f:
+            run["stderr"] = f.read(4096).decode("utf-8", "replace")
+        run["output_exceeded"] = len(stdout) >= limits["output_bytes"]
+        run["stdout"] = stdout[:limits["output_bytes"]].decode("utf-8", "replace")
+        return run
+    finally:
+        shutil.rmtree(io_dir, ignore_errors=True)
+
+def _normalize_output(text: str) -> str:
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+def _verdict(run: dict, expected: str, limits: dict) -> str:
+    if run["timed_out"] or run["exit_code"] == -signal.SIGXCPU:
+        return VERDICT_TIME_LIMIT
+    if run["exit_code"] == -signal.SIGXFSZ or run["output_exceeded"]:
+        return VERDICT_OUTPUT_LIMIT
+    if run["memory_kb"] * 1024 > limits["memory_bytes"] or "MemoryError" in run["stderr"]:
+        return VERDICT_MEMORY_LIMIT
+    if run["exit_code"] != 0:
+        return VERDICT_RUNTIME_ERROR
+    return VERDICT_ACCEPTED if _normalize_output(run["stdout"]) == _normalize_output(expected) else VERDICT_WRONG_ANSWER
+
+def execution_cache_key(code: str, language: str, tests: List[dict]) -> str:
+    """sha256 over (code hash, test set hash); limits are part of the test set."""
+    code_hash = hashlib.sha256(f"{language}\0{code}".encode("utf-8")).hexdigest()
+    test_set = json.dumps({
+        "tests": [[t["input"], t["output"]] for t in tests],
+        "limits": [settings.EXECUTION_TIME_LIMIT_SECONDS, settings.EXECUTION_MEMORY_LIMIT_MB,
+                   settings.EXECUTION_OUTPUT_LIMIT_KB],
+    }, sort_keys=True)
+    test_set_hash = hashlib.sha256(test_set.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{code_hash}:{test_set_hash}".encode("ascii")).hexdigest()
+
+class ExecutionEngine:
+    """Runs a submission against its test set and reports measured verdicts.
+
+    Results are cached by (code hash, test set hash), so resubmitting unchanged code
+    or re-grading does not execute anything. The thread pool and sandbox runners are
+    created on the first run, so importing the app starts nothing.
+    """
+    def __init__(self, cache: "AnalysisCache", workers: int, enabled: bool):
+        self.cache = cache
+        self.enabled = enabled
+        self.workers = workers
+        self.unavailable_reason = self._check_available() if enabled else None
+        if self.unavailable_reason:
+            logger.warning("Test execution is enabled but unavailable",
+                           extra={"fields": {"reason": self.unavailable_reason}})
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pool: Optional[SandboxPool] = None
+
+    @staticmethod
+    def _check_available() -> Optional[str]:
+        if not sys.platform.startswith("linux"):
+            return "test execution needs a Linux host"
+        if os.geteuid() != 0:
+            return "test execution needs the server to run as root"
+        return None
+
+    def _unavailable(self, tests: List[dict]) -> dict:
+        return {"status": "Unavailable", "error": self.unavailable_reason, "test_cases": len(tests)}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sandbox")
+            self._pool = SandboxPool(self.workers)
+        return self._executor
+
+    @staticmethod
+    def runtime(language: str) -> Optional[dict]:
+        language = (language or "").lower()
+        runtime = LANGUAGE_RUNTIMES.get(LANGUAGE_ALIASES.get(language, language))
+        if runtime is None:
+            return None
+        # Resolved on the sandbox PATH: the server's own interpreter may not be readable by `nobody`
+        binary = (runtime["compile"] or runtime["run"])[0]
+        return runtime if shutil.which(binary, path=SANDBOX_PATH) else None
+
+    async def cached(self, code: str, language: str, tests: List[dict]) -> Optional[dict]:
+        if self.unavailable_reason:
+            return self._unavailable(tests)
+        return await self.cache.get(execution_cache_key(code, language, tests))
+
+    async def run(self, code: str, language: str, tests: List[dict]) -> dict:
+        if self.unavailable_reason:
+            return self._unavailable(tests)
+        key = execution_cache_key(code, language, tests)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            result = await self._execute(code, language, tests)
+        except Exception as e:
+            logger.exception("Test execution failed")
+            return {"status": "Error", "error": str(e), "test_cases": len(tests)}
+        if result["status"] != "Error":
+            await self.cache.set(key, result)
+        return result
+
+    def _limits(self, runtime: dict, compile_step: bool = False) -> dict:
+        memory_mb = 1024 if compile_step else settings.EXECUTION_MEMORY_LIMIT_MB
+        cpu_seconds = settings.EXECUTION_COMPILE_TIMEOUT_SECONDS if compile_step else settings.EXECUTION_TIME_LIMIT_SECONDS
+        return {
+            "cpu_seconds": int(math.ceil(cpu_seconds)),
+            "memory_bytes": memory_mb * 1024 * 1024,
+            "address_space": (memory_mb + runtime["overhead_mb"]) * 1024 * 1024,
+            "output_bytes": settings.EXECUTION_OUTPUT_LIMIT_KB * 1024,
+            "processes": settings.EXECUTION_MAX_PROCESSES,
+        }
+
+    async def _execute(self, code: str, language: str, tests: List[dict]) -> dict:
+        runtime = self.runtime(language)
+        if runtime is None:
+            return {"status": "Unsupported", "language": language, "test_cases": len(tests)}
+
+        loop = asyncio.get_running_loop()
+        executor, pool = self._get_executor(), self._pool
+        workdir = tempfile.mkdtemp(prefix="meridian-run-", dir=settings.EXECUTION_TMP_DIR)
+        try:
+            with open(os.path.join(workdir, runtime["source"]), "w") as f:
+                f.write(code)
+            if os.geteuid() == 0:
+                os.chown(workdir, NOBODY_ID, NOBODY_ID)
+
+            if runtime["compile"]:
+                limits = self._limits(runtime, compile_step=True)
+                compiled = await loop.run_in_executor(
+                    executor, _sandbox_run, pool, runtime["compile"], workdir, "", limits,
+                    settings.EXECUTION_COMPILE_TIMEOUT_SECONDS
+                )
+                if compiled.get("error"):
+                    return {"status": "Error", "error": compiled["error"], "test_cases": len(tests)}
+                if compiled["exit_code"] != 0:
+                    return {"status": "Compilation Error", "language": language, "test_cases": len(tests),
+                            "passed_cases": 0, "failed_cases": len(tests), "compile_output": compiled["stderr"]}
+
+            if os.geteuid() == 0:
+                # Test runs share the directory: make it read-only for the sandbox user
+                os.chown(workdir, 0, 0)
+                os.chmod(workdir, 0o755)
+
+            limits = self._limits(runtime)
+            memory_mb = settings.EXECUTION_MEMORY_LIMIT_MB
+            argv = [part.format(memory_mb=memory_mb) for part in runtime["run"]]
+            wall_seconds = settings.EXECUTION_TIME_LIMIT_SECONDS * 2 + 1
+            runs = await asyncio.gather(*(
+                loop.run_in_executor(executor, _sandbox_run, pool, argv, workdir, t["input"], limits,
+                                     wall_seconds)
+                for t in tests
+            ))
+        finally:
+            await loop.run_in_executor(executor, shutil.rmtree, workdir, True)
+
+        errors = [r["error"] for r in runs if r.get("error")]
+        if errors:
+            return {"status": "Error", "error": errors[0], "test_cases": len(tests)}
+
+        results = []
+        for index, (test, run) in enumerate(zip(tests, runs)):
+            verdict = _verdict(run, test["output"], limits)
+            results.append({
+                "index": index,
+                "verdict": verdict,
+                "passed": verdict == VERDICT_ACCEPTED,
+                "runtime_ms": run["wall_ms"],
+                "cpu_ms": run["cpu_ms"],
+                "memory_kb": run["memory_kb"],
+            })
+        passed = sum(1 for r in results if r["passed"])
+        return {
+            "status": "Passed" if passed == len(results) else "Failed",
+            "language": language,
+            "test_cases": len(results),
+            "passed_cases": passed,
+            "failed_cases": len(results) - passed,
+            "max_runtime_ms": max((r["runtime_ms"] for r in results), default=0.0),
+            "peak_memory_kb": max((r["memory_kb"] for r in results), default=0),
+            "results": results,
+        }
+
+def apply_execution_metrics(analysis: dict, execution: dict) -> dict:
+    """Replace the LLM's guessed correctness/efficiency figures with measured ones."""
+    if execution.get("status") in ("Unsupported", "Unavailable", "Error"):
+        return dict(analysis, execution=execution)
+    metrics = dict(analysis.get("evaluation_metrics") or {})
+    metrics["code_correctness"] = {
+        "status": "Passed" if execution["status"] == "Passed" else "Failed",
+        "test_cases": str(execution["test_cases"]),
+        "failed_cases": str(execution["failed_cases"]),
+        "measured": True,
+    }
+    if execution.get("results"):
+        efficiency = dict(metrics.get("code_efficiency") or {})
+        efficiency["execution_time"] = f"{execution['max_runtime_ms']:.0f}ms"
+        efficiency["memory_usage"] = f"{execution['peak_memory_kb'] / 1024:.1f}MB"
+        metrics["code_efficiency"] = efficiency
+    return dict(analysis, evaluation_metrics=metrics, execution=execution)
+
+# Hidden test cases are keyed by the question's stable id, so they survive renames
+async def save_test_cases(contest_id: str, question_id: str, cases: List["TestCase"]):
+    await question_tests_collection.update_one(
+        {"contest_id": contest_id, "question_id": question_id},
+        {"$set": {"cases": [c.dict() for c in cases], "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def save_test_case_sets(contest_id: str, cases: Dict[str, List["TestCase"]]):
+    """Test cases of a bulk question upsert (question id -> cases), in one bulk write."""
+    operations = [
+        UpdateOne(
+            {"contest_id": contest_id, "question_id": question_id},
+            {"$set": {"cases": [c.dict() for c in question_cases], "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        for question_id, question_cases in cases.items()
+    ]
+    if operations:
+        await question_tests_collection.bulk_write(operations)
+
+async def load_test_set(contest_id: str, question: dict) -> List[dict]:
+    """The question's visible sample followed by its hidden test cases."""
+    tests = []
+    if question.get("sample_output"):
+        tests.append({"input": question.get("sample_input") or "", "output": question["sample_output"]})
+    doc = None
+    if question.get("id"):
+        doc = await question_tests_collection.find_one(
+            {"contest_id": contest_id, "question_id": question["id"]}, {"cases": 1}
+        )
+    if doc:
+        tests.extend(doc.get("cases", []))
+    return tests
+
+execution_engine = ExecutionEngine(
+    AnalysisCache(execution_cache_collection, settings.EXECUTION_CACHE_SIZE, settings.EXECUTION_CACHE_TTL_SECONDS),
+    workers=settings.EXECUTION_WORKERS,
+    enabled=settings.EXECUTION_ENABLED,
+)
+
+# =========================
+# Similarity Engine
+# =========================
+# Cross-submission copy detection: submissions are reduced to winnowed k-gram
+# fingerprints, summarised as MinHash signatures and bucketed with LSH per question.
+_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[A-Za-z_]\w*|\d+(?:\.\d+)?|\S')
+_KEYWORDS = frozenset("""
+and as assert async await break case catch char class const continue def default del do double elif
+else enum except extends false final finally float for from function global if implements import in
+include instanceof int interface is lambda let long new none nonlocal not null or pass private
+protected public raise return self short static struct super switch this throw throws true try
+typeof using var void while with yield print printf scanf cout cin endl std string vector map
+""".split())
+
+_MINHASH_PRIME = 4294967311  # smallest prime above 2**32
+_MINHASH_SEED = 1361
+_MASK64 = (1 << 64) - 1
+# Signatures are stored as raw little-endian 32-bit words (array typecode with itemsize 4)
+_U32 = "I" if array("I").itemsize == 4 else "L"
+
+def tokenize_code(code: str, language: str) -> List[str]:
+    """Lex code into a normalized token stream: identifiers and literals collapse to placeholders."""
+    tokens = []
+    for tok in _TOKEN_RE.findall(normalize_code(code, language)):
+        first = tok[0]
+        if first == '"' or first == "'":
+            tokens.append("S")
+        elif first.isdigit():
+            tokens.append("N")
+        elif first.isalpha() or first == "_":
+            lowered = tok.lower()
+            tokens.append(lowered if lowered in _KEYWORDS else "V")
+        else:
+            tokens.append(tok)
+    return tokens
+
+def signature_from_bytes(data: bytes) -> array:
+    sig = array(_U32)
+    sig.frombytes(data)
+    if sys.byteorder != "little":
+        sig.byteswap()
+    return sig
+
+def signature_to_bytes(sig: array) -> bytes:
+    if sys.byteorder != "little":
+        sig = array(_U32, sig)
+        sig.byteswap()
+    return sig.tobytes()
+
+class SimilarityEngine:
+    """Pure Python, so it fits the 15 MB serverless bundle: a few ms per submission."""
+    def __init__(self, collection, kgram: int, window: int, permutations: int, bands: int,
+                 top_k: int, max_indexes: int, refresh_seconds: float):
+        self.collection = collection
+        self.kgram = kgram
+        self.window = window
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.top_k = top_k
+        self.max_indexes = max_indexes
+        self.refresh_seconds = refresh_seconds
+        self._indexes: "OrderedDict[tuple, LSHIndex]" = OrderedDict()
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+        # Seeded, so every worker and every restart draws the same permutations
+        rng = random.Random(_MINHASH_SEED)
+        self._coefficients = [(rng.randrange(1, 2 ** 31), rng.randrange(0, 2 ** 32)) for _ in range(permutations)]
+
+    def fingerprints(self, code: str, language: str) -> List[int]:
+        """Winnowed k-gram hashes (32-bit) of the normalized token stream, sorted and unique."""
+        tokens = tokenize_code(code, language)
+        if not tokens:
+            return []
+        ids = [zlib.crc32(t.encode("utf-8")) for t in tokens]
+        k = self.kgram
+        if len(ids) < k:
+            ids += [0] * (k - len(ids))
+
+        # Polynomial rolling hash over every k-gram, wrapping at 64 bits, then mixed down to 32
+        base = 1000003
+        top = pow(base, k - 1, 1 << 64)
+        h = 0
+        for value in ids[:k]:
+            h = (h * base + value) & _MASK64
+        hashes = []
+        for i in range(len(ids) - k + 1):
+            if i:
+                h = ((h - ids[i - 1] * top) * base + ids[i + k - 1]) & _MASK64
+            mixed = h ^ (h >> 29)
+            hashes.append((((mixed * 0xBF58476D1CE4E5B9) & _MASK64) >> 32))
+
+        w = self.window
+        if len(hashes) <= w:
+            return sorted(set(hashes))
+        # Winnowing keeps the rightmost minimum of each window
+        picks = set()
+        for start in range(len(hashes) - w + 1):
+            best = start
+            for i in range(start + 1, start + w):
+                if hashes[i] <= hashes[best]:
+                    best = i
+            picks.add(best)
+        return sorted({hashes[i] for i in picks})
+
+    def signature(self, fingerprints: List[int]) -> array:
+        if not fingerprints:
+            return array(_U32, [0xFFFFFFFF]) * self.permutations
+        prime = _MINHASH_PRIME
+        return array(_U32, [min([(a * x + b) % prime for x in fingerprints]) & 0xFFFFFFFF
+                            for a, b in self._coefficients])
+
+    def signature_for(self, code: str, language: str):
+        fp = self.fingerprints(code, language)
+        return self.signature(fp), len(fp)
+
+    async def _get_index(self, contest_id: str, question_title: str) -> "LSHIndex":
+        key = (contest_id, question_title)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = LSHIndex(self.bands, self.rows, self.permutations)
+                self._indexes[key] = index
+                while len(self._indexes) > self.max_indexes:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._locks.pop(evicted, None)
+            self._indexes.move_to_end(key)
+
+            # Pick up submissions written by other workers since the last sync. last_id only
+            # ever comes from Mongo: local inserts can be newer than a peer's unsynced ones
+            if time.monotonic() - index.synced_at >= self.refresh_seconds:
+                query = {"contest_id": contest_id, "question_title": question_title}
+                if index.last_id is not None:
+                    query["_id"] = {"$gt": index.last_id}
+                cursor = self.collection.find(query, {"minhash": 1, "student_email": 1}).sort("_id", 1)
+                async for doc in cursor:
+                    index.add(str(doc["_id"]), doc.get("student_email"), signature_from_bytes(doc["minhash"]))
+                    index.last_id = doc["_id"]
+                index.synced_at = time.monotonic()
+            return index
+
+    async def add_submission(self, submission_id: str, contest_id: str, question_title: str,
+                             student_email: str, code: str, language: str) -> List[dict]:
+        """Fingerprint a new submission, index it, and return its nearest prior submissions."""
+        sig, fp_count = self.signature_for(code, language)
+        index = await self._get_index(contest_id, question_title)
+        nearest = index.query(sig, self.top_k, exclude_student=student_email)
+
+        await self.collection.insert_one({
+            "_id": ObjectId(submission_id),
+            "contest_id": contest_id,
+            "question_title": question_title,
+            "student_email": student_email,
+            "minhash": Binary(signature_to_bytes(sig)),
+            "fingerprint_count": fp_count,
+            "nearest": nearest,
+            "created_at": datetime.utcnow()
+        })
+        index.add(submission_id, student_email, sig)
+        return nearest
+
+    async def similarity_report(self, contest_id: str, question_title: str, threshold: float,
+                                include_matrix: bool = True) -> dict:
+        index = await self._get_index(contest_id, question_title)
+        # Snapshot before leaving the loop: new submissions may be indexed while pairs are counted
+        ids, students, sigs = list(index.ids), list(index.students), list(index.signatures)
+        agreements = await asyncio.to_thread(LSHIndex.pair_agreements, sigs)
+        n = len(ids)
+        p = self.permutations
+
+        # Union-find over every pair at or above the threshold
+        parent = list(range(n))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for (i, j), count in agreements.items():
+            if count / p >= threshold:
+                parent[find(i)] = find(j)
+
+        groups: Dict[int, List[int]] = {}
+        for i in range(n):
+            groups.setdefault(find(i), []).append(i)
+
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            best = max(agreements.get((a, b), 0) for x, a in enumerate(members) for b in members[x + 1:])
+            clusters.append({
+                "submission_ids": [ids[i] for i in members],
+                "student_emails": sorted({students[i] for i in members if students[i]}),
+                "max_similarity": round(best / p, 4)
+            })
+        clusters.sort(key=lambda c: c["max_similarity"], reverse=True)
+
+        report = {
+            "contest_id": contest_id,
+            "question_title": question_title,
+            "threshold": threshold,
+            "submission_ids": ids,
+            "student_emails": students,
+            "clusters": clusters
+        }
+        if include_matrix:
+            matrix = [[0.0] * n for _ in range(n)]
+            for i in range(n):
+                matrix[i][i] = 1.0
+            for (i, j), count in agreements.items():
+                matrix[i][j] = matrix[j][i] = round(count / p, 4)
+            report["matrix"] = matrix
+        return report
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures for one (contest, question)."""
+    def __init__(self, bands: int, rows: int, permutations: int):
+        self.bands = bands
+        self.rows = rows
+        self.permutations = permutations
+        self.ids: List[str] = []
+        self._known: set = set()
+        self.students: List[Optional[str]] = []
+        self.signatures: List[array] = []
+        self._buckets: List[Dict[bytes, List[int]]] = [dict() for _ in range(bands)]
+        self.last_id: Optional[ObjectId] = None
+        self.synced_at = float("-inf")
+
+    def _band_keys(self, sig):
+        return [sig[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def add(self, submission_id: str, student_email: Optional[str], sig):
+        # Local inserts come back on the next sync
+        if submission_id in self._known:
+            return
+        self._known.add(submission_id)
+        pos = len(self.signatures)
+        self.signatures.append(sig)
+        self.ids.append(submission_id)
+        self.students.append(student_email)
+        for band, key in enumerate(self._band_keys(sig)):
+            self._buckets[band].setdefault(key, []).append(pos)
+
+    def query(self, sig, k: int, exclude_student: Optional[str] = None) -> List[dict]:
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            candidates.update(self._buckets[band].get(key, ()))
+        if exclude_student:
+            candidates = {i for i in candidates if self.students[i] != exclude_student}
+        if not candidates:
+            return []
+
+        scored = [(sum(map(operator.eq, self.signatures[i], sig)) / self.permutations, i) for i in candidates]
+        scored.sort(key=lambda si: (-si[0], si[1]))
+        return [{
+            "submission_id": self.ids[i],
+            "student_email": self.students[i],
+            "similarity": round(score, 4)
+        } for score, i in scored[:k]]
+
+    @staticmethod
+    def pair_agreements(sigs: List[array]) -> Dict[tuple, int]:
+        """{(i, j): signature positions where i < j agree}; pairs that never agree are left out.
+
+        Signatures are grouped by value one position at a time, so the cost follows the
+        number of agreeing pairs rather than n^2 (unrelated code rarely agrees anywhere).
+        """
+        counts: Dict[tuple, int] = {}
+        if not sigs:
+            return counts
+        for position in range(len(sigs[0])):
+            groups: Dict[int, List[int]] = {}
+            for i, sig in enumerate(sigs):
+                groups.setdefault(sig[position], []).append(i)
+            for members in groups.values():
+                for x in range(len(members) - 1):
+                    a = members[x]
+                    for b in members[x + 1:]:
+                        counts[(a, b)] = counts.get((a, b), 0) + 1
+        return counts
+
+similarity_engine = SimilarityEngine(
+    similarity_collection,
+    kgram=settings.SIMILARITY_KGRAM,
+    window=settings.SIMILARITY_WINDOW,
+    permutations=settings.MINHASH_PERMUTATIONS,
+    bands=settings.LSH_BANDS,
+    top_k=settings.SIMILARITY_TOP_K,
+    max_indexes=settings.SIMILARITY_MAX_INDEXES,
+    refresh_seconds=settings.SIMILARITY_REFRESH_SECONDS
+)
+
+# =========================
+# Stylometry Profiles
+# =========================
+# Every student has a running style profile per language: the count, sum and sum of
+# squares of a fixed feature vector, kept up to date with one $inc per submission.
+# The same round trip returns the profile as it was before the submission, and the
+# submission is scored against it: a cheap authorship-drift signal for teachers.
+STYLE_PROFILE_VERSION = 1  # bump when STYLE_FEATURES changes; old profiles are left behind
+STYLE_NGRAM_BUCKETS = 32
+_STYLE_SHAPES = ("function", "class", "loop", "conditional", "comprehension", "lambda", "exception", "return", "call")
+_SHAPE_KEYWORDS = {
+    "def": "function", "function": "function", "func": "function", "fn": "function",
+    "class": "class", "struct": "class", "interface": "class",
+    "for": "loop", "while": "loop", "do": "loop",
+    "if": "conditional", "elif": "conditional", "switch": "conditional", "case": "conditional",
+    "lambda": "lambda", "=>": "lambda",
+    "try": "exception", "catch": "exception", "except": "exception",
+    "return": "return",
+}
+STYLE_FEATURES = (
+    "identifier_length", "identifier_snake_case", "identifier_camel_case", "identifier_single_char",
+    "identifier_upper_case", "comment_density", "blank_line_ratio", "line_length", "indent_tabs",
+    "indent_width", "nesting_depth",
+) + tuple(f"shape_{s}" for s in _STYLE_SHAPES) + tuple(f"ngram_{i}" for i in range(STYLE_NGRAM_BUCKETS))
+_CAMEL_RE = re.compile(r"[a-z0-9][A-Z]")
+
+def _python_shapes(code: str) -> Optional[Dict[str, int]]:
+    import ast
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    kinds = (
+        ((ast.FunctionDef, ast.AsyncFunctionDef), "function"), (ast.ClassDef, "class"),
+        ((ast.For, ast.AsyncFor, ast.While), "loop"), ((ast.If, ast.IfExp), "conditional"),
+        ((ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp), "comprehension"),
+        (ast.Lambda, "lambda"), (ast.Try, "exception"), (ast.Return, "return"), (ast.Call, "call"),
+    )
+    counts = dict.fromkeys(_STYLE_SHAPES, 0)
+    for node in ast.walk(tree):
+        for types, shape in kinds:
+            if isinstance(node, types):
+                counts[shape] += 1
+    return counts
+
+def style_features(code: str, language: str) -> Dict[str, float]:
+    """The STYLE_FEATURES of one submission. Counts are per line so file size cancels out."""
+    pattern = comment_pattern(language)
+    comment_chars = sum(len(m.group(0)) for m in pattern.finditer(code) if not m.group(1))
+    stripped = pattern.sub(lambda m: m.group(1) or "", code)
+    raw_lines = code.splitlines()
+    lines = [line for line in stripped.splitlines() if line.strip()]
+    line_count = max(len(lines), 1)
+    features = dict.fromkeys(STYLE_FEATURES, 0.0)
+
+    words = [t for t in _TOKEN_RE.findall(stripped) if (t[0].isalpha() or t[0] == "_")]
+    identifiers = [w for w in words if w.lower() not in _KEYWORDS]
+    if identifiers:
+        n = len(identifiers)
+        features["identifier_length"] = sum(map(len, identifiers)) / n
+        features["identifier_snake_case"] = sum("_" in w.strip("_") and w.islower() for w in identifiers) / n
+        features["identifier_camel_case"] = sum(bool(_CAMEL_RE.search(w)) and "_" not in w for w in identifiers) / n
+        features["identifier_single_char"] = sum(len(w) == 1 for w in identifiers) / n
+        features["identifier_upper_case"] = sum(len(w) > 1 and w.isupper() for w in identifiers) / n
+
+    features["comment_density"] = comment_chars / max(1, len(code) - code.count(" ") - code.count("\n"))
+    features["blank_line_ratio"] = sum(not line.strip() for line in raw_lines) / max(len(raw_lines), 1)
+    features["line_length"] = sum(len(line.rstrip()) for line in lines) / line_count
+    indents = [len(line) - len(line.lstrip()) for line in lines]
+    indented = [line for line in lines if line[:1] in (" ", "\t")]
+    features["indent_tabs"] = sum(line[0] == "\t" for line in indented) / max(len(indented), 1)
+    unit = min((i for i in indents if i), default=0)
+    features["indent_width"] = float(unit)
+    features["nesting_depth"] = max(indents, default=0) / unit if unit else 0.0
+
+    tokens = tokenize_code(code, language)
+    shapes = _python_shapes(code) if (language or "").lower() in ("python", "py") else None
+    if shapes is None:
+        shapes = dict.fromkeys(_STYLE_SHAPES, 0)
+        for i, tok in enumerate(tokens):
+            if tok in _SHAPE_KEYWORDS:
+                shapes[_SHAPE_KEYWORDS[tok]] += 1
+            elif tok == "(" and i and tokens[i - 1] == "V":
+                shapes["call"] += 1
+    for shape, count in shapes.items():
+        features[f"shape_{shape}"] = count / line_count
+
+    if len(tokens) > 1:
+        bigrams = len(tokens) - 1
+        for a, b in zip(tokens, tokens[1:]):
+            bucket = zlib.crc32(f"{a} {b}".encode("utf-8")) % STYLE_NGRAM_BUCKETS
+            features[f"ngram_{bucket}"] += 1 / bigrams
+    return features
+
+class StyleProfiles:
+    def __init__(self, collection, min_submissions: int, enabled: bool = True):
+        self.collection = collection
+        self.min_submissions = min_submissions
+        self._enabled = enabled
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    async def add_submission(self, student_email: str, language: str, code: str) -> dict:
+        """Fold a submission into the student's profile and score it against the profile before it."""
+        features = style_features(code, language)
+        inc = {"count": 1}
+        for name, value in features.items():
+            inc[f"sum.{name}"] = value
+            inc[f"sumsq.{name}"] = value * value
+        previous = await self.collection.find_one_and_update(
+            {"student_email": student_email, "language": (language or "").lower(), "version": STYLE_PROFILE_VERSION},
+            {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        return self.score(features, previous)
+
+    def score(self, features: Dict[str, float], profile: Optional[dict]) -> dict:
+        """Drift of one submission from a profile: 0 (typical for this student) to 100.
+
+        The distance is the RMS z-score over all features. Each feature's spread gets a
+        floor proportional to its mean, so features a student has never varied (or
+        never used) do not turn one small change into a large z-score.
+        """
+        count = (profile or {}).get("count", 0)
+        if count < self.min_submissions:
+            return {"score": None, "profile_submissions": count}
+        z = []
+        for name in STYLE_FEATURES:
+            mean = profile["sum"].get(name, 0.0) / count
+            variance = max(profile["sumsq"].get(name, 0.0) / count - mean * mean, 0.0)
+            scale = math.sqrt(variance + (0.1 * abs(mean) + 0.05) ** 2)
+            z.append(abs(features[name] - mean) / scale)
+        distance = math.sqrt(sum(v * v for v in z) / len(z))
+        top = sorted(range(len(z)), key=z.__getitem__, reverse=True)[:3]
+        return {
+            "score": round(100 * distance / (distance + 2.0)),  # an RMS z of 2 scores 50
+            "distance": round(distance, 3),
+            "profile_submissions": count,
+            "top_features": [{"feature": STYLE_FEATURES[i], "z": round(z[i], 2)} for i in top],
+        }
+
+style_profiles = StyleProfiles(
+    style_profiles_collection,
+    min_submissions=settings.STYLE_MIN_SUBMISSIONS,
+    enabled=settings.STYLE_PROFILES_ENABLED,
+)
+
+# =========================
+# Analysis Job Queue
+# =========================
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+class JobStore:
+    """Persistence backend for analysis jobs. Job ids are strings."""
+
+    async def create(self, doc: dict) -> str:
+        raise NotImplementedError
+
+    async def update(self, job_id: str, fields: dict):
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find_by_submissions(self, submission_ids: List[str]) -> List[dict]:
+        """Jobs created for any of the given submission ids."""
+        raise NotImplementedError
+
+    async def find_previous(self, submitter_email: str, assignment_id: str) -> Optional[dict]:
+        """The submitter's most recent completed job for the assignment."""
+        raise NotImplementedError
+
+    async def find_stale(self, cutoff: datetime) -> List[dict]:
+        """Jobs queued, or running, since before `cutoff`."""
+        raise NotImplementedError
+
+    async def claim(self, job_id: str, expected: dict, fields: dict) -> bool:
+        """Apply `fields` only if the job still matches `expected`; False if another worker got there first."""
+        raise NotImplementedError
+
+class InMemoryJobStore(JobStore):
+    """Jobs of this process only, oldest first; bounded by count and age."""
+    def __init__(self, max_jobs: int, ttl_seconds: float, clock=time.monotonic):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._jobs: Dict[str, dict] = {}
+        self._created: Dict[str, float] = {}
+
+    def _evict(self):
+        expired = self.clock() - self.ttl_seconds
+        for job_id, created in list(self._created.items()):
+            if created > expired and len(self._jobs) < self.max_jobs:
+                break
+            del self._jobs[job_id], self._created[job_id]
+
+    async def create(self, doc: dict) -> str:
+        self._evict()
+        job_id = str(ObjectId())
+        self._jobs[job_id] = dict(doc, _id=job_id)
+        self._created[job_id] = self.clock()
+        return job_id
+
+    async def update(self, job_id: str, fields: dict):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(fields)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def find_by_submissions(self, submission_ids: List[str]) -> List[dict]:
+        wanted = set(submission_ids)
+        return [dict(job) for job in self._jobs.values() if job.get("submission_id") in wanted]
+
+    async def find_previous(self, submitter_email: str, assignment_id: str) -> Optional[dict]:
+        for job in reversed(list(self._jobs.values())):
+            if (job.get("submitter_email") == submitter_email and job.get("assignment_id") == assignment_id
+                    and job.get("status") == JOB_COMPLETED):
+                return dict(job)
+        return None
+
+    async def find_stale(self, cutoff: datetime) -> List[dict]:
+        return [dict(job) for job in self._jobs.values()
+                if (job.get("status") == JOB_QUEUED and job.get("queued_at", cutoff) < cutoff)
+                or (job.get("status") == JOB_RUNNING and job.get("started_at", cutoff) < cutoff)]
+
+    async def claim(self, job_id: str, expected: dict, fields: dict) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or any(job.get(k) != v for k, v in expected.items()):
+            return False
+        job.update(fields)
+        return True
+
+class MongoJobStore(JobStore):
+    """Jobs live in the codes collection: the job id is the id of the analysis document."""
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def create(self, doc: dict) -> str:
+        result = await self.collection.insert_one(dict(doc))
+        return str(result.inserted_id)
+
+    async def update(self, job_id: str, fields: dict):
+        await self.collection.update_one({"_id": ObjectId(job_id)}, {"$set": fields})
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        if not ObjectId.is_valid(job_id):
+            return None
+        return await self.collection.find_one({"_id": ObjectId(job_id)})
+
+    async def find_by_submissions(self, submission_ids: List[str]) -> List[dict]:
+        return await self.collection.find(
+            {"submission_id": {"$in": submission_ids}}, {"code": 0}
+        ).to_list(length=None)
+
+    async def find_previous(self, submitter_email: str, assignment_id: str) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"submitter_email": submitter_email, "assignment_id": assignment_id, "status": JOB_COMPLETED},
+            {"code_hash": 1, "plagiarism_analysis": 1, "submitter_email": 1},
+            sort=[("_id", -1)]
+        )
+
+    async def find_stale(self, cutoff: datetime) -> List[dict]:
+        return await self.collection.find({"$or": [
+            {"status": JOB_QUEUED, "queued_at": {"$lt": cutoff}},
+            {"status": JOB_RUNNING, "started_at": {"$lt": cutoff}},
+        ]}).to_list(length=None)
+
+    async def claim(self, job_id: str, expected: dict, fields: dict) -> bool:
+        result = await self.collection.update_one(dict(expected, _id=ObjectId(job_id)), {"$set": fields})
+        return result.modified_count == 1
+
+class AnalysisQueue:
+    """Bounded in-process queue drained by a fixed pool of async workers.
+
+    Workers are started lazily on the first submit so that nothing needs to run at
+    import time. They are tasks of the serving process, so queued jobs only make
+    progress while it keeps running: deploy behind a long-lived server (uvicorn, as
+    in render.yaml). Under the Mangum handler the function is frozen once the
+    response is sent, so there use /plagiarism/check?stream=true, which analyses
+    inside the request, or run `python main.py recover-jobs` on a schedule. Jobs a
+    stopped worker left queued or running are requeued by `recover()` at startup.
+    """
+    def __init__(self, store: JobStore, workers: int, maxsize: int, service_time: float, clock=time.monotonic):
+        self.store = store
+        self.workers = workers
+        self.maxsize = maxsize
+        self.clock = clock
+        # Moving average of how long one job occupies a worker; drives Retry-After estimates
+        self.service_time = service_time
+        self._busy = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._done_events: Dict[str, asyncio.Event] = {}
+        self._listeners: List = []
+        self._handoffs: set = set()
+
+    def add_listener(self, callback):
+        """Register `async callback(job_id, doc, fields)`, awaited once a job reaches a final state."""
+        self._listeners.append(callback)
+
+    async def _finish(self, job_id: str, doc: dict, fields: dict):
+        await self.store.update(job_id, fields)
+        await self._notify(job_id, doc, fields)
+
+    async def _notify(self, job_id: str, doc: dict, fields: dict):
+        for callback in self._listeners:
+            try:
+                await callback(job_id, doc, fields)
+            except Exception:
+                logger.exception("Analysis job listener failed", extra={"fields": {"job_id": job_id}})
+
+    def estimated_wait(self) -> float:
+        """Seconds a job submitted now would wait before a worker picks it up."""
+        if self._queue is None:
+            return 0.0
+        ahead = self._queue.qsize() + self._busy - self.workers + 1
+        return max(0, ahead) * self.service_time / self.workers
+
+    def _queue_full(self) -> HTTPException:
+        # One worker frees up every service_time / workers seconds on average
+        retry_after = max(1, math.ceil(self.service_time / self.workers))
+        ADMISSION_REJECTIONS.inc("queue_full")
+        return HTTPException(status_code=429, detail="Analysis queue is full, please retry shortly",
+                             headers={"Retry-After": str(retry_after)})
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not all(t.done() for t in self._tasks):
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, doc: dict, payload: dict) -> str:
+        # Repeat analyses are answered from the cache without waiting behind LLM calls
+        if llm_service.available:
+            cached = await analysis_cache.get(analysis_cache_key(
+                payload["code"], payload["language"], payload.get("course_level"), payload.get("assignment_description")
+            ))
+            if cached is not None and payload.get("tests") and execution_engine.enabled:
+                execution = await execution_engine.cached(payload["code"], payload["language"], payload["tests"])
+                cached = apply_execution_metrics(cached, execution) if execution is not None else None
+            if cached is not None:
+                now = datetime.utcnow()
+                fields = {"status": JOB_COMPLETED, "plagiarism_analysis": cached,
+                          "cache_hit": True, "started_at": now, "completed_at": now}
+                job_id = await self.store.create(dict(doc, **fields))
+                await self._notify(job_id, doc, fields)
+                return job_id
+
+        self._ensure_started()
+        if self._queue.full():
+            raise self._queue_full()
+
+        job_doc = dict(doc, status=JOB_QUEUED, plagiarism_analysis=None, queued_at=datetime.utcnow())
+        job_id = await self.store.create(job_doc)
+        try:
+            self._queue.put_nowait((job_id, payload, doc))
+        except asyncio.QueueFull:
+            await self.store.update(job_id, {"status": JOB_FAILED, "error": "Analysis queue is full", "error_status": 429})
+            raise self._queue_full()
+        self._done_events[job_id] = asyncio.Event()
+        return job_id
+
+    async def recover(self, stale_seconds: float, max_recoveries: int) -> dict:
+        """Requeue jobs left queued or running longer than `stale_seconds` by a worker that stopped.
+
+        Each job is claimed with a conditional update, so concurrent recoveries take it
+        once. Jobs already recovered `max_recoveries` times, or whose code is gone, fail.
+        """
+        report = {"requeued": 0, "failed": 0, "skipped": 0}
+        cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+        for job in await self.store.find_stale(cutoff):
+            job_id = str(job["_id"])
+            since = "queued_at" if job["status"] == JOB_QUEUED else "started_at"
+            recoveries = job.get("recoveries", 0)
+            claimed = await self.store.claim(
+                job_id, {"status": job["status"], since: job.get(since)},
+                {"status": JOB_QUEUED, "queued_at": datetime.utcnow(), "recoveries": recoveries + 1}
+            )
+            if not claimed:
+                report["skipped"] += 1
+                continue
+            doc = {k: v for k, v in job.items()
+                   if k not in ("_id", "status", "plagiarism_analysis", "queued_at", "started_at", "recoveries")}
+            payload = await self._recovered_payload(doc) if recoveries < max_recoveries else None
+            if payload is None:
+                await self._finish(job_id, doc, {"status": JOB_FAILED,
+                                                 "error": "Analysis was interrupted and could not be resumed",
+                                                 "error_status": 500, "completed_at": datetime.utcnow()})
+                report["failed"] += 1
+            elif await self._enqueue(job_id, payload, doc):
+                report["requeued"] += 1
+            else:
+                report["failed"] += 1
+        if any(report.values()):
+            logger.info("Recovered analysis jobs", extra={"fields": report})
+        return report
+
+    async def _enqueue(self, job_id: str, payload: dict, doc: dict) -> bool:
+        """Put an existing queued job on this process's queue; fails the job if the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((job_id, payload, doc))
+        except asyncio.QueueFull:
+            await self._finish(job_id, doc, {"status": JOB_FAILED, "error": "Analysis queue is full",
+                                             "error_status": 429, "completed_at": datetime.utcnow()})
+            return False
+        self._done_events[job_id] = asyncio.Event()
+        return True
+
+    def hand_off(self, job_id: str, doc: dict, payload: dict):
+        """Finish a job whose request went away on the worker pool, in a task of its own.
+
+        The request's task is being cancelled, so nothing it awaits can be relied on.
+        """
+        async def requeue():
+            try:
+                await self.store.update(job_id, {"status": JOB_QUEUED, "queued_at": datetime.utcnow()})
+                await self._enqueue(job_id, payload, doc)
+            except Exception:
+                logger.exception("Analysis job hand-off failed", extra={"fields": {"job_id": job_id}})
+
+        task = asyncio.get_running_loop().create_task(requeue())
+        self._handoffs.add(task)
+        task.add_done_callback(self._handoffs.discard)
+
+    async def _recovered_payload(self, doc: dict) -> Optional[dict]:
+        """Rebuild the worker payload of a persisted job: its code and analysis arguments."""
+        code = await code_blobs.get(doc["code_hash"]) if doc.get("code_hash") else None
+        if code is None:
+            return None
+        payload = {"code": code, "language": doc.get("language"), "course_level": doc.get("course_level"),
+                   "assignment_description": doc.get("assignment_description"),
+                   "contest_id": doc.get("contest_id")}
+        ref = ("id", doc["question_id"]) if doc.get("question_id") else ("title", doc.get("question_title"))
+        if execution_engine.enabled and doc.get("contest_id") and ref[1]:
+            _, question = await contest_cache.get_question(doc["contest_id"], ref)
+            if question is not None:
+                payload["tests"] = await load_test_set(doc["contest_id"], question)
+        return payload
+
+    async def _worker(self):
+        # The task inherited the context of whichever request started it; its LLM
+        # calls belong to no request's Server-Timing header
+        _request_spans.set(None)
+        while True:
+            job_id, payload, doc = await self._queue.get()
+            self._busy += 1
+            started = self.clock()
+            try:
+                await self._run(job_id, payload, doc)
+            except Exception as e:
+                logger.exception("Analysis worker error", extra={"fields": {"job_id": job_id}})
+            finally:
+                self._busy -= 1
+                self.service_time = 0.8 * self.service_time + 0.2 * (self.clock() - started)
+                event = self._done_events.pop(job_id, None)
+                if event:
+                    event.set()
+                self._queue.task_done()
+
+    async def _previous_analysis(self, doc: dict) -> Optional[dict]:
+        """Base for an incremental analysis: the submitter's last LLM analysis of this assignment.
+
+        `previous_submissions` (submission ids) narrows the choice when the client sends it.
+        """
+        email = doc.get("submitter_email")
+        if not (settings.INCREMENTAL_ANALYSIS and llm_service.available and email):
+            return None
+        if doc.get("previous_submissions"):
+            jobs = [j for j in await self.store.find_by_submissions(doc["previous_submissions"])
+                    if j.get("submitter_email") == email and j.get("status") == JOB_COMPLETED]
+            job = max(jobs, key=lambda j: str(j["_id"]), default=None)
+        elif doc.get("assignment_id"):
+            job = await self.store.find_previous(email, doc["assignment_id"])
+        else:
+            return None
+        analysis = (job or {}).get("plagiarism_analysis")
+        # Local fallbacks and mocks are placeholders, not something to build on
+        if not analysis or analysis.get("analysis_mode") in ("local_fallback", "mock") or not job.get("code_hash"):
+            return None
+        code = await code_blobs.get(job["code_hash"])
+        if code is None:
+            return None
+        return {"job_id": str(job["_id"]), "code": code, "analysis": analysis}
+
+    async def _run(self, job_id: str, payload: dict, doc: dict):
+        await self.store.update(job_id, {"status": JOB_RUNNING, "started_at": datetime.utcnow()})
+        analysis_args = {k: v for k, v in payload.items() if k != "tests"}
+        tests = payload.get("tests")
+        try:
+            try:
+                analysis_args["previous"] = await self._previous_analysis(doc)
+            except Exception:
+                logger.exception("Previous analysis lookup failed", extra={"fields": {"job_id": job_id}})
+            if tests and execution_engine.enabled:
+                # Test cases run alongside the LLM call; their measurements replace its guesses
+                result, execution = await asyncio.gather(
+                    run_plagiarism_analysis(**analysis_args),
+                    execution_engine.run(payload["code"], payload["language"], tests)
+                )
+                result = apply_execution_metrics(result, execution)
+            else:
+                result = await run_plagiarism_analysis(**analysis_args)
+        except AnalysisError as e:
+            await self._finish(job_id, doc, {
+                "status": JOB_FAILED,
+                "error": e.detail,
+                "error_status": e.status_code,
+                "completed_at": datetime.utcnow()
+            })
+            return
+        except Exception as e:
+            await self._finish(job_id, doc, {
+                "status": JOB_FAILED,
+                "error": f"Plagiarism detection error: {str(e)}",
+                "error_status": 500,
+                "completed_at": datetime.utcnow()
+            })
+            return
+
+        await self._finish(job_id, doc, {
+            "status": JOB_COMPLETED,
+            "plagiarism_analysis": result,
+            "completed_at": datetime.utcnow()
+        })
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Return the job once it is finished, or its current state after `timeout` seconds."""
+        job = await self.store.get(job_id)
+        if not job or job.get("status") in (JOB_COMPLETED, JOB_FAILED) or timeout <= 0:
+            return job
+
+        event = self._done_events.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self.store.get(job_id)
+
+        # Job is owned by another worker process - poll the persistent store
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(min(0.5, max(0.0, deadline - loop.time())))
+            job = await self.store.get(job_id)
+            if not job or job.get("status") in (JOB_COMPLETED, JOB_FAILED):
+                break
+        return job
+
+async def authorize_job_access(job: dict, current_user: dict):
+    """The submitter may read their job; a teacher only jobs from contests they own."""
+    if job.get("submitter_email") == current_user["email"]:
+        return
+    if current_user["role"] == "teacher":
+        contest_id = job.get("contest_id")
+        contest = await contest_cache.get_by_id(contest_id) if contest_id and ObjectId.is_valid(contest_id) else None
+        if contest and contest.get("teacher_email") == current_user["email"]:
+            return
+    raise HTTPException(status_code=403, detail="Not authorized to view this job")
+
+def serialize_job(job: dict) -> dict:
+    out = {
+        "job_id": str(job["_id"]),
+        "status": job.get("status", JOB_COMPLETED),
+        "plagiarism_analysis": job.get("plagiarism_analysis"),
+    }
+    if job.get("error"):
+        out["error"] = job["error"]
+    if job.get("style_drift"):
+        out["style_drift"] = job["style_drift"]
+    for key in ("submission_timestamp", "started_at", "completed_at"):
+        if isinstance(job.get(key), datetime):
+            out[key] = job[key].isoformat()
+    return out
+
+if settings.ANALYSIS_JOB_STORE == "memory":
+    analysis_store: JobStore = InMemoryJobStore(settings.ANALYSIS_MEMORY_JOB_LIMIT,
+                                                settings.ANALYSIS_MEMORY_JOB_TTL_SECONDS)
+else:
+    analysis_store = MongoJobStore(codes_collection)
+
+analysis_queue = AnalysisQueue(analysis_store, settings.ANALYSIS_WORKERS, settings.ANALYSIS_QUEUE_SIZE,
+                               settings.ANALYSIS_SERVICE_TIME_SECONDS)
+
+# =========================
+# Admission Control
+# =========================
+# Every analysis is a paid, slow LLM call, so LLM-backed endpoints are admitted
+# before any work starts: per-user and per-contest token buckets bound how fast
+# anyone can spend model calls, and requests are shed while the analysis backlog
+# is longer than ANALYSIS_MAX_QUEUE_WAIT_SECONDS. Refusals are 429s whose
+# Retry-After is when the request would actually be admitted.
+class RateLimitStore:
+    """Token bucket state. Rates are tokens per second; buckets start full."""
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens from bucket `key`. Returns 0 when admitted, else seconds until it would be."""
+        raise NotImplementedError
+
+    async def refund(self, key: str, burst: float, cost: float = 1.0):
+        """Give back tokens taken for a request that was refused further along."""
+        raise NotImplementedError
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """Buckets of this process only; each worker enforces the limits on its own."""
+    def __init__(self, max_keys: int = 100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: Dict[str, list] = {}
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now, rate, burst)
+            bucket = self._buckets[key] = [burst, now]
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / rate
+
+    async def refund(self, key: str, burst: float, cost: float = 1.0):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(burst, bucket[0] + cost)
+
+    def _prune(self, now: float, rate: float, burst: float):
+        # A bucket that has refilled is indistinguishable from a missing one
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+class MongoRateLimitStore(RateLimitStore):
+    """Buckets shared by every worker. Refill and take are one atomic pipeline update."""
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.time()
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$refilled_at", now]}]}]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]},
+                                                             {"$multiply": [elapsed, rate]}]}]},
+                          "refilled_at": now}},
+                {"$set": {"admitted": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$admitted", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                          # An idle bucket is full again after burst / rate seconds; drop it then
+                          "expires_at": datetime.utcnow() + timedelta(seconds=burst / rate)}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["admitted"]:
+            return 0.0
+        return (cost - doc["tokens"]) / rate
+
+    async def refund(self, key: str, burst: float, cost: float = 1.0):
+        await self.collection.update_one({"_id": key}, [{"$set": {"tokens": {"$min": [burst, {"$add": ["$tokens", cost]}]}}}])
+
+class AdmissionController:
+    """Admits or refuses an LLM-backed request. A rate of 0 disables that bucket."""
+    def __init__(self, store: RateLimitStore, queue: AnalysisQueue, user_per_minute: float, user_burst: float,
+                 contest_per_minute: float, contest_burst: float, max_queue_wait: float):
+        self.store = store
+        self.queue = queue
+        self.user_rate = user_per_minute / 60
+        self.user_burst = user_burst
+        self.contest_rate = contest_per_minute / 60
+        self.contest_burst = contest_burst
+        self.max_queue_wait = max_queue_wait
+
+    @staticmethod
+    def _reject(reason: str, retry_after: float, detail: str):
+        ADMISSION_REJECTIONS.inc(reason)
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    async def _take(self, key: str, rate: float, burst: float) -> float:
+        if rate <= 0:
+            return 0.0
+        try:
+            return await self.store.take(key, rate, burst)
+        except Exception as e:
+            # A broken limiter must not take the endpoints down with it
+            logger.warning("Rate limit store unavailable", extra={"fields": {"error": str(e)}})
+            return 0.0
+
+    async def admit(self, user_email: str, contest_id: Optional[str] = None):
+        # Shed first, so a request refused for load does not spend the user's tokens
+        wait = self.queue.estimated_wait()
+        if wait > self.max_queue_wait:
+            self._reject("backlog", wait - self.max_queue_wait, "Analysis backlog is too long, please retry later")
+
+        user_key = f"user:{user_email}"
+        retry_after = await self._take(user_key, self.user_rate, self.user_burst)
+        if retry_after:
+            self._reject("user", retry_after, "Too many analysis requests, please slow down")
+
+        if contest_id:
+            retry_after = await self._take(f"contest:{contest_id}", self.contest_rate, self.contest_burst)
+            if retry_after:
+                await self.refund(user_email)
+                self._reject("contest", retry_after, "This contest is receiving too many submissions, please retry shortly")
+
+    async def refund(self, user_email: str, contest_id: Optional[str] = None):
+        """Return the tokens `admit` took, for a request refused after admission (queue full)."""
+        buckets = [(f"user:{user_email}", self.user_rate, self.user_burst)]
+        if contest_id:
+            buckets.append((f"contest:{contest_id}", self.contest_rate, self.contest_burst))
+        for key, rate, burst in buckets:
+            if rate <= 0:
+                continue
+            try:
+                await self.store.refund(key, burst)
+            except Exception:
+                pass
+
+if settings.RATE_LIMIT_STORE == "mongo":
+    rate_limit_store: RateLimitStore = MongoRateLimitStore(rate_limits_collection)
+else:
+    rate_limit_store = InMemoryRateLimitStore()
+
+admission = AdmissionController(
+    rate_limit_store,
+    analysis_queue,
+    user_per_minute=settings.RATE_LIMIT_USER_PER_MINUTE,
+    user_burst=settings.RATE_LIMIT_USER_BURST,
+    contest_per_minute=settings.RATE_LIMIT_CONTEST_PER_MINUTE,
+    contest_burst=settings.RATE_LIMIT_CONTEST_BURST,
+    max_queue_wait=settings.ANALYSIS_MAX_QUEUE_WAIT_SECONDS,
+)
+
+# =========================
+# Streaming Analysis
+# =========================
+class IncrementalJSONFieldParser:
+    """Emits (key, value) for each top-level field of a JSON object as soon as it closes.
+
+    Feed it the model output chunk by chunk; it scans each character once.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+
+    def _finish_value(self, end: int, out: list):
+        if self._key is not None and self._value_start is not None:
+            try:
+                out.append((self._key, json.loads(self.buffer[self._value_start:end])))
+            except json.JSONDecodeError:
+                pass
+        self._key = None
+        self._value_start = None
+
+    def feed(self, chunk: str) -> List[tuple]:
+        self.buffer += chunk
+        out = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._key_start is not None:
+                        self._key = json.loads(buf[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            at_top = self._depth == 1
+            if ch == '"':
+                self._in_str = True
+                if at_top and self._key is None:
+                    self._key_start = i
+                elif at_top and self._value_start is None:
+                    self._value_start = i
+            elif ch in "{[":
+                if at_top and self._key is not None and self._value_start is None:
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_value(i, out)
+            elif ch == "," and at_top:
+                self._finish_value(i, out)
+            elif at_top and ch != ":" and not ch.isspace() and self._key is not None and self._value_start is None:
+                self._value_start = i
+        self._pos = len(buf)
+        return out
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_plagiarism_analysis(submission_data: dict, code, language, course_level=None,
+                                     assignment_description=None):
+    """SSE body for /plagiarism/check?stream=true.
+
+    Events: `token` (raw model deltas), `field` (a top-level result field once it has
+    closed), `done` (final document, after it is persisted) and `error`. If the client
+    disconnects first, the job is handed to the analysis queue.
+    """
+    job_id = await analysis_store.create(dict(submission_data, status=JOB_RUNNING, plagiarism_analysis=None,
+                                              started_at=datetime.utcnow()))
+    finished = False
+    try:
+        yield sse_event("job", {"id": job_id, "job_id": job_id})
+
+        result = None
+        cache_key = analysis_cache_key(code, language, course_level, assignment_description)
+        if not llm_service.available:
+            result = generate_mock_analysis(code, language)
+        else:
+            result = await analysis_cache.get(cache_key)
+
+        try:
+            fields_streamed = False
+            if result is None:
+                messages, budget = build_analysis_messages(code, language, course_level, assignment_description)
+                parser = IncrementalJSONFieldParser()
+                try:
+                    async for delta in llm_service.stream_chat(
+                        messages,
+                        # Same context as run_full_analysis, so streamed calls count towards the contest's usage
+                        usage_context={"purpose": "plagiarism_analysis_stream",
+                                       "contest_id": submission_data.get("contest_id"), **budget},
+                        response_format={"type": "json_object"},
+                        max_tokens=settings.PROMPT_MAX_OUTPUT_TOKENS,
+                        temperature=0.2
+                    ):
+                        yield sse_event("token", {"delta": delta})
+                        for name, value in parser.feed(delta):
+                            yield sse_event("field", {"name": name, "value": value})
+                    fields_streamed = True
+                except LLMUnavailableError as e:
+                    result = generate_local_analysis(code, language, reason=str(e))
+
+                if fields_streamed:
+                    try:
+                        result = json.loads(parser.buffer)
+                    except json.JSONDecodeError:
+                        raise AnalysisError(500, "Failed to parse plagiarism analysis result")
+                    await analysis_cache.set(cache_key, result)
+
+            if not fields_streamed:
+                # Cached, mock or fallback results arrive whole - replay them as field events
+                for name, value in result.items():
+                    yield sse_event("field", {"name": name, "value": value})
+        except AnalysisError as e:
+            await analysis_store.update(job_id, {"status": JOB_FAILED, "error": e.detail,
+                                                 "error_status": e.status_code, "completed_at": datetime.utcnow()})
+            finished = True
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            detail = f"OpenAI API error: {str(e)}"
+            await analysis_store.update(job_id, {"status": JOB_FAILED, "error": detail, "error_status": 502,
+                                                 "completed_at": datetime.utcnow()})
+            finished = True
+            yield sse_event("error", {"status_code": 502, "detail": detail})
+            return
+
+        await analysis_store.update(job_id, {"status": JOB_COMPLETED, "plagiarism_analysis": result,
+                                             "completed_at": datetime.utcnow()})
+        finished = True
+        yield sse_event("done", {"id": job_id, "plagiarism_analysis": result})
+    finally:
+        if not finished:
+            # The client disconnected mid-analysis: the job completes on the queue and stays pollable
+            analysis_queue.hand_off(job_id, submission_data, {
+                "code": code, "language": language, "course_level": course_level,
+                "assignment_description": assignment_description, "contest_id": submission_data.get("contest_id"),
+            })
+
+# =========================
+# Live Submission Feed
+# =========================
+# Teachers watching a contest get new submissions and their analysis results pushed
+# over a WebSocket instead of re-reading every submission on each poll.
+FEED_SUBMISSION = "submission"
+FEED_ANALYSIS = "analysis"
+
+class FeedSubscription:
+    """One subscriber's bounded event queue. A `None` event means it fell behind and was dropped."""
+    def __init__(self, maxsize: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, event: dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # Make room for the sentinel; the client resumes from its cursor on reconnect
+            self.overflowed = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+            return False
+
+    async def get(self) -> Optional[dict]:
+        return await self._queue.get()
+
+class FeedBroker:
+    """Fan-out of feed events to the subscribers of a channel.
+
+    InMemoryFeedBroker only reaches subscribers connected to the same process; a
+    multi-worker deployment needs a shared implementation (Redis pub/sub, NATS, ...)
+    that delivers published events to every worker's local subscribers.
+    """
+    async def publish(self, channel: str, event: dict):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> FeedSubscription:
+        raise NotImplementedError
+
+    def unsubscribe(self, channel: str, subscription: FeedSubscription):
+        raise NotImplementedError
+
+class InMemoryFeedBroker(FeedBroker):
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._channels: Dict[str, set] = {}
+
+    async def publish(self, channel: str, event: dict):
+        for subscription in list(self._channels.get(channel, ())):
+            if not subscription.deliver(event):
+                self.unsubscribe(channel, subscription)
+
+    def subscribe(self, channel: str) -> FeedSubscription:
+        subscription = FeedSubscription(self.queue_size)
+        self._channels.setdefault(channel, set()).add(subscription)
+        FEED_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, channel: str, subscription: FeedSubscription):
+        subscribers = self._channels.get(channel)
+        if subscribers and subscription in subscribers:
+            subscribers.discard(subscription)
+            FEED_SUBSCRIBERS.dec()
+            if not subscribers:
+                del self._channels[channel]
+
+def _submission_summary(doc: dict) -> dict:
+    submitted_at = doc.get("submitted_at")
+    return {
+        "submission_id": str(doc["_id"]),
+        "student_email": doc.get("student_email"),
+        "question_title": doc.get("question_title"),
+        "language": doc.get("language"),
+        "submitted_at": submitted_at.isoformat() if isinstance(submitted_at, datetime) else submitted_at,
+    }
+
+def _analysis_summary(job_id: str, submission_id: str, fields: dict) -> dict:
+    analysis = fields.get("plagiarism_analysis") or {}
+    return {
+        "submission_id": submission_id,
+        "job_id": job_id,
+        "status": fields.get("status"),
+        "plagiarism_detected": analysis.get("plagiarism_detected"),
+        "confidence_score": analysis.get("confidence_score"),
+        "likely_source": analysis.get("likely_source"),
+        "error": fields.get("error"),
+    }
+
+class SubmissionFeed:
+    """Per-contest stream of submission and analysis events.
+
+    Events are `{"type", "cursor", "data"}`; `cursor` is the submission id, and a
+    client that reconnects with its last cursor is backfilled from `submissions`
+    before live events resume.
+    """
+    def __init__(self, broker: FeedBroker, submissions, jobs: JobStore):
+        self.broker = broker
+        self.submissions = submissions
+        self.jobs = jobs
+
+    @staticmethod
+    def channel(contest_id: str) -> str:
+        return f"contest:{contest_id}"
+
+    async def publish_submission(self, doc: dict):
+        await self.broker.publish(self.channel(doc["contest_id"]), {
+            "type": FEED_SUBMISSION, "cursor": str(doc["_id"]), "data": _submission_summary(doc),
+        })
+
+    async def publish_analysis(self, job_id: str, doc: dict, fields: dict):
+        # Only jobs created by submit_code belong to a contest feed
+        if not doc.get("contest_id") or not doc.get("submission_id"):
+            return
+        await self.broker.publish(self.channel(doc["contest_id"]), {
+            "type": FEED_ANALYSIS, "cursor": doc["submission_id"],
+            "data": _analysis_summary(job_id, doc["submission_id"], fields),
+        })
+
+    async def backfill(self, contest_id: str, cursor: Optional[str], batch_size: int = 200):
+        """Submissions after `cursor` (all of them when None), each followed by its finished analysis."""
+        query = {"contest_id": contest_id}
+        if cursor:
+            query["_id"] = {"$gt": ObjectId(cursor)}
+        projection = {"student_email": 1, "question_title": 1, "language": 1, "submitted_at": 1}
+        db_cursor = self.submissions.find(query, projection).sort("_id", ASCENDING)
+        while True:
+            docs = await db_cursor.to_list(length=batch_size)
+            if not docs:
+                return
+            jobs = await self.jobs.find_by_submissions([str(d["_id"]) for d in docs])
+            finished = {j["submission_id"]: j for j in jobs if j.get("status") in (JOB_COMPLETED, JOB_FAILED)}
+            for doc in docs:
+                submission_id = str(doc["_id"])
+                yield {"type": FEED_SUBMISSION, "cursor": submission_id, "data": _submission_summary(doc)}
+                job = finished.get(submission_id)
+                if job is not None:
+                    yield {"type": FEED_ANALYSIS, "cursor": submission_id,
+                           "data": _analysis_summary(str(job["_id"]), submission_id, job)}
+
+submission_feed = SubmissionFeed(InMemoryFeedBroker(settings.FEED_QUEUE_SIZE), submissions_collection, analysis_store)
+analysis_queue.add_listener(submission_feed.publish_analysis)
+
+# =========================
+# Contest Stats
+# =========================
+# Per-contest counters (overall and per question) maintained with $inc/$max as
+# submissions and analyses are written, so the teacher dashboard reads one document
+# instead of aggregating every submission. Distinct participants are tracked in
+# contest_participants: one document per (contest, student) whose upsert or
+# $addToSet tells whether a submission is the student's first in the contest or
+# for the question. rebuild_contest_stats recomputes everything from the source
+# collections.
+def question_stats_key(question_title: str) -> str:
+    # Titles can hold "." and "$", which field paths cannot
+    return hashlib.sha1((question_title or "").encode("utf-8")).hexdigest()[:16]
+
+class ContestStats:
+    def __init__(self, collection, participants):
+        self.collection = collection
+        self.participants = participants
+
+    async def record_submission(self, doc: dict):
+        """Count a stored submission (`doc` as inserted into submissions)."""
+        contest_id = doc["contest_id"]
+        key = question_stats_key(doc["question_title"])
+        membership = await self.participants.update_one(
+            {"_id": {"contest_id": contest_id, "student_email": doc["student_email"]}},
+            {"$addToSet": {"questions": key}},
+            upsert=True
+        )
+        new_participant = membership.upserted_id is not None
+        new_in_question = new_participant or membership.modified_count == 1
+
+        question = f"questions.{key}"
+        await self.collection.update_one(
+            {"_id": contest_id},
+            {
+                "$inc": {
+                    "submissions": 1,
+                    "participants": int(new_participant),
+                    f"{question}.submissions": 1,
+                    f"{question}.participants": int(new_in_question),
+                },
+                "$max": {"last_submission_at": doc["submitted_at"], f"{question}.last_submission_at": doc["submitted_at"]},
+                "$set": {f"{question}.question_title": doc["question_title"], "updated_at": datetime.utcnow()},
+            },
+            upsert=True
+        )
+
+    async def record_analysis(self, job_id: str, doc: dict, fields: dict):
+        """Analysis job listener: count completed analyses of contest submissions."""
+        if not doc.get("contest_id") or not doc.get("submission_id") or fields.get("status") != JOB_COMPLETED:
+            return
+        analysis = fields.get("plagiarism_analysis") or {}
+        confidence = _as_int(analysis.get("confidence_score"))
+        flagged = int(bool(analysis.get("plagiarism_detected")))
+        question = f"questions.{question_stats_key(doc.get('question_title'))}"
+        await self.collection.update_one(
+            {"_id": doc["contest_id"]},
+            {
+                "$inc": {
+                    "analyzed": 1, "flagged": flagged, "confidence_sum": confidence,
+                    f"{question}.analyzed": 1, f"{question}.flagged": flagged,
+                    f"{question}.confidence_sum": confidence,
+                },
+                "$max": {"max_confidence": confidence, f"{question}.max_confidence": confidence},
+                "$set": {f"{question}.question_title": doc.get("question_title"), "updated_at": datetime.utcnow()},
+            },
+            upsert=True
+        )
+
+    async def get(self, contest_id: str) -> dict:
+        doc = await self.collection.find_one({"_id": contest_id}) or {}
+        return serialize_contest_stats(contest_id, doc)
+
+def serialize_contest_stats(contest_id: str, doc: dict) -> dict:
+    def counters(d: dict) -> dict:
+        analyzed = d.get("analyzed", 0)
+        last = d.get("last_submission_at")
+        return {
+            "submissions": d.get("submissions", 0),
+            "participants": d.get("participants", 0),
+            "analyzed": analyzed,
+            "flagged": d.get("flagged", 0),
+            "average_confidence": round(d.get("confidence_sum", 0) / analyzed, 1) if analyzed else None,
+            "max_confidence": d.get("max_confidence"),
+            "last_submission_at": last.isoformat() if isinstance(last, datetime) else last,
+        }
+
+    questions = sorted((doc.get("questions") or {}).values(), key=lambda q: q.get("question_title") or "")
+    return dict(
+        counters(doc),
+        contest_id=contest_id,
+        questions=[dict(counters(q), question_title=q.get("question_title")) for q in questions],
+    )
+
+async def rebuild_contest_stats(contest_id: Optional[str] = None, check: bool = False) -> dict:
+    """Recompute contest_stats and contest_participants from submissions and analysis jobs.
+
+    With check=True nothing is written; the report lists contests whose stored stats
+    differ from the recomputed ones. Increments that land while a rebuild runs can be
+    lost, so rebuild during a quiet period (or re-check afterwards).
+    """
+    match = {"contest_id": contest_id} if contest_id else {"contest_id": {"$exists": True}}
+    stats: Dict[str, dict] = {}
+    members: Dict[tuple, set] = {}
+
+    async for row in submissions_collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"contest_id": "$contest_id", "question_title": "$question_title"},
+            "submissions": {"$sum": 1},
+            "students": {"$addToSet": "$student_email"},
+            "last_submission_at": {"$max": "$submitted_at"},
+        }},
+    ]):
+        contest, title = row["_id"]["contest_id"], row["_id"]["question_title"]
+        key = question_stats_key(title)
+        doc = stats.setdefault(contest, {"_id": contest, "questions": {}})
+        doc["questions"][key] = {
+            "question_title": title,
+            "submissions": row["submissions"],
+            "participants": len(row["students"]),
+            "last_submission_at": row["last_submission_at"],
+        }
+        for student in row["students"]:
+            members.setdefault((contest, student), set()).add(key)
+
+    async for row in codes_collection.aggregate([
+        {"$match": dict(match, status=JOB_COMPLETED, submission_id={"$exists": True})},
+        {"$group": {
+            "_id": {"contest_id": "$contest_id", "question_title": "$question_title"},
+            "analyzed": {"$sum": 1},
+            "flagged": {"$sum": {"$cond": [{"$eq": ["$plagiarism_analysis.plagiarism_detected", True]}, 1, 0]}},
+            # Parsed here with the same _as_int as record_analysis, so both paths round alike
+            "confidences": {"$push": {"$ifNull": ["$plagiarism_analysis.confidence_score", None]}},
+        }},
+    ]):
+        contest, title = row["_id"]["contest_id"], row["_id"]["question_title"]
+        doc = stats.setdefault(contest, {"_id": contest, "questions": {}})
+        question = doc["questions"].setdefault(question_stats_key(title), {"question_title": title})
+        confidences = [_as_int(value) for value in row["confidences"]]
+        question.update({
+            "analyzed": row["analyzed"],
+            "flagged": row["flagged"],
+            "confidence_sum": sum(confidences),
+            "max_confidence": max(confidences),
+        })
+
+    for doc in stats.values():
+        questions = doc["questions"].values()
+        for field in ("submissions", "analyzed", "flagged", "confidence_sum"):
+            doc[field] = sum(q.get(field, 0) for q in questions)
+        doc["participants"] = sum(1 for (contest, _) in members if contest == doc["_id"])
+        doc["max_confidence"] = max((q["max_confidence"] for q in questions if "max_confidence" in q), default=None)
+        doc["last_submission_at"] = max(
+            (q["last_submission_at"] for q in questions if q.get("last_submission_at")), default=None)
+
+    mismatched = []
+    for contest, doc in stats.items():
+        stored = await contest_stats_collection.find_one({"_id": contest}) or {}
+        if serialize_contest_stats(contest, stored) != serialize_contest_stats(contest, doc):
+            mismatched.append(contest)
+    report = {"check": check, "contests": len(stats), "participants": len(members), "mismatched": mismatched}
+    if check:
+        return report
+
+    now = datetime.utcnow()
+    for contest, doc in stats.items():
+        doc = {k: v for k, v in doc.items() if v is not None}
+        await contest_stats_collection.replace_one({"_id": contest}, dict(doc, updated_at=now), upsert=True)
+        await contest_participants_collection.delete_many({"_id.contest_id": contest})
+        contest_members = [
+            {"_id": {"contest_id": c, "student_email": s}, "questions": sorted(keys)}
+            for (c, s), keys in members.items() if c == contest
+        ]
+        if contest_members:
+            await contest_participants_collection.insert_many(contest_members)
+    return report
+
+contest_stats = ContestStats(contest_stats_collection, contest_participants_collection)
+analysis_queue.add_listener(contest_stats.record_analysis)
+
+# =========================
+# Contest Cache
+# =========================
+# Starting a contest sends every student to /contest/by-code and /contest/active at
+# once, and every submission re-reads the contest. Contests change rarely (start, end,
+# add question), so they are served from memory between writes.
+def index_questions(questions: List[dict]) -> Dict[tuple, dict]:
+    """Lookup map of a contest's questions by ("id", id) and ("title", title)."""
+    index = {}
+    for question in questions:
+        if question.get("id"):
+            index[("id", question["id"])] = question
+        index.setdefault(("title", question.get("title")), question)
+    return index
+
+class ContestCache:
+    """Read-through cache of contest documents and the active-contest list.
+
+    Every write through the routers calls invalidate(), which bumps `version` and
+    drops all entries; a load that started before the bump is not stored. Writes
+    made by other workers are picked up from a change stream when the deployment
+    has one (replica sets), and otherwise within `ttl_seconds`. Concurrent misses
+    for the same key share one DB fetch.
+
+    Cached documents are shared between requests: callers copy before mutating.
+
+    Each cached contest also gets a question map (by id and by title), so submission
+    validation is a dict lookup. When the contest itself is not cached, get_question
+    fetches only the matching question with an $elemMatch projection.
+    """
+    def __init__(self, collection, max_entries: int, ttl_seconds: float, watch: bool = True):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.watch = watch
+        self.version = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._questions: "OrderedDict[str, tuple]" = OrderedDict()  # contest id -> (contest, map, expires)
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+        self._questions.clear()
+
+    def _ensure_watcher(self):
+        if not self.watch:
+            return
+        loop = asyncio.get_running_loop()
+        if self._watcher is not None and self._watcher.get_loop() is loop and not self._watcher.done():
+            return
+        self._watcher = loop.create_task(self._watch_changes())
+
+    async def _watch_changes(self):
+        try:
+            async with self.collection.watch() as stream:
+                async for _ in stream:
+                    self.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Standalone servers have no change streams; the TTL bounds staleness instead
+            self.watch = False
+            logger.info("Contest change stream unavailable", extra={"fields": {"error": str(e)}})
+
+    async def _get(self, key: tuple, loader):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            CONTEST_CACHE_REQUESTS.inc("hit")
+            return entry[0]
+
+        self._ensure_watcher()
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            CONTEST_CACHE_REQUESTS.inc("coalesced")
+            return await asyncio.shield(task)
+
+        CONTEST_CACHE_REQUESTS.inc("miss")
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._inflight[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    async def _load(self, key: tuple, loader):
+        version = self.version
+        value = await loader()
+        if version == self.version:
+            expires = time.monotonic() + self.ttl_seconds
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if key[0] in ("id", "code") and value is not None:
+                contest_id = str(value["_id"])
+                self._questions[contest_id] = (value, index_questions(value.get("questions", [])), expires)
+                self._questions.move_to_end(contest_id)
+                while len(self._questions) > self.max_entries:
+                    self._questions.popitem(last=False)
+        return value
+
+    async def get_by_id(self, contest_id: str) -> Optional[dict]:
+        object_id = ObjectId(contest_id)
+        return await self._get(("id", contest_id), lambda: self.collection.find_one({"_id": object_id}))
+
+    async def get_question(self, contest_id: str, ref: tuple) -> tuple:
+        """(contest, question) for ref = ("id", question_id) or ("title", title).
+
+        contest is None when the contest does not exist and question is None when it
+        has no such question. On the $elemMatch path the returned contest holds only
+        _id, teacher_email, is_active and the matching question.
+        """
+        indexed = self._questions.get(contest_id)
+        if indexed is not None and indexed[2] > time.monotonic():
+            CONTEST_CACHE_REQUESTS.inc("hit")
+            return indexed[0], indexed[1].get(ref)
+        contest = await self._get(("question", contest_id) + ref, lambda: self.collection.find_one(
+            {"_id": ObjectId(contest_id)},
+            {"teacher_email": 1, "is_active": 1, "questions": {"$elemMatch": {ref[0]: ref[1]}}},
+        ))
+        if contest is None:
+            return None, None
+        return contest, (contest.get("questions") or [None])[0]
+
+    async def get_by_code(self, code: str) -> Optional[dict]:
+        # Unknown codes are cached too (as None); create_contest invalidates
+        return await self._get(("code", code), lambda: self.collection.find_one({"contest_code": code}))
+
+    async def active_contests(self) -> Response:
+        # The rendered body is cached, so hits do no serialization. Each request still
+        # gets its own Response: middlewares (CORS) edit the outgoing header list in place
+        body = await self._get(("active",), self._render_active)
+        return Response(body, media_type="application/json")
+
+    async def _render_active(self) -> bytes:
+        return (await list_documents(self.collection, {"is_active": True})).body
+
+contest_cache = ContestCache(
+    contests_collection,
+    max_entries=settings.CONTEST_CACHE_SIZE,
+    ttl_seconds=settings.CONTEST_CACHE_TTL_SECONDS,
+    watch=settings.CONTEST_CACHE_WATCH,
+)
+
+async def backfill_question_ids() -> dict:
+    """Give questions created before stable ids one, so submissions can reference them.
+
+    Each contest is rewritten conditionally on its question_revision; a contest edited
+    meanwhile is skipped and picked up by the next run.
+    """
+    report = {"contests": 0, "questions": 0, "skipped": 0}
+    async for contest in contests_collection.find(
+        {"questions": {"$elemMatch": {"id": {"$exists": False}}}}, {"questions": 1, "question_revision": 1}
+    ):
+        questions = contest["questions"]
+        missing = [q for q in questions if not q.get("id")]
+        for q in missing:
+            q["id"] = new_question_id()
+        revision = contest.get("question_revision")
+        result = await contests_collection.update_one(
+            {"_id": contest["_id"], "question_revision": revision},
+            {"$set": {"questions": questions, "question_revision": (revision or 0) + 1}}
+        )
+        if result.matched_count:
+            report["contests"] += 1
+            report["questions"] += len(missing)
+        else:
+            report["skipped"] += 1
+    contest_cache.invalidate()
+    return report
+
+async def migrate_question_test_keys() -> dict:
+    """Re-key hidden test cases stored by question title onto the question's stable id.
+
+    Questions get ids first. A title-keyed document whose question already has
+    id-keyed cases is superseded and dropped; one whose question no longer exists
+    (renamed or deleted before the migration) is left in place and reported as orphaned.
+    """
+    await backfill_question_ids()
+    report = {"migrated": 0, "superseded": 0, "orphaned": 0}
+    ids_by_contest: Dict[str, Dict[str, str]] = {}
+    async for doc in question_tests_collection.find(
+        {"question_id": {"$exists": False}}, {"contest_id": 1, "question_title": 1}
+    ):
+        contest_id = doc["contest_id"]
+        if contest_id not in ids_by_contest:
+            contest = None
+            if ObjectId.is_valid(contest_id):
+                contest = await contests_collection.find_one({"_id": ObjectId(contest_id)}, {"questions": 1})
+            ids_by_contest[contest_id] = {q["title"]: q["id"] for q in (contest or {}).get("questions", [])}
+        question_id = ids_by_contest[contest_id].get(doc.get("question_title"))
+        if question_id is None:
+            report["orphaned"] += 1
+        elif await question_tests_collection.find_one({"contest_id": contest_id, "question_id": question_id}, {"_id": 1}):
+            await question_tests_collection.delete_one({"_id": doc["_id"]})
+            report["superseded"] += 1
+        else:
+            await question_tests_collection.update_one(
+                {"_id": doc["_id"]}, {"$set": {"question_id": question_id}, "$unset": {"question_title": ""}}
+            )
+            report["migrated"] += 1
+    try:
+        await question_tests_collection.drop_index("contest_id_question_title_unique")
+    except OperationFailure:
+        pass  # already dropped, or never created
+    await question_tests_collection.create_indexes(INDEX_SPECS["question_tests"])
+    return report
 
 # =========================
 # Auth Router
@@ -304,7 +4884,7 @@ async def signup(user: UserCreate):
     user_dict = UserModel(
         email=user.email,
         username=user.username,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=await password_hasher.hash(user.password),
         role=user.role,
     ).dict()
 
@@ -332,8 +4912,15 @@ async def signup(user: UserCreate):
 @auth_router.post("/login", response_model=Token)
 async def login(login_data: LoginRequest):
     user = await users_collection.find_one({"email": login_data.email, "role": login_data.role})
-    if not user or not verify_password(login_data.password, user["hashed_password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    valid, new_hash = await password_hasher.verify_and_update(login_data.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash predates the current BCRYPT_ROUNDS - upgrade it transparently
+        await users_collection.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
 
     token_data = {
         "sub": user["email"],
@@ -370,9 +4957,13 @@ async def create_contest(contest: ContestCreate, current_user: dict = Depends(ge
         teacher_email=email,
         title=contest.title,
         description=contest.description,
-        questions=[q.dict() for q in contest.questions]
+        questions=[dict(q.dict(exclude={"test_cases"}), id=q.id or new_question_id()) for q in contest.questions]
     )
     result = await contests_collection.insert_one(model.dict())
+    contest_cache.invalidate()
+    for q, stored in zip(contest.questions, model.questions):
+        if q.test_cases:
+            await save_test_cases(str(result.inserted_id), stored["id"], q.test_cases)
     return {
         "id": str(result.inserted_id),
         "contest_code": model.contest_code
@@ -392,6 +4983,7 @@ async def start_contest(contest_id: str, current_user: dict = Depends(get_curren
     )
     if updated.modified_count == 0:
         raise HTTPException(404, "Contest not found or you don't have permission")
+    contest_cache.invalidate()
     return {"message": "Contest started"}
 
 @contest_router.post("/end/{contest_id}")
@@ -408,44 +5000,51 @@ async def end_contest(contest_id: str, current_user: dict = Depends(get_current_
     )
     if updated.modified_count == 0:
         raise HTTPException(404, "Contest not found or you don't have permission")
+    contest_cache.invalidate()
     return {"message": "Contest ended"}
 
 @contest_router.get("/all")
-async def get_all_contests(current_user: dict = Depends(get_current_user)):
+async def get_all_contests(
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    current_user: dict = Depends(get_current_user)
+):
     role = current_user["role"]
     
     try:
         if role == "teacher":
             # Teachers can see all contests
-            contests_cursor = contests_collection.find()
+            query = {}
         else:
             # Students can only see active contests
-            contests_cursor = contests_collection.find({"is_active": True})
+            query = {"is_active": True}
         
-        contests = await contests_cursor.to_list(length=None)
-        
-        for contest in contests:
-            contest["id"] = str(contest["_id"])
-            del contest["_id"]
-        
-        return contests
+        return await list_documents(contests_collection, query, limit, cursor, fields, exclude, format)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching all contests: {e}")
+        logger.exception("Error fetching all contests")
         raise HTTPException(status_code=500, detail=f"Failed to fetch contests: {str(e)}")
 
 @contest_router.get("/active")
-async def get_active_contests():
+async def get_active_contests(
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
     try:
-        contests_cursor = contests_collection.find({"is_active": True})
-        contests = await contests_cursor.to_list(length=None)
-        
-        for c in contests:
-            c["id"] = str(c["_id"])
-            del c["_id"]
-        
-        return contests
+        if not (limit or cursor or fields or exclude) and format == "json":
+            return await contest_cache.active_contests()
+        return await list_documents(contests_collection, {"is_active": True}, limit, cursor, fields, exclude, format)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching active contests: {e}")
+        logger.exception("Error fetching active contests")
         raise HTTPException(status_code=500, detail=f"Failed to fetch active contests: {str(e)}")
 
 @contest_router.get("/by-code/{code}")
@@ -453,12 +5052,13 @@ async def get_contest_by_code(code: str, current_user: dict = Depends(get_curren
     try:
         # Find contest by code (case-insensitive)
         code_upper = code.upper()
-        contest = await contests_collection.find_one({"contest_code": code_upper})
+        contest = await contest_cache.get_by_code(code_upper)
         
         if not contest:
             raise HTTPException(status_code=404, detail=f"Contest with code '{code}' not found")
         
         # Convert ObjectId to string
+        contest = dict(contest)
         contest["id"] = str(contest["_id"])
         del contest["_id"]
         
@@ -466,11 +5066,27 @@ async def get_contest_by_code(code: str, current_user: dict = Depends(get_curren
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Error fetching contest by code: {e}")
+        logger.exception("Error fetching contest by code", extra={"fields": {"code": code}})
         raise HTTPException(status_code=500, detail=f"Failed to fetch contest: {str(e)}")
 
+@contest_router.get("/{contest_id}/stats")
+async def get_contest_stats(contest_id: str, current_user: dict = Depends(get_current_user)):
+    contest = await contest_cache.get_by_id(contest_id) if ObjectId.is_valid(contest_id) else None
+    if not contest:
+        raise HTTPException(status_code=404, detail="Contest not found")
+    if current_user["role"] != "teacher" or contest.get("teacher_email") != current_user["email"]:
+        raise HTTPException(status_code=403, detail="Only the contest's teacher can view its stats")
+    return await contest_stats.get(contest_id)
+
 @contest_router.get("/teacher/mycontest")
-async def get_teacher_contests(current_user: dict = Depends(get_current_user)):
+async def get_teacher_contests(
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    current_user: dict = Depends(get_current_user)
+):
     email = current_user["email"]
     role = current_user["role"]
     
@@ -478,16 +5094,11 @@ async def get_teacher_contests(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Access denied")
     
     try:
-        contests_cursor = contests_collection.find({"teacher_email": email})
-        contests = await contests_cursor.to_list(length=None)
-        
-        for c in contests:
-            c["id"] = str(c["_id"])
-            del c["_id"]
-            
-        return contests
+        return await list_documents(contests_collection, {"teacher_email": email}, limit, cursor, fields, exclude, format)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching teacher contests: {e}")
+        logger.exception("Error fetching teacher contests")
         raise HTTPException(status_code=500, detail=f"Failed to fetch contests: {str(e)}")
 
 # =========================
@@ -500,6 +5111,12 @@ async def protected_route(current_user: dict = Depends(get_current_user)):
     return {"message": "Access granted", "user": current_user}
 
 
+async def contest_write_refused(contest_id: str) -> HTTPException:
+    """Why an ownership-filtered contest write matched nothing: 404 if the contest is missing, else 403."""
+    if not await contests_collection.find_one({"_id": ObjectId(contest_id)}, {"_id": 1}):
+        return HTTPException(status_code=404, detail="Contest not found")
+    return HTTPException(status_code=403, detail="Not authorized to modify this contest")
+
 @questions_router.post("/add")
 async def add_question(data: QuestionCreate, current_user: dict = Depends(get_current_user)):
     email = current_user["email"]
@@ -508,27 +5125,91 @@ async def add_question(data: QuestionCreate, current_user: dict = Depends(get_cu
     if role != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can add questions")
     
-    # First verify the contest belongs to the teacher
-    contest = await contests_collection.find_one({"_id": ObjectId(data.contest_id)})
-    if not contest or contest.get("teacher_email") != email:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this contest")
-    
+    if not ObjectId.is_valid(data.contest_id):
+        raise HTTPException(status_code=404, detail="Contest not found")
+
+    # Ownership is part of the filter, so the check and the push are one round-trip
+    question_id = new_question_id()
     update_result = await contests_collection.update_one(
-        {"_id": ObjectId(data.contest_id)},
+        {"_id": ObjectId(data.contest_id), "teacher_email": email},
         {"$push": {
             "questions": {
+                "id": question_id,
                 "title": data.title,
                 "description": data.description,
                 "sample_input": data.sample_input,
                 "sample_output": data.sample_output,
             }
-        }}
+        }, "$inc": {"question_revision": 1}}
     )
 
     if update_result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Contest not found or update failed")
+        raise await contest_write_refused(data.contest_id)
+
+    contest_cache.invalidate()
+    if data.test_cases:
+        await save_test_cases(data.contest_id, question_id, data.test_cases)
+    return {"message": "Question added", "id": question_id}
+
+@questions_router.put("/bulk")
+async def upsert_questions(data: QuestionBulkUpsert, current_user: dict = Depends(get_current_user)):
+    """Create or replace a set of questions in one write.
+
+    Questions match existing ones by id, else by title; the rest are appended.
+    The write is conditional on the contest's question_revision, so a concurrent
+    edit makes it fail with 409 instead of being overwritten.
+    """
+    email = current_user["email"]
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can add questions")
+
+    if not ObjectId.is_valid(data.contest_id):
+        raise HTTPException(status_code=404, detail="Contest not found")
+    contest = await contests_collection.find_one(
+        {"_id": ObjectId(data.contest_id), "teacher_email": email}, {"questions": 1, "question_revision": 1}
+    )
+    if not contest:
+        raise await contest_write_refused(data.contest_id)
+
+    questions = [dict(q) for q in contest.get("questions", [])]
+    index = index_questions(questions)
+    test_cases = {}
+    created = updated = 0
+    for q in data.questions:
+        existing = (index.get(("id", q.id)) if q.id else None) or index.get(("title", q.title))
+        fields = q.dict(exclude={"id", "test_cases"})
+        if existing is None:
+            existing = dict(fields, id=q.id or new_question_id())
+            questions.append(existing)
+            created += 1
+        else:
+            existing.update(fields, id=existing.get("id") or q.id or new_question_id())
+            updated += 1
+        if q.test_cases:
+            test_cases[existing["id"]] = q.test_cases
+        # Later entries of the same payload match what earlier ones wrote
+        index = index_questions(questions)
+
+    titles = [q["title"] for q in questions]
+    if len(set(titles)) != len(titles):
+        raise HTTPException(status_code=400, detail="Question titles must be unique within a contest")
 
-    return {"message": "Question added"}
+    revision = contest.get("question_revision")
+    result = await contests_collection.update_one(
+        {"_id": contest["_id"], "question_revision": revision},
+        {"$set": {"questions": questions, "question_revision": (revision or 0) + 1}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Questions were modified concurrently, please retry")
+
+    contest_cache.invalidate()
+    await save_test_case_sets(data.contest_id, test_cases)
+    return {
+        "message": "Questions saved",
+        "created": created,
+        "updated": updated,
+        "questions": [{"id": q["id"], "title": q["title"]} for q in questions],
+    }
 
 # =========================
 # Submissions Router
@@ -540,131 +5221,138 @@ async def submit_code(sub: SubmissionCreate, current_user: dict = Depends(get_cu
     email = current_user["email"]
     role = current_user["role"]
 
-    contest = await contests_collection.find_one({"_id": ObjectId(sub.contest_id)})
+    if sub.question_id:
+        ref = ("id", sub.question_id)
+    elif sub.question_title:
+        ref = ("title", sub.question_title)
+    else:
+        raise HTTPException(status_code=422, detail="question_id or question_title is required")
+
+    with span("contests"):
+        contest, question = await contest_cache.get_question(sub.contest_id, ref)
     if not contest:
         raise HTTPException(status_code=404, detail="Contest not found")
 
     if not contest.get("is_active", False):
         raise HTTPException(status_code=400, detail="Contest is not active")
 
-    question_exists = False
-    question_description = ""
-    for q in contest.get("questions", []):
-        if q.get("title") == sub.question_title:
-            question_exists = True
-            question_description = q.get("description", "")
-            break
-
-    if not question_exists:
+    if question is None:
         raise HTTPException(status_code=404, detail="Question not found in contest")
+    question_description = question.get("description", "")
+    # Everything downstream (test cases, similarity buckets, listings) keys on the title
+    sub.question_title = question["title"]
+
+    with span("admission"):
+        await admission.admit(email, sub.contest_id)
+
+    # One blob shared by the submission and its analysis job
+    with span("code_blobs"):
+        body_hash = await code_blobs.put(sub.code)
 
     sub_data = SubmissionModel(
         contest_id=sub.contest_id,
         student_email=email,
         question_title=sub.question_title,
-        code=sub.code,
+        question_id=question.get("id"),
+        code_hash=body_hash,
         language=sub.language
     ).dict()
 
-    result = await submissions_collection.insert_one(sub_data)
+    with span("submissions"):
+        result = await submissions_collection.insert_one(sub_data)
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Failed to save submission")
-
-    if not openai_client:
-        return {
-            "id": "mock-123",
-            "message": "Submission successful (mock mode)",
-            "plagiarism_analysis": generate_mock_analysis(sub.code, sub.language)
-        }
-
+    await submission_feed.publish_submission(dict(sub_data, _id=result.inserted_id))
     try:
-        code_submission = CodeSubmission(
-            code=sub.code,
-            language=sub.language,
-            assignment_description=question_description,
-            student_id=email,
-            assignment_id=f"{sub.contest_id}_{sub.question_title}"
-        )
+        with span("contest_stats"):
+            await contest_stats.record_submission(sub_data)
+    except Exception:
+        logger.exception("Error updating contest stats")
 
-        system_prompt = """
-        [Insert full prompt here as string literal from earlier version for clarity]
-        """
-
-        user_message = f"""
-Analyze this code for plagiarism and evaluate it based on the following parameters:
-
-{sub.code}
-
-*Context*:
-- Language: {sub.language}
-- Course Level: Not provided
-- Assignment Description: {question_description or "Not provided"}
-
-*Instructions*:
-1. Validate the input to ensure it is valid code in the specified programming language.
-2. If the input is not valid code, return a response indicating that no analysis can be performed.
-3. If the input is valid code, break down the code into sections and analyze each part for plagiarism.
-4. Provide a confidence score (0-100) for your assessment.
-5. Highlight specific lines or blocks of code that are suspicious.
-6. Evaluate the code based on the following parameters:
-   - Code Correctness: Check if the code executes correctly and handles exceptions.
-   - Code Efficiency: Estimate time complexity, memory usage, and execution time.
-   - Code Security: Detect vulnerabilities such as SQL injection, XSS, and hardcoded secrets.
-   - Code Readability: Assess code style, documentation, and naming conventions.
-7. Suggest follow-up questions to verify the student's understanding.
-8. Provide recommendations for improving originality, security, and code quality.
+    similar_submissions = []
+    try:
+        with span("similarity"):
+            similar_submissions = await similarity_engine.add_submission(
+                str(result.inserted_id), sub.contest_id, sub.question_title, email, sub.code, sub.language
+            )
+    except Exception as e:
+        logger.exception("Error indexing submission for similarity")
 
-*Output Format*:
-Your response should be in the structured JSON format provided in the system prompt.
-"""
+    style_drift = None
+    if style_profiles.enabled:
+        try:
+            with span("style_profiles"):
+                style_drift = await style_profiles.add_submission(email, sub.language, sub.code)
+        except Exception:
+            logger.exception("Error updating style profile")
 
-        response = openai_client.chat.completions.create(
-            model=settings.OPENAI_DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.2
-        )
+    code_submission = CodeSubmission(
+        code=sub.code,
+        language=sub.language,
+        assignment_description=question_description,
+        student_id=email,
+        assignment_id=f"{sub.contest_id}_{sub.question_title}"
+    )
 
-        plagiarism_result = json.loads(response.choices[0].message.content)
+    submission_data = code_submission.dict(exclude={"code"})
+    submission_data.update({
+        "code_hash": body_hash,
+        "submission_timestamp": datetime.utcnow(),
+        "submitter_email": email,
+        "contest_id": sub.contest_id,
+        "question_title": sub.question_title,
+        "question_id": question.get("id"),
+        "submission_id": str(result.inserted_id),
+        "similar_submissions": similar_submissions,
+        "style_drift": style_drift
+    })
 
-        submission_data = code_submission.dict()
-        submission_data.update({
-            "plagiarism_analysis": plagiarism_result,
-            "submission_timestamp": datetime.utcnow(),
-            "submitter_email": email,
-            "contest_id": sub.contest_id,
-            "question_title": sub.question_title
-        })
+    tests = []
+    if execution_engine.enabled:
+        with span("question_tests"):
+            tests = await load_test_set(sub.contest_id, question)
 
+    # Analysis runs in the background; the client polls /plagiarism/jobs/{job_id}
+    with span("codes"):
         try:
-            result = await codes_collection.insert_one(submission_data)
-            return {
-                "message": "Submission successful",
-                "submission_id": str(result.inserted_id),
-                "plagiarism_analysis": plagiarism_result
-            }
-        except Exception as e:
-            return {
-                "message": "Submission successful",
-                "submission_id": None,
-                "plagiarism_analysis": plagiarism_result,
-                "storage_error": f"Failed to save to database: {str(e)}"
-            }
+            job_id = await analysis_queue.submit(submission_data, {
+                "code": sub.code,
+                "language": sub.language,
+                "assignment_description": question_description,
+                "contest_id": sub.contest_id,
+                "tests": tests
+            })
+        except HTTPException as e:
+            if e.status_code == 429:  # queue full: no model call will be made for this request
+                await admission.refund(email, sub.contest_id)
+            raise
 
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Failed to parse plagiarism analysis result")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Plagiarism detection error: {str(e)}")
+    # Answered at once from the cache for a repeat submission; otherwise null until the job completes
+    job = await analysis_queue.wait(job_id, 0) or {}
+    return {
+        "message": "Submission successful",
+        "submission_id": str(result.inserted_id),
+        "job_id": job_id,
+        "status": job.get("status", JOB_QUEUED),
+        "plagiarism_analysis": job.get("plagiarism_analysis"),
+        "similar_submissions": similar_submissions
+    }
 
 @submissions_router.get("/by-contest/{contest_id}")
-async def get_submissions(contest_id: str, current_user: dict = Depends(get_current_user)):
+async def get_submissions(
+    contest_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    current_user: dict = Depends(get_current_user)
+):
     email = current_user["email"]
     role = current_user["role"]
     
     # Get contest to check if user is the teacher
-    contest = await contests_collection.find_one({"_id": ObjectId(contest_id)})
+    contest = await contest_cache.get_by_id(contest_id)
     if not contest:
         raise HTTPException(status_code=404, detail="Contest not found")
     
@@ -675,226 +5363,218 @@ async def get_submissions(contest_id: str, current_user: dict = Depends(get_curr
     if role != "teacher" or contest.get("teacher_email") != email:
         filter_query["student_email"] = email
     
-    subs_cursor = submissions_collection.find(filter_query)
-    subs = await subs_cursor.to_list(length=None)
+    return await list_documents(submissions_collection, filter_query, limit, cursor, with_code_hash(fields),
+                                with_code_hash(exclude), format, hydrate=code_blobs.hydrate)
 
-    for s in subs:
-        if "_id" in s:
-            s["id"] = str(s["_id"])
-            del s["_id"]
-        if "submitted_at" in s:
-            s["submitted_at"] = s["submitted_at"].isoformat()
+@submissions_router.websocket("/live/{contest_id}")
+async def submissions_live_feed(
+    websocket: WebSocket,
+    contest_id: str,
+    token: str,
+    cursor: Optional[str] = None,
+    backfill: bool = True
+):
+    """Live submission and analysis events for the contest's teacher.
 
-    return subs
-
-# =========================
-# Plagiarism Router
-# =========================
-
-
-plagiarism_router = APIRouter()
-
-@plagiarism_router.post("/check")
-async def check_plagiarism(submission: CodeSubmission, current_user: dict = Depends(get_current_user)):
-    email = current_user["email"]
-    role = current_user["role"]
-    
-    if not openai_client:
-        mock_analysis = generate_mock_analysis(submission.code, submission.language)
-        return {
-            "id": "mock-123",
-            "plagiarism_analysis": mock_analysis
-        }
+    Browsers cannot set headers on a WebSocket, so the JWT comes as `?token=`.
+    Reconnect with `?cursor=<last cursor seen>` to receive only what was missed;
+    `backfill=false` skips the initial history.
+    """
     try:
-        
-        # Enhanced system prompt for plagiarism detection and code evaluation
-        system_prompt = """
-You are an advanced, highly trained AI model specialized in detecting plagiarism in code submissions. Your expertise includes identifying AI-generated code, copied code from online sources, and assessing the originality of student work. Your analysis must be thorough, precise, and context-aware. Follow these guidelines:
-
----
-
-### *Key Responsibilities*
+        principal = await resolve_principal(token)
+        if cursor and not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        contest = await contest_cache.get_by_id(contest_id) if ObjectId.is_valid(contest_id) else None
+        if not contest:
+            raise HTTPException(status_code=404, detail="Contest not found")
+        if principal["role"] != "teacher" or contest.get("teacher_email") != principal["email"]:
+            raise HTTPException(status_code=403, detail="Not authorized to view this contest")
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
 
-1. *Validate Input*:
-   - Check if the input is valid code in the specified programming language.
-   - If the input is not valid code, return a response indicating that no analysis can be performed.
+    await websocket.accept()
+    channel = submission_feed.channel(contest_id)
+    # Subscribe before backfilling so nothing written in between is missed
+    subscription = submission_feed.broker.subscribe(channel)
 
-2. *Detect AI-Generated Code*:
-   - Identify patterns typical of AI-generated code (e.g., ChatGPT, Claude, GitHub Copilot).
-   - Look for overly consistent formatting, excessive or unnatural comments, and generic variable/function names.
-   - Detect code that is overly optimized or uses advanced techniques inconsistent with the student's course level.
-   - Flag code that lacks common mistakes or shows an unnatural level of perfection.
+    async def send_events():
+        last_sent = ObjectId(cursor) if cursor else None
+        # A job finishes once, so its live event can repeat a backfilled one at most once
+        backfilled_jobs = set()
+        if backfill or cursor:
+            async for event in submission_feed.backfill(contest_id, cursor):
+                await websocket.send_json(event)
+                last_sent = ObjectId(event["cursor"])
+                if event["type"] == FEED_ANALYSIS:
+                    backfilled_jobs.add(event["data"]["job_id"])
+        while True:
+            event = await subscription.get()
+            if event is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Feed fell behind; resume from cursor")
+                return
+            # Events written while the backfill ran arrive again live. An analysis can
+            # finish after its submission was sent, so analyses are matched by job id
+            if event["type"] == FEED_SUBMISSION and last_sent is not None and ObjectId(event["cursor"]) <= last_sent:
+                continue
+            if event["type"] == FEED_ANALYSIS and event["data"]["job_id"] in backfilled_jobs:
+                backfilled_jobs.discard(event["data"]["job_id"])
+                continue
+            await websocket.send_json(event)
 
-3. *Identify Copied Code*:
-   - Recognize code snippets copied from common online sources (e.g., Stack Overflow, GitHub, GeeksforGeeks).
-   - Compare the code against known algorithms, functions, or solutions from tutorials or public repositories.
-   - Detect inconsistent coding styles, mixed conventions, or abrupt changes in logic that suggest multiple sources.
-   - Use contextual clues (e.g., comments, variable names) to trace potential sources.
+    async def wait_for_close():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
 
-4. *Assess Originality*:
-   - Evaluate the likelihood that the code was written by the student based on the course level and assignment description.
-   - Identify common mistakes, incomplete implementations, or lack of understanding in the code.
-   - Check for code that is too simplistic, overly generic, or lacks originality.
-   - Consider the student's coding style, if previously available, for consistency.
+    tasks = [asyncio.ensure_future(send_events()), asyncio.ensure_future(wait_for_close())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Not awaited: the server may already be cancelling this handler
+        for task in tasks:
+            if task.done() and not task.cancelled():
+                task.exception()
+            task.cancel()
+        submission_feed.broker.unsubscribe(channel, subscription)
 
-5. *Provide Detailed Analysis*:
-   - Break down the code into logical sections (e.g., functions, loops, classes) and analyze each part for plagiarism.
-   - Provide a confidence score (0-100) for your assessment, considering the strength of evidence.
-   - Highlight specific lines or blocks of code that are suspicious, with clear explanations.
+@submissions_router.get("/similarity/{contest_id}")
+async def get_similarity_report(
+    contest_id: str,
+    question_title: str,
+    threshold: float = Query(0.5, gt=0, le=1),
+    include_matrix: bool = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """Pairwise similarity matrix and copy clusters for one question of a contest."""
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can view similarity reports")
 
-6. *Generate Recommendations*:
-   - Suggest follow-up questions to verify the student's understanding of the code.
-   - Provide actionable recommendations for improving the originality and quality of the code.
+    contest = await contest_cache.get_by_id(contest_id)
+    if not contest:
+        raise HTTPException(status_code=404, detail="Contest not found")
+    if contest.get("teacher_email") != current_user["email"]:
+        raise HTTPException(status_code=403, detail="Not authorized to view this contest")
 
----
+    return await similarity_engine.similarity_report(contest_id, question_title, threshold, include_matrix)
 
-### *Evaluation Parameters*
+# =========================
+# Plagiarism Router
+# =========================
 
-Your analysis should also consider the following evaluation parameters from the AI-based Code Evaluator:
 
-1. *Code Correctness*:
-   - Check if the code executes correctly without errors.
-   - Verify if the code handles exceptions properly.
-   - Compare expected vs. actual output for given test cases.
+plagiarism_router = APIRouter()
 
-2. *Code Efficiency & Performance*:
-   - Estimate time complexity using Big-O notation.
-   - Measure memory consumption and execution time.
-   - Identify performance bottlenecks.
+@plagiarism_router.post("/check")
+async def check_plagiarism(
+    submission: CodeSubmission,
+    background: bool = False,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    email = current_user["email"]
+    role = current_user["role"]
 
-3. *Code Security Analysis*:
-   - Detect SQL injection vulnerabilities.
-   - Check for cross-site scripting (XSS) risks.
-   - Identify hardcoded secrets (e.g., API keys, passwords).
-   - Scan for outdated or vulnerable dependencies.
+    with span("admission"):
+        await admission.admit(email)
 
-4. *Code Readability & Maintainability*:
-   - Assess code style and documentation.
-   - Evaluate function and variable naming conventions.
-   - Analyze cyclomatic complexity and suggest improvements.
+    submission_data = submission.dict()
+    submission_data["submission_timestamp"] = datetime.utcnow()
+    submission_data["submitter_email"] = email
+    submission_data["submitter_role"] = role
+    with span("code_blobs"):
+        submission_data = await externalize_code(submission_data)
 
-5. *Plagiarism Detection & Code Similarity Analysis*:
-   - Perform exact code matching using hashes.
-   - Analyze structural similarity using AST (Abstract Syntax Tree).
-   - Use NLP-based similarity detection (e.g., SimHash, MinHash) to detect paraphrased code.
+    if stream:
+        return StreamingResponse(
+            stream_plagiarism_analysis(
+                submission_data,
+                code=submission.code,
+                language=submission.language,
+                course_level=submission.course_level,
+                assignment_description=submission.assignment_description
+            ),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
----
+    with span("codes"):
+        try:
+            job_id = await analysis_queue.submit(submission_data, {
+                "code": submission.code,
+                "language": submission.language,
+                "course_level": submission.course_level,
+                "assignment_description": submission.assignment_description
+            })
+        except HTTPException as e:
+            if e.status_code == 429:  # queue full: no model call will be made for this request
+                await admission.refund(email)
+            raise
 
-### *Output Format*
+    if background:
+        return JSONResponse(status_code=202, content={"id": job_id, "job_id": job_id, "status": JOB_QUEUED})
 
-Your response must be a structured JSON object with the following fields:
+    # Queue wait plus the LLM call, which runs on a worker outside this request's spans
+    with span("analysis"):
+        job = await analysis_queue.wait(job_id, settings.ANALYSIS_WAIT_TIMEOUT)
+    if not job:
+        raise HTTPException(status_code=500, detail="Plagiarism detection error: job record lost")
+    if job.get("status") == JOB_FAILED:
+        raise HTTPException(status_code=job.get("error_status", 500), detail=job.get("error"))
+    if job.get("status") != JOB_COMPLETED:
+        # Still running - hand the job id back so the client can keep polling
+        return JSONResponse(status_code=202, content={"id": job_id, "job_id": job_id, "status": job.get("status")})
 
-json
-{
-    "is_valid_code": true/false,
-    "plagiarism_detected": true/false,
-    "confidence_score": 0-100,
-    "likely_source": "AI-generated" or "Online resource" or "Original student work",
-    "explanation": "Detailed reasoning for your conclusion",
-    "suspicious_elements": [
-        {
-            "code_section": "Specific lines or blocks of code",
-            "likely_source": "AI-generated" or "Online resource",
-            "confidence": 0-100,
-            "explanation": "Why this section is suspicious"
-        }
-    ],
-    "red_flags": [
-        "List of key concerns (e.g., inconsistent style, advanced techniques, lack of originality)"
-    ],
-    "verification_questions": [
-        "Suggested questions to ask the student to verify authorship"
-    ],
-    "recommendations": [
-        "Suggestions for improving originality and understanding"
-    ],
-    "evaluation_metrics": {
-        "code_correctness": {
-            "status": "Passed/Failed",
-            "test_cases": "Number of test cases executed",
-            "failed_cases": "Number of failed test cases"
-        },
-        "code_efficiency": {
-            "time_complexity": "O(n log n)",
-            "memory_usage": "12MB",
-            "execution_time": "120ms"
-        },
-        "code_security": {
-            "issues_found": ["SQL Injection", "Hardcoded API Key"],
-            "recommendations": ["Use parameterized queries", "Store API keys securely"]
-        },
-        "code_readability": {
-            "score": 8.5,
-            "suggestions": ["Improve documentation"]
-        }
+    return {
+        "id": job_id,
+        "plagiarism_analysis": job["plagiarism_analysis"]
     }
-}
-"""
-        # User message with context
-        user_message = f"""
-Analyze this code for plagiarism and evaluate it based on the following parameters:
 
-{submission.code}
+@plagiarism_router.get("/cache/stats")
+async def get_analysis_cache_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Access denied")
+    return analysis_cache.stats()
 
-*Context*:
-- Language: {submission.language}
-- Course Level: {submission.course_level if submission.course_level else "Not provided"}
-- Assignment Description: {submission.assignment_description if submission.assignment_description else "Not provided"}
+@plagiarism_router.get("/usage")
+async def get_llm_usage(contest_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Token usage, latency and call counts per contest, aggregated from llm_usage."""
+    if current_user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Access denied")
 
-*Instructions*:
-1. Validate the input to ensure it is valid code in the specified programming language.
-2. If the input is not valid code, return a response indicating that no analysis can be performed.
-3. If the input is valid code, break down the code into sections and analyze each part for plagiarism.
-4. Provide a confidence score (0-100) for your assessment.
-5. Highlight specific lines or blocks of code that are suspicious.
-6. Evaluate the code based on the following parameters:
-   - Code Correctness: Check if the code executes correctly and handles exceptions.
-   - Code Efficiency: Estimate time complexity, memory usage, and execution time.
-   - Code Security: Detect vulnerabilities such as SQL injection, XSS, and hardcoded secrets.
-   - Code Readability: Assess code style, documentation, and naming conventions.
-7. Suggest follow-up questions to verify the student's understanding.
-8. Provide recommendations for improving originality, security, and code quality.
+    pipeline = []
+    if contest_id:
+        pipeline.append({"$match": {"contest_id": contest_id}})
+    pipeline.append({"$group": {
+        "_id": "$contest_id",
+        "calls": {"$sum": 1},
+        "errors": {"$sum": {"$cond": [{"$ifNull": ["$error", False]}, 1, 0]}},
+        "truncated_calls": {"$sum": {"$cond": ["$truncated", 1, 0]}},
+        "prompt_tokens": {"$sum": "$prompt_tokens"},
+        "completion_tokens": {"$sum": "$completion_tokens"},
+        "avg_latency_ms": {"$avg": "$latency_ms"},
+        "max_latency_ms": {"$max": "$latency_ms"},
+    }})
+    rows = await llm_usage_collection.aggregate(pipeline).to_list(length=None)
+    for row in rows:
+        row["contest_id"] = row.pop("_id")
+    return rows
 
-*Output Format*:
-Your response should be in the structured JSON format provided in the system prompt.
-"""
-        try:
-            response = openai_client.chat.completions.create(
-                model=settings.OPENAI_DEPLOYMENT_NAME,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.2
-            )
-            plagiarism_result = json.loads(response.choices[0].message.content)
-        except Exception as e:
-            raise HTTPException(status_code=502, detail=f"OpenAI API error: {str(e)}")
+@plagiarism_router.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str, wait: float = 0, current_user: dict = Depends(get_current_user)):
+    """Fetch an analysis job. Pass `wait` (seconds, max 30) to long-poll until it finishes."""
+    # Authorize before long-polling so strangers cannot hold a request open on someone else's job
+    job = await analysis_queue.store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await authorize_job_access(job, current_user)
 
-        submission_data = submission.dict()
-        submission_data["plagiarism_analysis"] = plagiarism_result
-        submission_data["submission_timestamp"] = datetime.utcnow()
-        submission_data["submitter_email"] = email
-        submission_data["submitter_role"] = role
+    job = await analysis_queue.wait(job_id, min(max(wait, 0), 30))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_job(job)
 
-        try:
-            result = await codes_collection.insert_one(submission_data)
-            return {
-                "id": str(result.inserted_id),
-                "plagiarism_analysis": plagiarism_result
-            }
-        except Exception as e:
-            return {
-                "id": None,
-                "plagiarism_analysis": plagiarism_result,
-                "storage_error": f"Failed to save to database: {str(e)}"
-            }
-            
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Failed to parse plagiarism analysis result")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Plagiarism detection error: {str(e)}")
 # =========================
 # Root endpoint
 # =========================
@@ -906,7 +5586,12 @@ async def root():
     except Exception as e:
         db_status = f"Disconnected: {str(e)}"
     
-    openai_status = "Available" if openai_client else "Unavailable"
+    if not llm_service.available:
+        openai_status = "Unavailable"
+    elif llm_service.breaker.state == "open":
+        openai_status = "Degraded"
+    else:
+        openai_status = "Available"
     
     return JSONResponse(content={
         "message": "Coding Contest Platform API with Plagiarism Detection",
@@ -916,8 +5601,16 @@ async def root():
         }
     })
 
-# Initialize database
-init_db()
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not settings.METRICS_PUBLIC:
+        # Without a configured token there is nothing a scraper could present
+        if not settings.METRICS_TOKEN:
+            raise HTTPException(status_code=404, detail="Not Found")
+        presented = request.headers.get("authorization", "").encode()
+        if not hmac.compare_digest(presented, f"Bearer {settings.METRICS_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
@@ -926,9 +5619,42 @@ app.include_router(questions_router, prefix="/questions", tags=["Questions"])
 app.include_router(submissions_router, prefix="/submissions", tags=["Submissions"])
 app.include_router(plagiarism_router, prefix="/plagiarism", tags=["Plagiarism"])
 
-# For Vercel/AWS Lambda deployment
+# For Vercel/AWS Lambda deployment; BootstrapMiddleware creates the indexes on a cold start
 handler = Mangum(app, lifespan="off")  
 
 # For running locally
+#   python main.py                 -> dev server
+#   python main.py ensure-indexes  -> create all indexes
+#   python main.py audit-indexes   -> explain() every router query; exits 1 on any COLLSCAN
+#   python main.py migrate-code-blobs [--dry-run] -> move inline code into code_blobs, print a storage report
+#   python main.py recover-jobs    -> requeue analysis jobs a stopped worker left behind and run them
+#   python main.py migrate-question-tests -> re-key hidden test cases from question title to question id
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command == "ensure-indexes":
+        print(json.dumps(asyncio.run(ensure_indexes()), indent=2))
+    elif command == "audit-indexes":
+        sys.exit(asyncio.run(run_index_audit()))
+    elif command == "backfill-question-ids":
+        print(json.dumps(asyncio.run(backfill_question_ids()), indent=2))
+    elif command == "rebuild-contest-stats":
+        contest_arg = next((a for a in sys.argv[2:] if not a.startswith("--")), None)
+        report = asyncio.run(rebuild_contest_stats(contest_arg, check="--check" in sys.argv))
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["check"] and report["mismatched"] else 0)
+    elif command == "migrate-question-tests":
+        print(json.dumps(asyncio.run(migrate_question_test_keys()), indent=2))
+    elif command == "migrate-code-blobs":
+        print(json.dumps(asyncio.run(migrate_code_blobs(dry_run="--dry-run" in sys.argv)), indent=2))
+    elif command == "recover-jobs":
+        async def recover_jobs():
+            report = await analysis_queue.recover(settings.ANALYSIS_JOB_RECOVERY_SECONDS,
+                                                  settings.ANALYSIS_JOB_MAX_RECOVERIES)
+            if report["requeued"]:
+                await analysis_queue._queue.join()
+            return report
+        print(json.dumps(asyncio.run(recover_jobs()), indent=2))
+    else:
+        import uvicorn  # server-only; not loaded on the serverless path
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
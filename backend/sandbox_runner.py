@@ -0,0 +1,243 @@
+"""Sandbox runner process for the test-case execution engine in main.py.
+
+main.py keeps a small pool of these processes and sends them one JSON request per
+line on stdin. For each request the runner forks the sandboxed program and answers
+with one JSON line on stdout once the program has exited.
+
+Runs are forked from this small interpreter rather than from the API server
+because the rusage peak RSS of a forked child starts at its parent's footprint.
+The runner only imports the standard library and runs with -I -S, so the floor
+stays at a few MB.
+
+The program sees a private root filesystem: a tmpfs holding read-only binds of the
+system directories (SYSTEM_PATHS), the request's working directory at /work and a
+private /tmp. None of the server's files, the backend directory and its .env
+included, are visible. It runs as `nobody`. Building that root needs root, so the
+runner refuses to run anything otherwise. Setup failures are reported as
+{"error"} through a close-on-exec pipe and are never mistaken for the program
+exiting.
+
+Request:  {"argv", "cwd", "env", "stdin", "stdout", "stderr", "limits", "wall_seconds",
+           "require_network_isolation"}
+Response: {"exit_code", "timed_out", "wall_ms", "cpu_ms", "memory_kb"} or {"error"}
+"""
+import ctypes
+import glob
+import json
+import os
+import resource
+import signal
+import sys
+import tempfile
+import time
+import warnings  # noqa: F401 - os.execvpe imports it lazily, after setuid can no longer read the stdlib
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+MS_RDONLY = 0x1
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_REMOUNT = 0x20
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+PR_SET_CHILD_SUBREAPER = 36
+NOBODY_ID = 65534
+EXEC_FAILED = 127
+
+# Bound read-only into the sandbox root when present; symlinks (merged /usr) are recreated
+SYSTEM_PATHS = ("/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64", "/libx32", "/etc/alternatives",
+                "/etc/ld.so.cache", "/etc/ld.so.conf", "/etc/ld.so.conf.d", "/etc/localtime", "/etc/java-*")
+DEVICES = ("/dev/null", "/dev/zero", "/dev/random", "/dev/urandom")
+WORKDIR = "/work"
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_root = None  # mount point of the sandbox root; created once, mounted per child in its own namespace
+
+
+def unshare_network():
+    if _libc.unshare(CLONE_NEWNET) == 0:
+        return True
+    # Unprivileged runners can still get a network namespace inside a user namespace
+    return _libc.unshare(CLONE_NEWUSER | CLONE_NEWNET) == 0
+
+
+def mount(source, target, fstype=None, flags=0, data=None):
+    args = [x.encode() if isinstance(x, str) else x for x in (source, target, fstype, data)]
+    if _libc.mount(args[0], args[1], args[2], flags, args[3]) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"mount {target}: {os.strerror(errno)}")
+
+
+def bind_readonly(source, target):
+    if os.path.isdir(source):
+        os.makedirs(target, exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, "a").close()
+    mount(source, target, None, MS_BIND | MS_REC)
+    mount(None, target, None, MS_REMOUNT | MS_BIND | MS_RDONLY | MS_NOSUID)
+
+
+def isolate_filesystem(workdir):
+    """In the child: switch to a new mount namespace whose root holds only the sandbox files."""
+    if _libc.unshare(CLONE_NEWNS) != 0:
+        raise OSError(ctypes.get_errno(), "mount namespace unavailable")
+    # Nothing mounted below leaks back into the runner's namespace
+    mount(None, "/", None, MS_REC | MS_PRIVATE)
+    mount("tmpfs", _root, "tmpfs", MS_NOSUID, "size=1m,mode=755")
+    for pattern in SYSTEM_PATHS:
+        for path in glob.glob(pattern):
+            target = _root + path
+            if os.path.islink(path):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.symlink(os.readlink(path), target)
+            else:
+                bind_readonly(path, target)
+    for device in DEVICES:
+        target = _root + device
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, "a").close()
+        mount(device, target, None, MS_BIND)
+    os.makedirs(_root + WORKDIR)
+    mount(workdir, _root + WORKDIR, None, MS_BIND)
+    os.makedirs(_root + "/tmp")
+    mount("tmpfs", _root + "/tmp", "tmpfs", MS_NOSUID | MS_NODEV, "size=64m,mode=1777")
+    mount(None, _root, None, MS_REMOUNT | MS_BIND | MS_RDONLY | MS_NOSUID)
+    os.chroot(_root)
+    os.chdir(WORKDIR)
+
+
+def reap_strays():
+    """Kill and reap whatever the program left behind.
+
+    The runner is a child subreaper, so orphans (including ones that escaped the
+    process group with setsid) are reparented here; reaping them before answering
+    keeps them from counting against the next run's RLIMIT_NPROC.
+    """
+    proc_dir = f"/proc/{os.getpid()}/task"
+    while True:
+        for tid in os.listdir(proc_dir):
+            with open(os.path.join(proc_dir, tid, "children")) as f:
+                for child in f.read().split():
+                    try:
+                        os.kill(int(child), signal.SIGKILL)
+                    except OSError:
+                        pass
+        try:
+            os.waitpid(-1, 0)
+        except ChildProcessError:
+            return
+
+
+def exec_child(request, error_fd):
+    """In the forked child: isolate, limit, drop privileges, exec. Never returns.
+
+    Anything that goes wrong before exec is written to error_fd; a successful exec
+    closes it (O_CLOEXEC), so the parent reads nothing.
+    """
+    try:
+        os.setsid()
+        # Opened with the runner's view of the filesystem, before the root changes
+        stdin = os.open(request["stdin"], os.O_RDONLY)
+        stdout = os.open(request["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        stderr = os.open(request["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        if not unshare_network() and request["require_network_isolation"]:
+            raise OSError("network namespace unavailable")
+        isolate_filesystem(request["cwd"])
+
+        limits = request["limits"]
+        resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu_seconds"], limits["cpu_seconds"] + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (limits["address_space"], limits["address_space"]))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limits["output_bytes"], limits["output_bytes"]))
+        resource.setrlimit(resource.RLIMIT_NPROC, (limits["processes"], limits["processes"]))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+        for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2)):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.closerange(3, error_fd)
+        os.closerange(error_fd + 1, 1024)
+        # Python ignores SIGXFSZ; the program should die on hitting the output limit
+        signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
+
+        os.setgroups([])
+        os.setgid(NOBODY_ID)
+        os.setuid(NOBODY_ID)
+        os.execvpe(request["argv"][0], request["argv"], request["env"])
+        raise OSError("exec returned")
+    except BaseException as e:
+        try:
+            os.write(error_fd, f"{type(e).__name__}: {e}".encode()[:1024])
+        finally:
+            os._exit(EXEC_FAILED)
+
+
+_running = {"pid": None, "timed_out": False}
+
+
+def on_timeout(signum, frame):
+    if _running["pid"] is not None:
+        _running["timed_out"] = True
+        try:
+            os.killpg(_running["pid"], signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def run(request):
+    if os.geteuid() != 0:
+        # Without root there is no way to drop to `nobody` or build a private root
+        return {"error": "sandbox setup failed: the runner must start as root"}
+    error_read, error_write = os.pipe2(os.O_CLOEXEC)
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(error_read)
+        exec_child(request, error_write)
+    os.close(error_write)
+
+    _running.update(pid=pid, timed_out=False)
+    signal.setitimer(signal.ITIMER_REAL, request["wall_seconds"])
+    try:
+        _, wait_status, usage = os.wait4(pid, 0)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _running["pid"] = None
+    wall = time.perf_counter() - started
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    reap_strays()
+    with os.fdopen(error_read, "rb") as f:
+        setup_error = f.read().decode("utf-8", "replace")
+    if setup_error:
+        return {"error": f"sandbox setup failed: {setup_error}"}
+    return {
+        "exit_code": os.waitstatus_to_exitcode(wait_status),
+        "timed_out": _running["timed_out"],
+        "wall_ms": round(wall * 1000, 1),
+        "cpu_ms": round((usage.ru_utime + usage.ru_stime) * 1000, 1),
+        "memory_kb": usage.ru_maxrss,
+    }
+
+
+def main():
+    global _root
+    _root = tempfile.mkdtemp(prefix="meridian-root-")
+    signal.signal(signal.SIGALRM, on_timeout)
+    _libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    for line in sys.stdin:
+        try:
+            response = run(json.loads(line))
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# Configure before main is imported: no real database or OpenAI endpoint is contacted
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ["MONGODB_URI"] = "mongodb://localhost:1"
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["BOOTSTRAP_ON_FIRST_REQUEST"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Points every module-level collection at a fresh in-memory database."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(main, "_client", client)
+    for value in vars(main).values():
+        if isinstance(value, main.LazyCollection):
+            monkeypatch.setattr(value, "_collection", None)
+    return client[main.DB_NAME]
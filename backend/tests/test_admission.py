@@ -0,0 +1,210 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_bucket_allows_a_burst_then_refuses_with_time_to_next_token():
+    clock = FakeClock()
+    store = main.InMemoryRateLimitStore(clock=clock)
+    rate = 6 / 60  # one token every 10 seconds
+    assert [run(store.take("k", rate, burst=3)) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert run(store.take("k", rate, burst=3)) == pytest.approx(10.0)
+    clock.advance(4)
+    assert run(store.take("k", rate, burst=3)) == pytest.approx(6.0)
+
+
+def test_bucket_refills_at_rate_and_caps_at_burst():
+    clock = FakeClock()
+    store = main.InMemoryRateLimitStore(clock=clock)
+    rate = 1.0
+    for _ in range(2):
+        run(store.take("k", rate, burst=2))
+    clock.advance(1)
+    assert run(store.take("k", rate, burst=2)) == 0.0
+    assert run(store.take("k", rate, burst=2)) == pytest.approx(1.0)
+    clock.advance(3600)  # idle for long: refilled to burst, not beyond
+    assert [run(store.take("k", rate, burst=2)) for _ in range(2)] == [0.0, 0.0]
+    assert run(store.take("k", rate, burst=2)) > 0
+
+
+def test_refund_returns_a_token_without_exceeding_burst():
+    store = main.InMemoryRateLimitStore(clock=FakeClock())
+    run(store.take("k", 1.0, burst=1))
+    run(store.refund("k", burst=1))
+    run(store.refund("k", burst=1))
+    assert run(store.take("k", 1.0, burst=1)) == 0.0
+    assert run(store.take("k", 1.0, burst=1)) > 0
+
+
+def test_prune_drops_only_refilled_buckets():
+    clock = FakeClock()
+    store = main.InMemoryRateLimitStore(max_keys=2, clock=clock)
+    run(store.take("a", 1.0, burst=5))
+    clock.advance(10)
+    run(store.take("b", 1.0, burst=5))
+    run(store.take("c", 1.0, burst=5))
+    assert set(store._buckets) == {"b", "c"}
+
+
+class IdleQueue:
+    """Stands in for AnalysisQueue in AdmissionController tests."""
+    def __init__(self, wait=0.0):
+        self.wait = wait
+
+    def estimated_wait(self):
+        return self.wait
+
+
+def controller(queue=None, clock=None, max_queue_wait=30):
+    store = main.InMemoryRateLimitStore(clock=clock or FakeClock())
+    return main.AdmissionController(store, queue or IdleQueue(), user_per_minute=6, user_burst=2,
+                                    contest_per_minute=60, contest_burst=3, max_queue_wait=max_queue_wait)
+
+
+def rejection(admission, *args):
+    with pytest.raises(main.HTTPException) as exc:
+        run(admission.admit(*args))
+    assert exc.value.status_code == 429
+    return exc.value
+
+
+def test_user_limit_retry_after_rounds_up_to_the_next_token():
+    clock = FakeClock()
+    admission = controller(clock=clock)
+    run(admission.admit("a@example.com"))
+    run(admission.admit("a@example.com"))
+    assert rejection(admission, "a@example.com").headers["Retry-After"] == "10"
+    clock.advance(9.5)
+    assert rejection(admission, "a@example.com").headers["Retry-After"] == "1"
+    clock.advance(0.5)
+    run(admission.admit("a@example.com"))
+    run(admission.admit("b@example.com"))  # other users have their own bucket
+
+
+def test_contest_limit_refunds_the_user_token():
+    clock = FakeClock()
+    admission = controller(clock=clock)
+    for user in ("a", "b", "c"):
+        run(admission.admit(f"{user}@example.com", "contest-1"))
+    assert rejection(admission, "d@example.com", "contest-1").headers["Retry-After"] == "1"
+    # d's user token was refunded: two more admissions once the contest bucket refills
+    clock.advance(2)
+    run(admission.admit("d@example.com", "contest-1"))
+    run(admission.admit("d@example.com", "contest-1"))
+
+
+def test_backlog_sheds_before_spending_tokens():
+    queue = IdleQueue(wait=45.2)
+    admission = controller(queue=queue, max_queue_wait=30)
+    exc = rejection(admission, "a@example.com")
+    assert exc.headers["Retry-After"] == "16"
+    assert "backlog" in exc.detail
+    queue.wait = 30
+    run(admission.admit("a@example.com"))
+    run(admission.admit("a@example.com"))  # the shed request took no token
+
+
+def test_zero_rate_disables_a_bucket():
+    store = main.InMemoryRateLimitStore(clock=FakeClock())
+    admission = main.AdmissionController(store, IdleQueue(), user_per_minute=0, user_burst=1,
+                                         contest_per_minute=0, contest_burst=1, max_queue_wait=30)
+    for _ in range(10):
+        run(admission.admit("a@example.com", "contest-1"))
+
+
+def make_queue(workers=2, service_time=8.0, maxsize=10, clock=None):
+    return main.AnalysisQueue(main.InMemoryJobStore(100, 3600), workers=workers, maxsize=maxsize,
+                              service_time=service_time, clock=clock or FakeClock())
+
+
+def test_estimated_wait_counts_jobs_ahead_per_worker():
+    async def scenario():
+        queue = make_queue(workers=2, service_time=8.0)
+        assert queue.estimated_wait() == 0.0
+        queue._queue = asyncio.Queue()
+        queue._busy = 2
+        assert queue.estimated_wait() == pytest.approx(4.0)  # next free worker in service_time / workers
+        for _ in range(3):
+            queue._queue.put_nowait(None)
+        assert queue.estimated_wait() == pytest.approx(16.0)
+        queue._busy = 0
+        queue._queue = asyncio.Queue()
+        assert queue.estimated_wait() == 0.0
+
+    run(scenario())
+
+
+def test_full_queue_retry_after():
+    exc = make_queue(workers=4, service_time=10.0)._queue_full()
+    assert exc.status_code == 429
+    assert exc.headers["Retry-After"] == "3"
+    assert make_queue(workers=8, service_time=1.0)._queue_full().headers["Retry-After"] == "1"
+
+
+def test_service_time_is_a_moving_average_of_job_durations(monkeypatch):
+    clock = FakeClock()
+    queue = make_queue(workers=1, service_time=10.0, clock=clock)
+
+    async def run_job(job_id, payload, doc):
+        clock.advance(20)
+
+    monkeypatch.setattr(queue, "_run", run_job)
+    monkeypatch.setattr(main.llm_service, "api_key", "")
+
+    async def scenario():
+        job_id = await queue.submit({"submitter_email": "a@example.com"}, {"code": "x", "language": "python"})
+        await queue._queue.join()
+        return job_id
+
+    run(scenario())
+    assert queue.service_time == pytest.approx(0.8 * 10 + 0.2 * 20)
+
+
+def test_refund_returns_user_and_contest_tokens():
+    admission = controller()
+    run(admission.admit("a@example.com", "contest-1"))
+    run(admission.admit("a@example.com", "contest-1"))
+    rejection(admission, "a@example.com", "contest-1")
+    run(admission.refund("a@example.com", "contest-1"))
+    run(admission.admit("a@example.com", "contest-1"))
+    assert admission.store._buckets["contest:contest-1"][0] == 1
+
+
+def test_queue_full_refunds_the_admission(mongo, monkeypatch):
+    admission = controller()
+    monkeypatch.setattr(main, "admission", admission)
+    full = make_queue(workers=1)
+
+    async def submit(doc, payload):
+        raise full._queue_full()
+
+    monkeypatch.setattr(main.analysis_queue, "submit", submit)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"email": "a@example.com", "role": "student"}
+    try:
+        client = TestClient(main.app)
+        for _ in range(3):
+            response = client.post("/plagiarism/check", json={"code": "print(1)", "language": "python"})
+            assert response.status_code == 429
+            assert response.json()["detail"] == "Analysis queue is full, please retry shortly"
+    finally:
+        main.app.dependency_overrides.clear()
+    # Every refused request gave its token back: the user's burst of 2 is intact
+    assert admission.store._buckets["user:a@example.com"][0] == 2
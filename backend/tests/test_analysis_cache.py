@@ -0,0 +1,31 @@
+import main
+from main import analysis_cache_key, normalize_code
+
+
+def test_formatting_and_comment_edits_share_a_key():
+    original = "def add(a, b):\n    return a + b\n"
+    reformatted = "# adds\ndef add(a,  b):   \n\n    return a  +  b  # sum\n"
+    assert analysis_cache_key(original, "python") == analysis_cache_key(reformatted, "python")
+    assert analysis_cache_key("int x = 1; // one", "c") == analysis_cache_key("int  x = 1;\n/* c */", "c")
+
+
+def test_python_indentation_is_part_of_the_code():
+    inside = "for x in xs:\n    total += x\n    print(total)\n"
+    after = "for x in xs:\n    total += x\nprint(total)\n"
+    assert normalize_code(inside, "python") == "for x in xs:\n    total += x\n    print(total)"
+    assert analysis_cache_key(inside, "python") != analysis_cache_key(after, "python")
+    # Languages with braces still ignore indentation
+    assert normalize_code("if (x) {\n    y();\n}", "java") == "if (x) {\ny();\n}"
+
+
+def test_comment_markers_inside_strings_are_kept():
+    assert normalize_code('print("# not a comment")  # comment', "python") == 'print("# not a comment")'
+
+
+def test_key_changes_with_model_deployment_and_prompt_version(monkeypatch):
+    key = analysis_cache_key("print(1)", "python")
+    monkeypatch.setattr(main.llm_service, "deployment", "gpt-4o")
+    assert analysis_cache_key("print(1)", "python") != key
+    monkeypatch.undo()
+    monkeypatch.setattr(main, "PROMPT_VERSION", main.PROMPT_VERSION + "-next")
+    assert analysis_cache_key("print(1)", "python") != key
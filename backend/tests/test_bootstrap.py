@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+def track_bootstrap(monkeypatch):
+    calls = []
+
+    async def ensure_indexes(database=None):
+        calls.append("indexes")
+        return {}
+
+    async def recover(stale_seconds, max_recoveries):
+        calls.append("recover")
+        return {"requeued": 0, "failed": 0, "skipped": 0}
+
+    monkeypatch.setattr(main, "bootstrap", main.Bootstrap())
+    monkeypatch.setattr(main, "ensure_indexes", ensure_indexes)
+    monkeypatch.setattr(main.analysis_queue, "recover", recover)
+    return calls
+
+
+def test_first_request_bootstraps_indexes_when_no_lifespan_ran(monkeypatch):
+    calls = track_bootstrap(monkeypatch)
+    monkeypatch.setattr(main.settings, "BOOTSTRAP_ON_FIRST_REQUEST", True)
+    client = TestClient(main.app)  # not entered: no lifespan, as under Mangum
+    for _ in range(3):
+        client.get("/docs")
+    # Jobs are not recovered where the process may be frozen after the response
+    assert calls == ["indexes"]
+    assert main.bootstrap.done
+
+
+def test_lifespan_bootstraps_once_with_job_recovery(monkeypatch):
+    calls = track_bootstrap(monkeypatch)
+    monkeypatch.setattr(main.settings, "BOOTSTRAP_ON_FIRST_REQUEST", True)
+    with TestClient(main.app) as client:
+        assert calls == ["indexes", "recover"]
+        client.get("/docs")
+    assert calls == ["indexes", "recover"]
@@ -0,0 +1,40 @@
+import asyncio
+import sys
+
+import main
+
+
+def make_store(cache_size=100, cache_bytes=4096):
+    return main.CodeBlobStore(main.code_blobs_collection, "zlib", 1024 * 1024, cache_size, cache_bytes)
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    store = make_store()
+    body = "x" * 900
+    for i in range(4):
+        store._remember(f"k{i}", body + str(i))
+    store._remember("k0", body + "0")  # touch: k1 is now the oldest
+    store._remember("k4", body + "4")
+    assert "k1" not in store._bodies
+    assert list(store._bodies) == ["k2", "k3", "k0", "k4"]
+    assert store._cached_bytes == sum(sys.getsizeof(v) for v in store._bodies.values())
+    assert store._cached_bytes <= store.cache_bytes
+
+
+def test_cache_skips_bodies_larger_than_a_quarter_of_the_budget():
+    store = make_store()
+    store._remember("small", "print(1)")
+    store._remember("huge", "y" * 2000)
+    assert list(store._bodies) == ["small"]
+
+
+def test_uncached_large_body_is_still_readable(mongo):
+    store = make_store()
+    code = "z = 1\n" * 500
+
+    async def roundtrip():
+        key = await store.put(code)
+        assert key not in store._bodies
+        return await store.get(key)
+
+    assert asyncio.run(roundtrip()) == code
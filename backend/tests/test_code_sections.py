@@ -0,0 +1,135 @@
+import main
+
+
+def python_function(name, statements=6):
+    body = "\n".join(f"    total = total + {name}_value_{i} * {i}" for i in range(statements))
+    return f"def {name}(items):\n    total = 0\n{body}\n    return total\n"
+
+
+def java_method(name, statements=6):
+    body = "\n".join(f"        total += {name}Value{i} * {i};" for i in range(statements))
+    return f"    int {name}(int[] items) {{\n        int total = 0;\n{body}\n        return total;\n    }}\n"
+
+
+def assert_covers(sections, code):
+    """Sections are in order, do not overlap and keep every non-blank line."""
+    lines = code.splitlines()
+    previous_end = 0
+    for s in sections:
+        assert s["start_line"] > previous_end
+        assert s["end_line"] >= s["start_line"]
+        assert s["code"] == "\n".join(lines[s["start_line"] - 1:s["end_line"]])
+        previous_end = s["end_line"]
+    kept = [l for s in sections for l in s["code"].splitlines() if l.strip()]
+    assert kept == [l for l in lines if l.strip()]
+
+
+def test_python_splits_at_function_boundaries():
+    functions = [python_function(n) for n in ("alpha", "beta", "gamma")]
+    code = "\n".join(functions)
+    budget = max(main.count_tokens(f) for f in functions) + 5  # one function fits, two do not
+    sections = main.split_code_sections(code, "python", budget, max_sections=8)
+    assert [s["name"] for s in sections] == ["alpha", "beta", "gamma"]
+    assert all(s["kind"] == "function" for s in sections)
+    assert sections[0]["start_line"] == 1
+    assert_covers(sections, code)
+
+
+def test_brace_language_splits_where_depth_returns_to_zero():
+    methods = [java_method(n) for n in ("alpha", "beta")]
+    code = "".join(m.replace("    ", "", 1) for m in methods)
+    budget = max(main.count_tokens(m) for m in methods) + 5
+    sections = main.split_code_sections(code, "java", budget, max_sections=8)
+    assert [s["name"] for s in sections] == ["alpha", "beta"]
+    assert_covers(sections, code)
+
+
+def test_single_section_input():
+    code = python_function("solo")
+    sections = main.split_code_sections(code, "python", 10_000, max_sections=8)
+    assert len(sections) == 1
+    assert sections[0]["name"] == "solo"
+    assert (sections[0]["start_line"], sections[0]["end_line"]) == (1, len(code.splitlines()))
+
+
+def test_small_neighbours_are_merged():
+    functions = [python_function(n, statements=1) for n in ("a", "b", "c")]
+    code = "\n".join(functions)
+    sections = main.split_code_sections(code, "python", 10_000, max_sections=8)
+    assert len(sections) == 1
+    assert sections[0]["name"] == "a, b, c"
+    assert sections[0]["kind"] == "block"
+    assert_covers(sections, code)
+
+
+def test_oversized_single_function_is_cut_into_line_chunks_within_budget():
+    code = python_function("huge", statements=80)
+    budget = main.count_tokens(code) // 5
+    sections = main.split_code_sections(code, "python", budget, max_sections=50)
+    assert len(sections) > 1
+    assert all(s["tokens"] <= budget for s in sections)
+    assert all(s["name"].startswith("huge (part ") for s in sections)
+    assert_covers(sections, code)
+
+
+def test_section_count_is_capped():
+    functions = [python_function(f"f{i}") for i in range(10)]
+    code = "\n".join(functions)
+    budget = max(main.count_tokens(f) for f in functions) + 5
+    sections = main.split_code_sections(code, "python", budget, max_sections=3)
+    assert len(sections) <= 3
+    assert_covers(sections, code)
+
+
+def analysis(detected, confidence, **extra):
+    result = {
+        "is_valid_code": True,
+        "plagiarism_detected": detected,
+        "confidence_score": confidence,
+        "explanation": "why",
+        "red_flags": ["shared flag"],
+        "evaluation_metrics": {
+            "code_correctness": {"status": "Passed", "test_cases": "3", "failed_cases": "0"},
+            "code_readability": {"score": 8, "suggestions": ["rename x"]},
+        },
+    }
+    result.update(extra)
+    return result
+
+
+SECTIONS = [
+    {"name": "small", "kind": "function", "start_line": 1, "end_line": 5, "tokens": 100},
+    {"name": "large", "kind": "function", "start_line": 7, "end_line": 30, "tokens": 300},
+]
+
+
+def test_merge_uses_the_most_confident_flagged_section():
+    results = [analysis(True, 60, likely_source="GitHub"), analysis(True, "90", likely_source="Stack Overflow")]
+    merged = main.merge_section_analyses(SECTIONS, results)
+    assert merged["plagiarism_detected"] is True
+    assert merged["confidence_score"] == 90
+    assert merged["likely_source"] == "Stack Overflow"
+    assert [s["plagiarism_detected"] for s in merged["sections"]] == [True, True]
+
+
+def test_merge_without_detection_weights_confidence_by_section_size():
+    results = [analysis(False, 40), analysis(False, "20.0")]
+    merged = main.merge_section_analyses(SECTIONS, results)
+    assert merged["plagiarism_detected"] is False
+    assert merged["likely_source"] == "Original student work"
+    assert merged["confidence_score"] == round((40 * 100 + 20 * 300) / 400)
+
+
+def test_merge_combines_flags_correctness_and_validity():
+    failed = analysis(True, 70, is_valid_code=False, red_flags=["shared flag", "odd naming"], evaluation_metrics={
+        "code_correctness": {"status": "Failed", "test_cases": 2, "failed_cases": "1"},
+        "code_readability": {"score": "4", "suggestions": ["rename x"]},
+    })
+    merged = main.merge_section_analyses(SECTIONS, [analysis(False, 10), failed])
+    assert merged["is_valid_code"] is False
+    assert merged["red_flags"] == ["shared flag", "odd naming"]
+    correctness = merged["evaluation_metrics"]["code_correctness"]
+    assert correctness == {"status": "Failed", "test_cases": "5", "failed_cases": "1"}
+    readability = merged["evaluation_metrics"]["code_readability"]
+    assert readability == {"score": round((8 * 100 + 4 * 300) / 400, 1), "suggestions": ["rename x"]}
+    assert merged["explanation"].startswith("[small, lines 1-5] why")
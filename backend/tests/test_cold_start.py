@@ -0,0 +1,68 @@
+import json
+import subprocess
+import sys
+
+import main
+from benchmarks import cold_start
+
+DEFERRED = ("openai", "motor", "numpy", "passlib", "uvicorn")
+
+PROBE = """
+import json, sys
+import main
+print(json.dumps({"loaded": [m for m in %r if m in sys.modules],
+                  "clients": [main._client is None, main.llm_service._client is None]}))
+""" % (DEFERRED,)
+
+
+def test_importing_main_defers_heavy_modules_and_clients():
+    proc = subprocess.run([sys.executable, "-c", PROBE], cwd=cold_start.BACKEND_DIR, env=cold_start.child_env(),
+                          capture_output=True, text=True, check=True)
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert probe == {"loaded": [], "clients": [True, True]}
+
+
+def test_first_request_through_the_serverless_handler():
+    result = cold_start.cold_start("/metrics")
+    assert result["status"] == 404  # /metrics is hidden without a token, and needs no database
+    assert 0 < result["import_ms"] < result["process_ms"]
+    assert result["first_response_ms"] > 0
+
+
+def test_the_database_client_is_created_once_and_reused(monkeypatch):
+    created = []
+
+    class FakeMotorClient(dict):
+        def __init__(self, uri, event_listeners):
+            super().__init__(coding_platform={})
+            created.append(uri)
+
+    import motor.motor_asyncio
+    monkeypatch.setattr(motor.motor_asyncio, "AsyncIOMotorClient", FakeMotorClient)
+    monkeypatch.setattr(main, "_client", None)
+    client = main.get_client()
+    assert main.get_client() is client
+    assert created == [main.MONGODB_URI]
+
+
+def test_collections_resolve_lazily_and_once():
+    resolved = []
+
+    class Database:
+        name = "coding_platform"
+
+        def resolve(self):
+            resolved.append(self.name)
+            return {"users": {"count": 3}}
+
+    users = main.LazyCollection(Database(), "users")
+    assert resolved == []
+    assert users.get("count") == 3 and users.get("count") == 3
+    assert resolved == ["coding_platform"]
+
+
+def test_importtime_lists_the_slowest_direct_imports():
+    rows = cold_start.importtime(5)
+    assert 0 < len(rows) <= 5
+    assert [ms for _, ms in rows] == sorted((ms for _, ms in rows), reverse=True)
+    assert not {name for name, _ in rows} & set(DEFERRED)
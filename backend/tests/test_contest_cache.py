@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+TEACHER = {"email": "t@example.com", "role": "teacher"}
+
+
+class CountingCollection:
+    """The contests collection, counting reads and optionally slowing them down."""
+    def __init__(self, collection, delay=0.0):
+        self.collection = collection
+        self.delay = delay
+        self.reads = 0
+
+    async def find_one(self, *args, **kwargs):
+        self.reads += 1
+        await asyncio.sleep(self.delay)
+        return await self.collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.collection, attr)
+
+
+@pytest.fixture
+def contest(mongo):
+    doc = {"_id": ObjectId(), "teacher_email": TEACHER["email"], "contest_code": "ABC123", "is_active": False,
+           "questions": [{"id": "q1", "title": "Echo"}, {"id": "q2", "title": "Sum"}]}
+    asyncio.run(main.contests_collection.insert_one(doc))
+    return doc
+
+
+def cache(delay=0.0, ttl_seconds=60.0):
+    collection = CountingCollection(main.contests_collection, delay)
+    return main.ContestCache(collection, max_entries=16, ttl_seconds=ttl_seconds, watch=False), collection
+
+
+def test_concurrent_misses_share_one_fetch_and_later_reads_hit(contest):
+    contests, collection = cache(delay=0.05)
+
+    async def scenario():
+        found = await asyncio.gather(*(contests.get_by_code("ABC123") for _ in range(20)))
+        assert collection.reads == 1
+        assert {str(c["_id"]) for c in found} == {str(contest["_id"])}
+        await contests.get_by_code("ABC123")
+        assert await contests.get_by_code("NOPE") is None
+        await contests.get_by_code("NOPE")  # unknown codes are cached too
+        assert collection.reads == 2
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_discards_entries_and_loads_already_in_flight(contest):
+    contests, collection = cache(delay=0.05)
+    contest_id = str(contest["_id"])
+
+    async def scenario():
+        await contests.get_by_id(contest_id)
+        contests.invalidate()
+        await contests.get_by_id(contest_id)
+        assert collection.reads == 2
+
+        # A load that raced a write must not be stored
+        contests.invalidate()
+        loading = asyncio.ensure_future(contests.get_by_id(contest_id))
+        await asyncio.sleep(0.01)
+        contests.invalidate()
+        await loading
+        await contests.get_by_id(contest_id)
+        assert collection.reads == 4
+        await contests.get_by_id(contest_id)
+        assert collection.reads == 4
+
+    asyncio.run(scenario())
+
+
+def test_entries_expire_after_the_ttl(contest):
+    contests, collection = cache(ttl_seconds=0.0)
+
+    async def scenario():
+        await contests.get_by_code("ABC123")
+        await contests.get_by_code("ABC123")
+
+    asyncio.run(scenario())
+    assert collection.reads == 2
+
+
+def test_questions_resolve_from_the_cached_contest_or_a_projection(contest):
+    contests, collection = cache()
+    contest_id = str(contest["_id"])
+
+    async def scenario():
+        uncached, question = await contests.get_question(contest_id, ("title", "Sum"))
+        assert question == {"id": "q2", "title": "Sum"}
+        assert uncached["questions"] == [question]  # only the matching question was fetched
+        contest_only, missing = await contests.get_question(contest_id, ("id", "q9"))
+        assert contest_only["_id"] == contest["_id"] and missing is None
+
+        await contests.get_by_id(contest_id)
+        reads = collection.reads
+        cached, question = await contests.get_question(contest_id, ("id", "q1"))
+        assert question["title"] == "Echo" and len(cached["questions"]) == 2
+        assert (await contests.get_question(contest_id, ("title", "Missing")))[1] is None
+        assert collection.reads == reads
+        assert await contests.get_question(str(ObjectId()), ("id", "q1")) == (None, None)
+
+    asyncio.run(scenario())
+
+
+def test_a_missing_change_stream_falls_back_to_the_ttl(contest):
+    contests = main.ContestCache(main.contests_collection, max_entries=16, ttl_seconds=60.0, watch=True)
+
+    async def scenario():
+        await contests.get_by_code("ABC123")
+        await asyncio.wait_for(contests._watcher, 1)
+
+    asyncio.run(scenario())
+    assert contests.watch is False
+
+
+def test_starting_a_contest_refreshes_the_active_list(contest):
+    client = TestClient(main.app)
+    assert client.get("/contest/active").json() == []
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: TEACHER
+    try:
+        assert client.post(f"/contest/start/{contest['_id']}").status_code == 200
+    finally:
+        main.app.dependency_overrides.clear()
+    assert [c["id"] for c in client.get("/contest/active").json()] == [str(contest["_id"])]
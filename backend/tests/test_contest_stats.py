@@ -0,0 +1,44 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import main
+
+
+@pytest.mark.parametrize("value, expected", [
+    (85, 85), ("85", 85), (85.5, 86), (" 72.4 ", 72), ("0.9", 1), (None, 0), ("high", 0), (float("nan"), 0),
+])
+def test_as_int_rounds_numeric_scores(value, expected):
+    assert main._as_int(value) == expected
+
+
+def test_incremental_stats_match_rebuild_for_float_scores(mongo, monkeypatch):
+    stats = main.ContestStats(main.contest_stats_collection, main.contest_participants_collection)
+    monkeypatch.setattr(main, "contest_stats", stats)
+    contest_id = str(ObjectId())
+    scores = [85.5, "0.9", 70, "not a number", None]
+
+    async def scenario():
+        for i, score in enumerate(scores):
+            submission = {"contest_id": contest_id, "question_title": "Two Sum", "student_email": f"s{i % 3}@example.com",
+                          "submitted_at": datetime(2026, 1, 1, 10, i)}
+            result = await main.submissions_collection.insert_one(dict(submission))
+            await stats.record_submission(submission)
+
+            doc = {"contest_id": contest_id, "question_title": "Two Sum", "submission_id": str(result.inserted_id)}
+            fields = {"status": main.JOB_COMPLETED,
+                      "plagiarism_analysis": {"confidence_score": score, "plagiarism_detected": i == 0}}
+            await main.codes_collection.insert_one(dict(doc, **fields))
+            await stats.record_analysis(str(ObjectId()), doc, fields)
+
+        return await stats.get(contest_id), await main.rebuild_contest_stats(contest_id, check=True)
+
+    served, report = asyncio.run(scenario())
+    assert report["mismatched"] == []
+    assert served["analyzed"] == 5
+    assert served["max_confidence"] == 86
+    assert served["average_confidence"] == round((86 + 1 + 70) / 5, 1)
+    assert served["participants"] == 3
+    assert served["questions"][0]["flagged"] == 1
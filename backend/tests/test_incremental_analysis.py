@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+import main
+
+NAMES = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+def python_function(name, statements=12):
+    body = "\n".join(f"    total = total + {name}_value_{i} * {i} - {name}_offset" for i in range(statements))
+    return f"def {name}(items):\n    total = 0\n{body}\n    return total\n"
+
+
+def program(functions):
+    return "\n".join(functions)
+
+
+FUNCTIONS = {name: python_function(name) for name in NAMES}
+ORIGINAL = program(FUNCTIONS.values())
+
+
+def lines_of(code, name):
+    lines = code.splitlines()
+    start = lines.index(f"def {name}(items):") + 1
+    return set(range(start, start + len(FUNCTIONS[name].splitlines())))
+
+
+def dirty_names(plan):
+    return {n.strip() for s in plan["sections"] for n in s["name"].split(",")}
+
+
+def test_unchanged_code_has_no_changed_lines():
+    assert main.diff_changed_lines(ORIGINAL, ORIGINAL) == (set(), 0.0)
+
+
+def test_edited_line_is_reported_at_its_new_position():
+    code = ORIGINAL.replace("gamma_value_3 * 3", "gamma_value_3 * 30")
+    changed, ratio = main.diff_changed_lines(ORIGINAL, code)
+    assert len(changed) == 1
+    assert changed <= lines_of(code, "gamma")
+    assert 0 < ratio < 0.05
+
+
+def test_inserted_section_lines_are_changed():
+    extra = python_function("inserted")
+    code = program([FUNCTIONS["alpha"], extra] + [FUNCTIONS[n] for n in NAMES[1:]])
+    changed, _ = main.diff_changed_lines(ORIGINAL, code)
+    start = code.splitlines().index("def inserted(items):") + 1
+    inserted = set(range(start, start + len(extra.splitlines())))
+    # Identical lines around the gap ("return total", blanks) may be attributed to either side
+    assert len(changed) == len(inserted) + 1  # the function plus its separating blank line
+    assert len(inserted - changed) <= 1
+    assert not changed & lines_of(code, "theta")
+
+    plan = main.plan_incremental_analysis(ORIGINAL, code, "python")
+    assert "inserted" in dirty_names(plan)
+    assert "theta" not in dirty_names(plan)
+
+
+def test_deleted_section_marks_the_line_after_the_gap():
+    code = program(FUNCTIONS[n] for n in NAMES if n != "delta")
+    changed, ratio = main.diff_changed_lines(ORIGINAL, code)
+    # A single stand-in line near the gap (its exact position is ambiguous between repeated lines)
+    assert len(changed) == 1
+    assert abs(min(changed) - min(lines_of(code, "epsilon"))) <= 2
+    assert ratio == pytest.approx(len(FUNCTIONS["delta"].splitlines()) / len(ORIGINAL.splitlines()), abs=0.02)
+
+    plan = main.plan_incremental_analysis(ORIGINAL, code, "python")
+    assert plan is not None
+    assert "alpha" not in dirty_names(plan)
+
+
+def test_deletion_at_the_end_stays_within_the_file():
+    code = program(FUNCTIONS[n] for n in NAMES[:-1])
+    changed, _ = main.diff_changed_lines(ORIGINAL, code)
+    assert changed and max(changed) <= len(code.splitlines())
+
+
+def test_moved_section_is_reanalysed():
+    order = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "eta"]
+    code = program(FUNCTIONS[n] for n in order)
+    changed, ratio = main.diff_changed_lines(ORIGINAL, code)
+    assert lines_of(code, "eta") <= changed or lines_of(code, "theta") <= changed
+    assert ratio < main.settings.INCREMENTAL_MAX_CHANGE_RATIO
+
+    plan = main.plan_incremental_analysis(ORIGINAL, code, "python")
+    assert dirty_names(plan) & {"eta", "theta"}
+    assert "alpha" not in dirty_names(plan)
+
+
+def test_large_change_falls_back_to_full_analysis():
+    code = program(python_function(f"rewritten_{n}") for n in NAMES[:4]) + "\n" + program(
+        FUNCTIONS[n] for n in NAMES[4:])
+    _, ratio = main.diff_changed_lines(ORIGINAL, code)
+    assert ratio > main.settings.INCREMENTAL_MAX_CHANGE_RATIO
+    assert main.plan_incremental_analysis(ORIGINAL, code, "python") is None
+
+
+def test_change_touching_every_section_falls_back_to_full_analysis():
+    code = ORIGINAL.replace("total = 0", "total = 1")
+    _, ratio = main.diff_changed_lines(ORIGINAL, code)
+    assert ratio < main.settings.INCREMENTAL_MAX_CHANGE_RATIO
+    assert main.plan_incremental_analysis(ORIGINAL, code, "python") is None
+
+
+PRIOR = {"is_valid_code": True, "plagiarism_detected": False, "confidence_score": 10, "explanation": "original",
+         "execution": {"verdict": "AC"}}
+
+
+def previous(code=ORIGINAL, analysis=PRIOR):
+    return {"job_id": "job-1", "code": code, "analysis": dict(analysis)}
+
+
+def fake_sections(monkeypatch, outcome):
+    calls = []
+
+    async def analyze(sections, *args, **kwargs):
+        calls.append([s["name"] for s in sections])
+        return [outcome(s) if callable(outcome) else outcome for s in sections]
+
+    monkeypatch.setattr(main, "analyze_sections", analyze)
+    return calls
+
+
+def test_incremental_analysis_reanalyses_only_changed_sections(monkeypatch):
+    calls = fake_sections(monkeypatch, {"plagiarism_detected": False, "confidence_score": 30, "explanation": "edit"})
+    code = ORIGINAL.replace("gamma_value_3 * 3", "gamma_value_3 * 30")
+    result = asyncio.run(main.run_incremental_analysis(previous(), code, "python"))
+    assert len(calls) == 1 and any("gamma" in name for name in calls[0])
+    assert result["analysis_mode"] == "incremental"
+    assert result["incremental"]["previous_job_id"] == "job-1"
+    assert result["incremental"]["changed_lines"] == 1
+    assert 0 < result["incremental"]["reanalyzed_tokens"] < result["incremental"]["reused_tokens"]
+    assert "execution" not in result
+    assert 10 < result["confidence_score"] < 30
+
+
+def test_unchanged_resubmission_reuses_the_previous_analysis(monkeypatch):
+    calls = fake_sections(monkeypatch, {})
+    result = asyncio.run(main.run_incremental_analysis(previous(), ORIGINAL, "python"))
+    assert calls == []
+    assert result["explanation"] == "original"
+    assert result["incremental"]["reanalyzed_sections"] == []
+
+
+def test_previous_plagiarism_verdict_is_rejudged_in_full(monkeypatch):
+    fake_sections(monkeypatch, {})
+    flagged = dict(PRIOR, plagiarism_detected=True)
+    code = ORIGINAL.replace("gamma_value_3 * 3", "gamma_value_3 * 30")
+    assert asyncio.run(main.run_incremental_analysis(previous(analysis=flagged), code, "python")) is None
+
+
+def test_failed_section_falls_back_and_unavailable_llm_propagates(monkeypatch):
+    code = ORIGINAL.replace("gamma_value_3 * 3", "gamma_value_3 * 30")
+    fake_sections(monkeypatch, ValueError("bad json"))
+    assert asyncio.run(main.run_incremental_analysis(previous(), code, "python")) is None
+
+    fake_sections(monkeypatch, main.LLMUnavailableError("circuit open"))
+    with pytest.raises(main.LLMUnavailableError):
+        asyncio.run(main.run_incremental_analysis(previous(), code, "python"))
+
+
+def test_only_full_analyses_are_shared_through_the_cache(mongo, monkeypatch):
+    monkeypatch.setattr(type(main.llm_service), "available", property(lambda self: True))
+    cache = main.AnalysisCache(main.analysis_cache_collection, 16, 60)
+    monkeypatch.setattr(main, "analysis_cache", cache)
+    fake_sections(monkeypatch, {"plagiarism_detected": False, "confidence_score": 30, "explanation": "edit"})
+    code = ORIGINAL.replace("gamma_value_3 * 3", "gamma_value_3 * 30")
+    key = main.analysis_cache_key(code, "python")
+
+    result = asyncio.run(main.run_plagiarism_analysis(code, "python", previous=previous()))
+    assert result["analysis_mode"] == "incremental"
+    assert asyncio.run(cache.get(key)) is None
+
+    async def full_analysis(*args, **kwargs):
+        return {"plagiarism_detected": False, "confidence_score": 20, "explanation": "full"}
+
+    monkeypatch.setattr(main, "run_full_analysis", full_analysis)
+    assert asyncio.run(main.run_plagiarism_analysis(code, "python"))["explanation"] == "full"
+    assert asyncio.run(cache.get(key))["explanation"] == "full"
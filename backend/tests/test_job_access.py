@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+TEACHER = {"email": "owner@example.com", "role": "teacher"}
+OTHER_TEACHER = {"email": "other@example.com", "role": "teacher"}
+STUDENT = {"email": "student@example.com", "role": "student"}
+
+
+@pytest.fixture
+def job(mongo, monkeypatch):
+    contest_id = ObjectId()
+    asyncio.run(main.contests_collection.insert_one({"_id": contest_id, "teacher_email": TEACHER["email"]}))
+    job_id = str(ObjectId())
+    doc = {"_id": job_id, "status": main.JOB_COMPLETED, "plagiarism_analysis": {"confidence_score": 10},
+           "submitter_email": STUDENT["email"], "contest_id": str(contest_id)}
+
+    async def get(requested):
+        return dict(doc) if requested == job_id else None
+
+    monkeypatch.setattr(main.analysis_queue.store, "get", get)
+    return job_id
+
+
+def fetch(job_id, user):
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    try:
+        return TestClient(main.app).get(f"/plagiarism/jobs/{job_id}")
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_submitter_and_contest_teacher_can_read_job(job):
+    assert fetch(job, STUDENT).status_code == 200
+    assert fetch(job, TEACHER).json()["job_id"] == job
+
+
+def test_other_teacher_cannot_read_job(job):
+    assert fetch(job, OTHER_TEACHER).status_code == 403
+    assert fetch(job, {"email": "someone@example.com", "role": "student"}).status_code == 403
+
+
+def test_teacher_cannot_read_job_without_contest(mongo):
+    job = {"_id": "x", "submitter_email": STUDENT["email"]}
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.authorize_job_access(job, TEACHER))
+    assert exc.value.status_code == 403
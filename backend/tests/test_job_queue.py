@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_store_is_bounded_by_count_and_age():
+    clock = FakeClock()
+    store = main.InMemoryJobStore(max_jobs=3, ttl_seconds=60, clock=clock)
+
+    async def scenario():
+        ids = [await store.create({"n": n}) for n in range(4)]
+        assert await store.get(ids[0]) is None
+        assert [(await store.get(i))["n"] for i in ids[1:]] == [1, 2, 3]
+
+        clock.now += 61
+        fresh = await store.create({"n": 4})
+        assert [await store.get(i) for i in ids[1:]] == [None, None, None]
+        assert (await store.get(fresh))["n"] == 4
+
+    asyncio.run(scenario())
+
+
+def stale_job(status, minutes_ago, **fields):
+    at = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    since = "queued_at" if status == main.JOB_QUEUED else "started_at"
+    return dict({"submitter_email": "s@example.com", "language": "python", "status": status,
+                 "plagiarism_analysis": None, since: at}, **fields)
+
+
+def test_recovery_requeues_abandoned_jobs_once(mongo):
+    store = main.MongoJobStore(main.codes_collection)
+    queue = main.AnalysisQueue(store, workers=1, maxsize=10, service_time=1.0)
+
+    async def scenario():
+        code_hash = await main.code_blobs.put("print('resumed')")
+        running = await store.create(stale_job(main.JOB_RUNNING, 30, code_hash=code_hash))
+        queued = await store.create(stale_job(main.JOB_QUEUED, 30, code_hash=code_hash))
+        fresh = await store.create(stale_job(main.JOB_RUNNING, 1, code_hash=code_hash))
+        lost_code = await store.create(stale_job(main.JOB_QUEUED, 30, code_hash="0" * 64))
+        exhausted = await store.create(stale_job(main.JOB_RUNNING, 30, code_hash=code_hash, recoveries=2))
+
+        report = await queue.recover(stale_seconds=600, max_recoveries=2)
+        assert report == {"requeued": 2, "failed": 2, "skipped": 0}
+        # A second process recovering at the same time finds nothing left to claim
+        assert await queue.recover(stale_seconds=600, max_recoveries=2) == {"requeued": 0, "failed": 0,
+                                                                            "skipped": 0}
+
+        for job_id in (running, queued):
+            job = await queue.wait(job_id, 5)
+            assert job["status"] == main.JOB_COMPLETED
+            assert job["recoveries"] == 1 and job["plagiarism_analysis"]
+        assert (await store.get(fresh))["status"] == main.JOB_RUNNING
+        for job_id in (lost_code, exhausted):
+            job = await store.get(job_id)
+            assert job["status"] == main.JOB_FAILED
+            assert job["error"] == "Analysis was interrupted and could not be resumed"
+
+    asyncio.run(scenario())
+
+
+def test_claim_is_refused_once_the_job_moved_on(mongo):
+    store = main.MongoJobStore(main.codes_collection)
+
+    async def scenario():
+        job = stale_job(main.JOB_QUEUED, 30)
+        job_id = await store.create(job)
+        expected = {"status": main.JOB_QUEUED, "queued_at": job["queued_at"]}
+        assert await store.claim(job_id, expected, {"queued_at": datetime.utcnow()})
+        assert not await store.claim(job_id, expected, {"queued_at": datetime.utcnow()})
+
+    asyncio.run(scenario())
+
+
+def test_submission_response_keeps_the_analysis_field(mongo, monkeypatch):
+    student = {"email": "s@example.com", "role": "student"}
+    contest_id = ObjectId()
+    question = {"id": "q1", "title": "Echo", "description": "Print the input"}
+    asyncio.run(main.contests_collection.insert_one({"_id": contest_id, "teacher_email": "t@example.com",
+                                                     "is_active": True, "questions": [question]}))
+    monkeypatch.setattr(main, "analysis_queue", main.AnalysisQueue(
+        main.InMemoryJobStore(100, 3600), workers=1, maxsize=10, service_time=1.0))
+    main.app.dependency_overrides[main.get_current_user] = lambda: student
+    try:
+        response = TestClient(main.app).post("/submissions/submit", json={
+            "contest_id": str(contest_id), "question_title": "Echo", "code": "print(input())", "language": "python"})
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["job_id"] and body["status"] in (main.JOB_QUEUED, main.JOB_RUNNING, main.JOB_COMPLETED)
+    assert "plagiarism_analysis" in body
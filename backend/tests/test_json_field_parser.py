@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import main
+
+DOCUMENT = json.dumps({
+    "plagiarism_detected": True,
+    "confidence_score": 85,
+    "explanation": 'He said "copied" here, then {braces}, [brackets] and a comma, too \\ ok',
+    "suspicious_sections": [{"lines": "1-4", "reason": "matches } and , inside"}, {"nested": [1, [2, {"x": "}"}]]}],
+    "metadata": {"a": {"b": [1, 2, 3]}, "c": "d,e}"},
+    "ratio": 0.5,
+    "notes": None,
+})
+FIELDS = list(json.loads(DOCUMENT).items())
+
+
+def feed_all(chunks):
+    parser = main.IncrementalJSONFieldParser()
+    out = []
+    for chunk in chunks:
+        out.extend(parser.feed(chunk))
+    return out
+
+
+def test_whole_document_emits_every_top_level_field_in_order():
+    assert feed_all([DOCUMENT]) == FIELDS
+
+
+@pytest.mark.parametrize("split", range(1, len(DOCUMENT)))
+def test_any_single_split_point_gives_the_same_fields(split):
+    assert feed_all([DOCUMENT[:split], DOCUMENT[split:]]) == FIELDS
+
+
+def test_character_by_character_feed():
+    assert feed_all(DOCUMENT) == FIELDS
+
+
+def test_split_inside_escape_sequence():
+    doc = '{"explanation": "a \\"quoted\\" word", "n": 1}'
+    split = doc.index("\\") + 1  # between the backslash and the escaped quote
+    assert feed_all([doc[:split], doc[split:]]) == [("explanation", 'a "quoted" word'), ("n", 1)]
+
+
+def test_field_is_emitted_as_soon_as_it_closes():
+    parser = main.IncrementalJSONFieldParser()
+    assert parser.feed('{"confidence_score": 7') == []  # the number could still grow
+    assert parser.feed('0, "expl') == [("confidence_score", 70)]
+    assert parser.feed('anation": "x"}') == [("explanation", "x")]
+
+
+def test_prose_or_code_fence_around_the_object_is_ignored():
+    assert feed_all(["```json\n", '{"a": 1}', "\n```"]) == [("a", 1)]
+
+
+@pytest.mark.parametrize("truncated, expected", [
+    ('{"a": 1, "b": "unterminated', [("a", 1)]),
+    ('{"a": 1, "b": {"c": [1, 2', [("a", 1)]),
+    ('{"a": 1, "b": 2', [("a", 1)]),
+    ('{"a": 1, "b"', [("a", 1)]),
+    ('{"a', []),
+])
+def test_truncated_input_emits_only_closed_fields(truncated, expected):
+    assert feed_all([truncated]) == expected
+
+
+@pytest.mark.parametrize("document", ['[1, 2, 3]', '["a", "b"]', '[{"a": 1}]', '"text"', '42', 'null', ''])
+def test_non_object_top_level_values_emit_nothing(document):
+    assert feed_all([document]) == []
+
+
+def test_malformed_value_is_skipped_and_parsing_continues():
+    assert feed_all(['{"a": tru, "b": 2}']) == [("b", 2)]
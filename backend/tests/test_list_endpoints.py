@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+TEACHER = {"email": "t@example.com", "role": "teacher"}
+STUDENT = {"email": "s@example.com", "role": "student"}
+
+
+def get(path, user, **params):
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    try:
+        return TestClient(main.app).get(path, params=params)
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def contests(mongo):
+    docs = [{"_id": ObjectId(), "teacher_email": TEACHER["email"], "title": f"C{i}", "is_active": True,
+             "questions": [{"id": f"q{i}", "title": "Q"}]} for i in range(5)]
+    asyncio.run(main.contests_collection.insert_many(docs))
+    return [str(d["_id"]) for d in docs]
+
+
+def test_keyset_pages_walk_every_document_once_in_insert_order(contests):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = get("/contest/teacher/mycontest", TEACHER, **params).json()
+        assert len(page["items"]) <= 2
+        seen += [c["id"] for c in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == contests
+
+    # Without limit the plain list is returned, as before
+    assert [c["id"] for c in get("/contest/teacher/mycontest", TEACHER).json()] == contests
+
+
+def test_projection_and_bad_parameters(contests):
+    slim = get("/contest/all", TEACHER, exclude="questions", limit=1).json()["items"][0]
+    assert "questions" not in slim and slim["title"] == "C0"
+    assert set(get("/contest/all", TEACHER, fields="title").json()[0]) == {"id", "title"}
+
+    assert get("/contest/all", TEACHER, fields="title", exclude="questions").status_code == 400
+    assert get("/contest/all", TEACHER, cursor="not-an-id").status_code == 400
+    assert get("/contest/all", TEACHER, limit=main.settings.MAX_PAGE_SIZE + 1).status_code == 422
+
+
+def test_ndjson_streams_one_document_per_line(contests):
+    response = get("/contest/teacher/mycontest", TEACHER, format="ndjson", limit=3, cursor=contests[0])
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [c["id"] for c in lines] == contests[1:4]
+
+
+def test_submission_lists_hydrate_code_unless_excluded(contests):
+    contest_id = contests[0]
+
+    async def seed():
+        for n in range(3):
+            code = f"print({n})"
+            await main.submissions_collection.insert_one({
+                "contest_id": contest_id, "student_email": STUDENT["email"] if n else "x@example.com",
+                "code_hash": await main.code_blobs.put(code), "language": "python"})
+    asyncio.run(seed())
+
+    full = get(f"/submissions/by-contest/{contest_id}", TEACHER).json()
+    assert [s["code"] for s in full] == ["print(0)", "print(1)", "print(2)"]
+    assert all("code_hash" not in s for s in full)
+
+    slim = get(f"/submissions/by-contest/{contest_id}", TEACHER, exclude="code").json()
+    assert all("code" not in s and "code_hash" not in s for s in slim)
+
+    # Students only see their own submissions, in every format
+    streamed = get(f"/submissions/by-contest/{contest_id}", STUDENT, format="ndjson").text.splitlines()
+    assert [json.loads(line)["code"] for line in streamed] == ["print(1)", "print(2)"]
@@ -0,0 +1,103 @@
+import asyncio
+
+import main
+
+
+def make_service():
+    service = main.LLMService(
+        api_key="key", endpoint="http://upstream", api_version="2024-02-01", deployment="gpt",
+        timeout=1, max_retries=0, backoff_base=0, backoff_max=0, max_concurrency=1, pool_size=1,
+        breaker_threshold=1, breaker_cooldown=0,
+    )
+    service.breaker.record_failure()
+    assert service.breaker.state == "half-open"
+    return service
+
+
+def test_cancelled_trial_chat_releases_half_open_breaker(monkeypatch):
+    service = make_service()
+    monkeypatch.setattr(main, "OPENAI_SDK_INSTALLED", True)
+
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    service._chat = hang
+
+    async def scenario():
+        task = asyncio.ensure_future(service.chat([{"role": "user", "content": "hi"}]))
+        await asyncio.sleep(0)
+        assert not service.breaker.allow()  # the trial is in flight
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(scenario())
+    assert service.breaker.allow()
+
+
+def test_abandoned_trial_stream_releases_half_open_breaker(monkeypatch):
+    service = make_service()
+    monkeypatch.setattr(main, "OPENAI_SDK_INSTALLED", True)
+
+    async def deltas(*args, **kwargs):
+        yield "first"
+        await asyncio.sleep(3600)
+
+    service._stream_chat = deltas
+
+    async def scenario():
+        stream = service.stream_chat([{"role": "user", "content": "hi"}])
+        assert await stream.__anext__() == "first"
+        assert not service.breaker.allow()
+        await stream.aclose()  # client disconnected mid-stream
+
+    asyncio.run(scenario())
+    assert service.breaker.allow()
+
+
+def test_stale_trial_token_does_not_release_a_newer_trial():
+    breaker = main.CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    first = breaker.current_trial
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.abandon_trial(first)
+    assert not breaker.allow()
+
+
+def bad_request():
+    import httpx
+    request = httpx.Request("POST", "http://upstream/chat/completions")
+    return main._load_openai().BadRequestError("bad", response=httpx.Response(400, request=request), body=None)
+
+
+def test_client_error_leaves_breaker_state_and_releases_the_trial(monkeypatch):
+    service = make_service()
+    monkeypatch.setattr(main, "OPENAI_SDK_INSTALLED", True)
+
+    class Completions:
+        async def create(self, **kwargs):
+            raise bad_request()
+
+    def ensure_client():
+        service._client = type("Client", (), {"chat": type("Chat", (), {"completions": Completions()})()})()
+        service._semaphore = asyncio.Semaphore(1)
+
+    service._ensure_client = ensure_client
+
+    async def scenario():
+        try:
+            await service.chat([{"role": "user", "content": "hi"}])
+        except main._load_openai().BadRequestError:
+            pass
+        else:
+            raise AssertionError("the 400 should propagate")
+
+    asyncio.run(scenario())
+    # Still half-open: a 400 is no evidence the upstream recovered, and the next call is the probe
+    assert service.breaker.state == "half-open"
+    assert service.breaker.failures == 1
+    assert service.breaker.allow()
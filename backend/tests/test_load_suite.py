@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks import fake_openai, load_suite
+
+BASELINE = {"throughput_rps": 100.0, "p95_ms": 50.0, "rss_mb": 80.0, "errors": 0}
+
+
+def result(**overrides):
+    return dict(BASELINE, requests=10, p50_ms=10.0, p99_ms=60.0, peak_rss_mb=80.0, **overrides)
+
+
+def test_percentile_picks_the_nearest_rank():
+    samples = [float(n) for n in range(1, 101)]
+    assert load_suite.percentile(samples, 50) == 51.0
+    assert load_suite.percentile(samples, 99) == 99.0
+    assert load_suite.percentile([], 95) == 0.0
+
+
+def test_regressions_beyond_the_tolerance_fail_the_run():
+    baselines = {"login_storm": BASELINE}
+    assert load_suite.compare({"login_storm": result(throughput_rps=75.0, p95_ms=64.0)}, baselines, 0.3) == []
+    failures = load_suite.compare({"login_storm": result(throughput_rps=60.0, p95_ms=70.0, rss_mb=120.0, errors=2),
+                                   "contest_start": result(throughput_rps=1.0)}, baselines, 0.3)
+    # contest_start has no baseline, so nothing is compared for it
+    assert failures == [
+        "login_storm: throughput 60.0 rps < baseline 100.0",
+        "login_storm: p95 70.0 ms > baseline 50.0",
+        "login_storm: rss 120.0 MB > baseline 80.0",
+        "login_storm: 2 errors (baseline 0)",
+    ]
+
+
+def test_fake_openai_serves_canned_and_streamed_completions():
+    client = TestClient(fake_openai.create_app())
+    path = "/openai/deployments/gpt-4/chat/completions"
+    body = {"messages": [{"role": "user", "content": "x" * 400}]}
+
+    completion = client.post(path, json=body).json()
+    assert json.loads(completion["choices"][0]["message"]["content"]) == fake_openai.CANNED_ANALYSIS
+    assert completion["usage"]["prompt_tokens"] == 100
+
+    events = [line[len("data: "):] for line in client.post(path, json=dict(body, stream=True)).text.splitlines()
+              if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    content = "".join(json.loads(e)["choices"][0]["delta"].get("content", "") for e in events[:-1])
+    assert json.loads(content) == fake_openai.CANNED_ANALYSIS
+
+    failing = TestClient(fake_openai.create_app(error_rate=1.0, error_status=429)).post(path, json=body)
+    assert failing.status_code == 429 and failing.headers["retry-after"] == "0"
+
+
+def test_suite_runs_every_scenario_offline():
+    pytest.importorskip("mongomock_motor")
+    args = argparse.Namespace(students=3, viewers=1, questions=1, concurrency=3, repeat=1, llm_latency_ms=0,
+                              bcrypt_rounds=4, scenario=None)
+    results = asyncio.run(load_suite.run(args))
+    assert list(results) == list(load_suite.SCENARIOS)
+    assert {name: r["errors"] for name, r in results.items()} == dict.fromkeys(load_suite.SCENARIOS, 0)
+    assert results["login_storm"]["requests"] == 3
+    assert results["contest_start"]["requests"] == 1 + 2 * 3
+    assert all(r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"] for r in results.values())
@@ -0,0 +1,48 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.mark.parametrize("token, public, header, expected", [
+    (None, False, None, 404),
+    ("s3cret", False, None, 401),
+    ("s3cret", False, "Bearer wrong", 401),
+    ("s3cret", False, "Bearer s3cret", 200),
+    (None, True, None, 200),
+])
+def test_metrics_need_a_token_unless_made_public(monkeypatch, token, public, header, expected):
+    monkeypatch.setattr(main.settings, "METRICS_TOKEN", token)
+    monkeypatch.setattr(main.settings, "METRICS_PUBLIC", public)
+    headers = {"Authorization": header} if header else {}
+    response = TestClient(main.app).get("/metrics", headers=headers)
+    assert response.status_code == expected
+    if expected == 200:
+        assert "# TYPE mongo_operation_errors_total counter" in response.text
+
+
+def test_mongo_listener_tracks_commands_from_many_driver_threads():
+    listener = main.MongoMetricsListener()
+    errors_before = main.MONGO_ERRORS._values.get(("metrics_test", "find"), 0.0)
+
+    def driver_thread(offset):
+        for request_id in range(offset, offset + 2000):
+            listener.started(SimpleNamespace(command={"find": "metrics_test"}, command_name="find",
+                                             request_id=request_id))
+            done = SimpleNamespace(command_name="find", request_id=request_id, duration_micros=100)
+            if request_id % 100 == 0:
+                listener.failed(done)
+            else:
+                listener.succeeded(done)
+
+    threads = [threading.Thread(target=driver_thread, args=(n * 2000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert listener._inflight == {}
+    assert main.MONGO_ERRORS._values[("metrics_test", "find")] - errors_before == 160
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakeContext:
+    def __init__(self, release=None):
+        self.release = release
+        self.threads = []
+
+    def hash(self, password):
+        self.threads.append(threading.current_thread().name)
+        if self.release is not None:
+            self.release.wait(5)
+        return "hashed:" + password
+
+
+@pytest.fixture
+def rounds(monkeypatch):
+    """Cheap bcrypt costs; the context is rebuilt whenever the cost changes."""
+    def set_rounds(n):
+        monkeypatch.setattr(main.settings, "BCRYPT_ROUNDS", n)
+        monkeypatch.setattr(main, "_pwd_context", None)
+    return set_rounds
+
+
+def test_hashing_runs_in_the_bcrypt_pool(monkeypatch):
+    context = FakeContext()
+    monkeypatch.setattr(main, "get_pwd_context", lambda: context)
+    hasher = main.PasswordHasher(workers=2, queue_limit=4)
+    assert hasher._executor is None
+    assert asyncio.run(hasher.hash("secret")) == "hashed:secret"
+    assert context.threads[0].startswith("bcrypt") and context.threads[0] != threading.current_thread().name
+    hasher._executor.shutdown()
+
+
+def test_callers_beyond_the_queue_limit_get_503(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(main, "get_pwd_context", lambda: FakeContext(release))
+    hasher = main.PasswordHasher(workers=1, queue_limit=2)
+
+    async def scenario():
+        pending = [asyncio.ensure_future(hasher.hash(f"p{n}")) for n in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as refused:
+            await hasher.hash("one too many")
+        release.set()
+        assert await asyncio.gather(*pending) == ["hashed:p0", "hashed:p1"]
+        assert hasher._pending == 0
+        return refused.value
+
+    refused = asyncio.run(scenario())
+    assert refused.status_code == 503 and refused.headers == {"Retry-After": "1"}
+    hasher._executor.shutdown()
+
+
+def test_login_upgrades_hashes_made_with_another_cost(mongo, rounds):
+    rounds(4)
+    stored = asyncio.run(main.password_hasher.hash("correct horse"))
+    asyncio.run(main.users_collection.insert_one({"email": "s@example.com", "username": "s", "role": "student",
+                                                  "hashed_password": stored}))
+    client = TestClient(main.app)
+    login = {"email": "s@example.com", "password": "correct horse", "role": "student"}
+
+    assert client.post("/auth/login", json=dict(login, password="wrong")).status_code == 401
+    assert client.post("/auth/login", json=login).status_code == 200
+    assert asyncio.run(main.users_collection.find_one())["hashed_password"] == stored
+
+    rounds(5)
+    assert client.post("/auth/login", json=login).status_code == 200
+    upgraded = asyncio.run(main.users_collection.find_one())["hashed_password"]
+    assert upgraded != stored and upgraded.startswith("$2b$05$")
+    assert asyncio.run(main.password_hasher.verify_and_update("correct horse", upgraded)) == (True, None)
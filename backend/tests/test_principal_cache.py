@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+from jose import jwt
+
+import main
+
+
+def token_for(email, issued_ago=10):
+    now = int(time.time())
+    claims = {"sub": email, "role": "teacher", "iat": now - issued_ago, "exp": now + 600}
+    return jwt.encode(claims, main.settings.SECRET_KEY, algorithm=main.settings.ALGORITHM)
+
+
+def worker(sync_seconds=0.0):
+    return main.PrincipalCache(100, 60, main.token_revocations_collection, sync_seconds=sync_seconds,
+                               token_lifetime_seconds=1800)
+
+
+def test_revocation_on_one_worker_reaches_the_others(mongo, monkeypatch):
+    revoking, other = worker(), worker()
+    token = token_for("t@example.com")
+
+    async def scenario():
+        monkeypatch.setattr(main, "principal_cache", other)
+        assert (await main.resolve_principal(token))["role"] == "teacher"
+        assert other.get(token) is not None  # cached on the other worker
+
+        await revoking.revoke("t@example.com")
+        with pytest.raises(main.HTTPException) as exc:
+            await main.resolve_principal(token)
+        assert exc.value.status_code == 401
+        assert other.get(token) is None
+
+        # A token issued after the revocation is accepted everywhere
+        assert await main.resolve_principal(token_for("t@example.com", issued_ago=-2))
+
+    asyncio.run(scenario())
+
+
+def test_other_workers_see_revocations_within_the_sync_interval(mongo, monkeypatch):
+    revoking, other = worker(), worker(sync_seconds=5)
+    clock = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+
+    async def scenario():
+        await other.sync()
+        await revoking.revoke("t@example.com")
+        await other.sync()
+        assert not other.is_revoked("t@example.com", time.time() - 10)  # within the staleness window
+        clock[0] += 5
+        await other.sync()
+        assert other.is_revoked("t@example.com", time.time() - 10)
+
+    asyncio.run(scenario())
+
+
+def test_revocation_record_expires_after_a_token_lifetime(mongo):
+    async def scenario():
+        await worker().revoke("t@example.com")
+        return await main.token_revocations_collection.find_one({"_id": "t@example.com"})
+
+    doc = asyncio.run(scenario())
+    remaining = (doc["expires_at"] - main.datetime.utcnow()).total_seconds()
+    assert 1700 < remaining <= 1800
+
+
+def test_failed_sync_keeps_serving(mongo, monkeypatch):
+    cache = worker()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(main.token_revocations_collection, "find", broken)
+    asyncio.run(cache.sync())
+    cache.put("token", {"email": "t@example.com", "role": "student"})
+    assert cache.get("token") == {"email": "t@example.com", "role": "student"}
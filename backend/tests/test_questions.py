@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+OWNER = {"email": "owner@example.com", "role": "teacher"}
+OTHER = {"email": "other@example.com", "role": "teacher"}
+QUESTION = {"title": "Two Sum", "description": "Find two numbers", "sample_input": "1 2", "sample_output": "3"}
+
+
+@pytest.fixture
+def contest_id(mongo):
+    contest_id = ObjectId()
+    asyncio.run(main.contests_collection.insert_one({"_id": contest_id, "teacher_email": OWNER["email"],
+                                                     "questions": []}))
+    return str(contest_id)
+
+
+def call(method, path, user, body):
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    try:
+        return TestClient(main.app).request(method, path, json=body)
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("POST", "/questions/add", lambda cid: dict(QUESTION, contest_id=cid)),
+    ("PUT", "/questions/bulk", lambda cid: {"contest_id": cid, "questions": [QUESTION]}),
+])
+def test_question_writes_distinguish_missing_and_foreign_contests(contest_id, method, path, body):
+    assert call(method, path, OTHER, body(contest_id)).status_code == 403
+    assert call(method, path, OWNER, body(str(ObjectId()))).status_code == 404
+    assert call(method, path, OWNER, body("not-an-id")).status_code == 404
+    assert call(method, path, {"email": "s@example.com", "role": "student"}, body(contest_id)).status_code == 403
+
+
+def test_owner_adds_question(contest_id):
+    response = call("POST", "/questions/add", OWNER, dict(QUESTION, contest_id=contest_id))
+    assert response.status_code == 200
+    contest = asyncio.run(main.contests_collection.find_one({"_id": ObjectId(contest_id)}))
+    assert [q["id"] for q in contest["questions"]] == [response.json()["id"]]
+
+
+def hidden_cases(contest_id, question):
+    """The question's tests without its visible sample."""
+    return asyncio.run(main.load_test_set(contest_id, dict(question, sample_output="")))
+
+
+def test_hidden_test_cases_follow_a_renamed_question(contest_id):
+    cases = [{"input": "2 2", "output": "4"}]
+    question_id = call("POST", "/questions/add", OWNER,
+                       dict(QUESTION, contest_id=contest_id, test_cases=cases)).json()["id"]
+    renamed = dict(QUESTION, id=question_id, title="Pair Sum")
+    assert call("PUT", "/questions/bulk", OWNER, {"contest_id": contest_id, "questions": [renamed]}).status_code == 200
+
+    assert hidden_cases(contest_id, renamed) == cases
+    # A new question reusing the old title does not inherit them
+    response = call("PUT", "/questions/bulk", OWNER, {"contest_id": contest_id, "questions": [QUESTION]})
+    reused = next(q for q in response.json()["questions"] if q["title"] == QUESTION["title"])
+    assert reused["id"] != question_id
+    assert hidden_cases(contest_id, dict(QUESTION, id=reused["id"])) == []
+
+
+def test_bulk_upsert_replaces_hidden_test_cases_by_id(contest_id, monkeypatch):
+    async def bulk_write(operations):  # mongomock cannot run pymongo's bulk operations
+        for op in operations:
+            await main.question_tests_collection.update_one(op._filter, op._doc, upsert=op._upsert)
+    monkeypatch.setattr(main.question_tests_collection, "bulk_write", bulk_write, raising=False)
+
+    cases = [{"input": "1 1", "output": "2"}]
+    body = {"contest_id": contest_id, "questions": [dict(QUESTION, test_cases=cases)]}
+    question = call("PUT", "/questions/bulk", OWNER, body).json()["questions"][0]
+    assert hidden_cases(contest_id, question) == cases
+
+    replaced = [{"input": "3 4", "output": "7"}]
+    body = {"contest_id": contest_id, "questions": [dict(QUESTION, id=question["id"], title="Renamed",
+                                                         test_cases=replaced)]}
+    assert call("PUT", "/questions/bulk", OWNER, body).status_code == 200
+    assert hidden_cases(contest_id, question) == replaced
+
+
+def test_migration_rekeys_title_keyed_test_cases(contest_id):
+    contest = ObjectId(contest_id)
+    asyncio.run(main.contests_collection.update_one({"_id": contest}, {"$set": {"questions": [
+        dict(QUESTION), dict(QUESTION, id="q2", title="Three Sum")]}}))
+    legacy = [
+        {"contest_id": contest_id, "question_title": "Two Sum", "cases": [{"input": "a", "output": "b"}]},
+        {"contest_id": contest_id, "question_title": "Three Sum", "cases": [{"input": "old", "output": "old"}]},
+        {"contest_id": contest_id, "question_title": "Deleted", "cases": []},
+    ]
+    new = {"contest_id": contest_id, "question_id": "q2", "cases": [{"input": "new", "output": "new"}]}
+
+    async def scenario():
+        await main.question_tests_collection.insert_many(legacy + [new])
+        report = await main.migrate_question_test_keys()
+        assert report == {"migrated": 1, "superseded": 1, "orphaned": 1}
+        assert await main.migrate_question_test_keys() == {"migrated": 0, "superseded": 0, "orphaned": 1}
+        return (await main.contests_collection.find_one({"_id": contest}))["questions"]
+
+    questions = asyncio.run(scenario())
+    two_sum = next(q for q in questions if q["title"] == "Two Sum")
+    assert two_sum["id"]
+    assert hidden_cases(contest_id, two_sum) == [{"input": "a", "output": "b"}]
+    assert hidden_cases(contest_id, questions[1]) == [{"input": "new", "output": "new"}]
@@ -0,0 +1,45 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from bson import ObjectId
+
+import main
+
+OID = ObjectId("6ad49e296caf8827b40a7940")
+DOC = {"_id": OID, "submitted_at": datetime(2026, 1, 1, 9, 30, 0, 123456), "student": "Zoë",
+       "similar": [{"submission_id": OID, "score": 0.5}], "analysis": None}
+EXPECTED = {"id": str(OID), "submitted_at": "2026-01-01T09:30:00.123456", "student": "Zoë",
+            "similar": [{"submission_id": str(OID), "score": 0.5}], "analysis": None}
+
+
+@pytest.mark.parametrize("encoder", ["orjson", "json"])
+def test_documents_render_in_one_pass_with_either_encoder(encoder, monkeypatch):
+    if encoder == "json":
+        monkeypatch.setattr(main, "orjson", None)
+    elif main.orjson is None:
+        pytest.skip("orjson is not installed")
+    body = main.render_json([main.serialize_doc(dict(DOC))])
+    assert json.loads(body) == [EXPECTED]
+    assert "Zoë".encode() in body  # UTF-8, not \\u escapes
+
+
+def test_unknown_types_are_still_an_error():
+    with pytest.raises(TypeError):
+        main.render_json({"amount": Decimal("1.5")})
+
+
+def test_response_class_uses_the_same_encoder():
+    response = main.FastJSONResponse({"at": DOC["submitted_at"], "id": OID})
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {"at": EXPECTED["submitted_at"], "id": str(OID)}
+
+
+def test_benchmark_paths_render_identical_json():
+    from benchmarks import serialization
+
+    data = serialization.build_batch(20, 120)
+    rendered = {name: json.loads(fn(data)) for name, fn in serialization.PATHS.items()}
+    assert len(rendered["legacy"]) == 20
+    assert rendered["fast"] == rendered["raw_bson"] == rendered["legacy"]
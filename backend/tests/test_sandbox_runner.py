@@ -0,0 +1,139 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+
+import pytest
+
+import main
+import sandbox_runner
+
+LIMITS = {"cpu_seconds": 2, "memory_bytes": 256 * 1024 * 1024, "address_space": 256 * 1024 * 1024,
+          "output_bytes": 64 * 1024, "processes": 16}
+
+needs_sandbox = pytest.mark.skipif(main.ExecutionEngine._check_available() is not None,
+                                   reason="the sandbox needs root on Linux")
+
+
+@pytest.fixture
+def workdir():
+    path = tempfile.mkdtemp(prefix="meridian-test-")
+    os.chmod(path, 0o755)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def pool():
+    pool = main.SandboxPool(1)
+    yield pool
+    while not pool._idle.empty():
+        runner = pool._idle.get()
+        runner.kill()
+        runner.wait()
+
+
+def write_program(workdir, source):
+    with open(os.path.join(workdir, "main.py"), "w") as f:
+        f.write(source)
+
+
+def run_python(pool, workdir, stdin="", wall_seconds=5):
+    return main._sandbox_run(pool, ["python3", "-I", "-S", "main.py"], workdir, stdin, LIMITS, wall_seconds)
+
+
+def test_runner_refuses_to_run_without_root(monkeypatch):
+    monkeypatch.setattr(sandbox_runner.os, "geteuid", lambda: 1000)
+    assert sandbox_runner.run({}) == {"error": "sandbox setup failed: the runner must start as root"}
+
+
+@needs_sandbox
+def test_runner_reports_exit_status_and_output(pool, workdir):
+    write_program(workdir, "import sys\nn = int(input())\nprint(n * 2)\nsys.exit(3)\n")
+    run = run_python(pool, workdir, "21\n")
+    assert run["exit_code"] == 3
+    assert run["stdout"].strip() == "42"
+    assert not run["timed_out"] and not run["output_exceeded"]
+    assert run["memory_kb"] > 0 and run["wall_ms"] > 0
+
+
+@needs_sandbox
+def test_runner_kills_programs_past_the_wall_clock(pool, workdir):
+    write_program(workdir, "import time\ntime.sleep(30)\n")
+    run = run_python(pool, workdir, wall_seconds=0.5)
+    assert run["timed_out"]
+    assert run["exit_code"] == -signal.SIGKILL
+    assert main._verdict(run, "", LIMITS) == main.VERDICT_TIME_LIMIT
+
+
+@needs_sandbox
+def test_runner_hides_server_files_and_drops_privileges(pool, workdir):
+    write_program(workdir, "import os\n"
+                           f"print(os.path.exists({main.__file__!r}), os.getuid(), os.getcwd())\n")
+    run = run_python(pool, workdir)
+    assert run["exit_code"] == 0
+    assert run["stdout"].split() == ["False", str(main.NOBODY_ID), "/work"]
+
+
+@needs_sandbox
+def test_setup_failures_are_errors_not_exit_codes(pool, workdir):
+    run = main._sandbox_run(pool, ["no-such-binary"], workdir, "", LIMITS, 5)
+    assert run["error"].startswith("sandbox setup failed: FileNotFoundError")
+
+
+@needs_sandbox
+def test_pool_replaces_a_runner_that_died(pool, workdir):
+    write_program(workdir, "print('ok')\n")
+    assert run_python(pool, workdir)["stdout"] == "ok\n"
+    runner = pool._idle.get()
+    runner.kill()
+    runner.wait()
+    pool._idle.put(runner)
+    assert run_python(pool, workdir) == {"error": "sandbox runner exited unexpectedly"}
+    assert run_python(pool, workdir)["stdout"] == "ok\n"
+    assert pool._started == 1
+
+
+def engine():
+    return main.ExecutionEngine(main.AnalysisCache(main.execution_cache_collection, 16, 60), workers=2,
+                                enabled=True)
+
+
+def test_engine_starts_no_threads_or_runners_until_first_run():
+    assert main.execution_engine._executor is None
+    assert engine()._executor is None
+
+
+def test_engine_without_root_reports_unavailable(mongo, monkeypatch):
+    monkeypatch.setattr(main.os, "geteuid", lambda: 1000)
+    unavailable = engine()
+    tests = [{"input": "1", "output": "1"}]
+    execution = asyncio.run(unavailable.run("print(1)", "python", tests))
+    assert execution == {"status": "Unavailable", "error": "test execution needs the server to run as root",
+                         "test_cases": 1}
+    assert asyncio.run(unavailable.cached("print(1)", "python", tests)) == execution
+    assert unavailable._executor is None
+
+    analysis = {"evaluation_metrics": {"code_correctness": {"status": "Passed"}}}
+    applied = main.apply_execution_metrics(analysis, execution)
+    assert applied["evaluation_metrics"] == analysis["evaluation_metrics"]
+    assert applied["execution"] == execution
+
+
+@needs_sandbox
+def test_engine_grades_and_caches_test_cases(mongo):
+    runner = engine()
+    code = "a, b = map(int, input().split())\nprint(a + b)\n"
+    tests = [{"input": "1 2", "output": "3"}, {"input": "2 2", "output": "5"}]
+    try:
+        execution = asyncio.run(runner.run(code, "python", tests))
+        assert execution["status"] == "Failed"
+        assert [r["verdict"] for r in execution["results"]] == [main.VERDICT_ACCEPTED, main.VERDICT_WRONG_ANSWER]
+        assert (execution["passed_cases"], execution["failed_cases"]) == (1, 1)
+        assert asyncio.run(runner.cached(code, "python", tests)) == execution
+    finally:
+        if runner._executor is not None:
+            runner._executor.shutdown()
+            while not runner._pool._idle.empty():
+                runner._pool._idle.get().kill()
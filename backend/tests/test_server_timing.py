@@ -0,0 +1,56 @@
+import asyncio
+import os
+import pstats
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_header_sums_repeated_phases_and_adds_the_total():
+    header = main.server_timing_header([("users", 0.002), ("llm", 0.5), ("users", 0.001)], 0.75)
+    assert header == "users;dur=3.00, llm;dur=500.00, total;dur=750.00"
+
+
+def test_spans_outside_a_request_record_nothing():
+    with main.span("orphan"):
+        pass
+    assert main._request_spans.get() is None
+
+
+@pytest.fixture
+def authorized(mongo):
+    asyncio.run(main.users_collection.insert_one({"email": "timing@example.com", "role": "teacher"}))
+    # No role claim, so the users lookup runs; the nonce keeps the token out of the principal cache
+    token = main.create_access_token({"sub": "timing@example.com", "nonce": uuid.uuid4().hex})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_auth_phases_are_reported(authorized):
+    response = TestClient(main.app).get("/protected", headers=authorized)
+    assert response.status_code == 200
+    phases = dict(part.split(";dur=") for part in response.headers["server-timing"].split(", "))
+    assert {"jwt", "users", "total"} <= set(phases)
+    assert all(float(ms) >= 0 for ms in phases.values())
+    assert float(phases["total"]) >= float(phases["jwt"])
+
+
+def test_profiles_are_captured_only_when_asked_for(authorized, monkeypatch, tmp_path):
+    monkeypatch.setattr(main.settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(main.settings, "PROFILE_TOKEN", "let-me-profile")
+    monkeypatch.setattr(main.request_profiler, "directory", str(tmp_path))
+    client = TestClient(main.app)
+
+    assert "x-profile-id" not in client.get("/protected", headers=authorized).headers
+    refused = client.get("/protected", headers=dict(authorized, **{"X-Profile": "guess"}))
+    assert "x-profile-id" not in refused.headers
+
+    response = client.get("/protected", headers=dict(authorized, **{"X-Profile": "let-me-profile"}))
+    name = response.headers["x-profile-id"]
+    assert name.endswith(("-GET-protected.prof", "-GET-protected.html"))
+    assert os.listdir(tmp_path) == [name]
+    if name.endswith(".prof"):
+        assert pstats.Stats(str(tmp_path / name)).total_calls > 0
+    assert not main.request_profiler._active
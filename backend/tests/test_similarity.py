@@ -0,0 +1,162 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+
+import main
+
+ORIGINAL = '''
+def two_sum(nums, target):
+    seen = {}
+    for index, value in enumerate(nums):
+        need = target - value
+        if need in seen:
+            return [seen[need], index]
+        seen[value] = index
+    return []
+
+def main():
+    nums = list(map(int, input().split()))
+    target = int(input())
+    print(two_sum(nums, target))
+'''
+
+# Same program with every identifier, comment and literal changed
+RENAMED = '''
+# my own solution
+def find_pair(arr, goal):
+    lookup = {}
+    for i, x in enumerate(arr):
+        other = goal - x
+        if other in lookup:
+            return [lookup[other], i]
+        lookup[x] = i
+    return []
+
+def run():
+    arr = list(map(int, input().split()))
+    goal = int(input())
+    print(find_pair(arr, goal))
+'''
+
+UNRELATED = '''
+class Matrix:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def transpose(self):
+        return Matrix([list(col) for col in zip(*self.rows)])
+
+    def __mul__(self, other):
+        cols = other.transpose().rows
+        return Matrix([[sum(a * b for a, b in zip(r, c)) for c in cols] for r in self.rows])
+
+while True:
+    line = input()
+    if not line:
+        break
+    print(line[::-1].upper())
+'''
+
+
+def make_engine():
+    return main.SimilarityEngine(main.similarity_collection, kgram=5, window=4, permutations=128, bands=32,
+                                 top_k=5, max_indexes=8, refresh_seconds=3600)
+
+
+def estimated_similarity(engine, a, b):
+    sig_a, _ = engine.signature_for(a, "python")
+    sig_b, _ = engine.signature_for(b, "python")
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def test_identical_and_renamed_code_match():
+    engine = make_engine()
+    assert estimated_similarity(engine, ORIGINAL, ORIGINAL) == 1.0
+    assert estimated_similarity(engine, ORIGINAL, RENAMED) == 1.0
+
+
+def test_unrelated_code_does_not_match():
+    assert estimated_similarity(make_engine(), ORIGINAL, UNRELATED) < 0.2
+
+
+def test_input_shorter_than_k_still_fingerprints():
+    engine = make_engine()
+    short = "print(1)"
+    assert len(main.tokenize_code(short, "python")) < engine.kgram
+    fingerprints = engine.fingerprints(short, "python")
+    assert len(fingerprints) == 1
+    assert estimated_similarity(engine, short, "print(2)") == 1.0  # literals are normalized away
+    assert estimated_similarity(engine, short, "x = y") < 0.2
+
+
+def test_empty_input_has_no_fingerprints():
+    engine = make_engine()
+    assert len(engine.fingerprints("", "python")) == 0
+    sig, count = engine.signature_for("   \n", "python")
+    assert count == 0
+    assert len(sig) == engine.permutations
+
+
+def test_signatures_are_identical_across_processes():
+    engine = make_engine()
+    here = engine.signature_for(ORIGINAL, "python")[0].tobytes().hex()
+    script = (
+        "import sys, main\n"
+        "engine = main.SimilarityEngine(None, 5, 4, 128, 32, 5, 8, 3600)\n"
+        "print(engine.signature_for(sys.stdin.read(), 'python')[0].tobytes().hex())\n"
+    )
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONHASHSEED="12345")
+    out = subprocess.run([sys.executable, "-c", script], input=ORIGINAL, capture_output=True, text=True,
+                         cwd=backend, env=env, check=True, timeout=60)
+    assert out.stdout.splitlines()[-1] == here  # earlier lines are startup log records
+
+
+def test_lsh_index_returns_similar_candidates_only():
+    engine = make_engine()
+    index = main.LSHIndex(engine.bands, engine.rows, engine.permutations)
+    index.add("original", "a@example.com", engine.signature_for(ORIGINAL, "python")[0])
+    index.add("unrelated", "b@example.com", engine.signature_for(UNRELATED, "python")[0])
+
+    renamed = engine.signature_for(RENAMED, "python")[0]
+    assert index.query(renamed, k=5) == [{"submission_id": "original", "student_email": "a@example.com",
+                                          "similarity": 1.0}]
+    assert index.query(renamed, k=5, exclude_student="a@example.com") == []
+
+
+def test_add_submission_reports_nearest_and_clusters(mongo):
+    engine = make_engine()
+    ids = [str(main.ObjectId()) for _ in range(3)]
+
+    async def scenario():
+        await engine.add_submission(ids[0], "c1", "Two Sum", "a@example.com", ORIGINAL, "python")
+        await engine.add_submission(ids[1], "c1", "Two Sum", "b@example.com", UNRELATED, "python")
+        nearest = await engine.add_submission(ids[2], "c1", "Two Sum", "c@example.com", RENAMED, "python")
+        report = await engine.similarity_report("c1", "Two Sum", threshold=0.8)
+        return nearest, report
+
+    nearest, report = asyncio.run(scenario())
+    assert [n["submission_id"] for n in nearest] == [ids[0]]
+    assert len(report["clusters"]) == 1
+    assert sorted(report["clusters"][0]["submission_ids"]) == sorted([ids[0], ids[2]])
+    assert report["matrix"][0][0] == 1.0
+
+
+def test_local_insert_does_not_skip_unsynced_peer_submissions(mongo):
+    local, peer = make_engine(), make_engine()
+    older, newer = str(main.ObjectId()), str(main.ObjectId())
+
+    async def scenario():
+        index = await local._get_index("c1", "Two Sum")  # synced while the collection is empty
+        await peer.add_submission(older, "c1", "Two Sum", "a@example.com", ORIGINAL, "python")
+        await local.add_submission(newer, "c1", "Two Sum", "b@example.com", UNRELATED, "python")
+        index.synced_at = float("-inf")  # refresh interval elapsed
+        await local._get_index("c1", "Two Sum")
+        return index
+
+    index = asyncio.run(scenario())
+    assert sorted(index.ids) == sorted([older, newer])
+    assert len(index.ids) == 2  # the local insert is not indexed twice
+    assert str(index.last_id) == newer
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import main
+
+
+def test_streamed_analysis_records_usage_against_the_contest(mongo, monkeypatch):
+    contexts = []
+    result = {"is_valid_code": True, "plagiarism_detected": False, "confidence_score": 12}
+
+    async def stream_chat(messages, usage_context=None, **kwargs):
+        contexts.append(usage_context)
+        text = json.dumps(result)
+        for i in range(0, len(text), 7):
+            yield text[i:i + 7]
+
+    monkeypatch.setattr(main, "OPENAI_SDK_INSTALLED", True)
+    monkeypatch.setattr(main.llm_service, "api_key", "key")
+    monkeypatch.setattr(main.llm_service, "endpoint", "http://upstream")
+    monkeypatch.setattr(main.llm_service, "api_version", "2024-02-01")
+    monkeypatch.setattr(main.llm_service, "stream_chat", stream_chat)
+
+    async def consume():
+        submission = {"submitter_email": "s@example.com", "contest_id": "contest-1"}
+        return [event async for event in main.stream_plagiarism_analysis(submission, "print(1)", "python")]
+
+    events = asyncio.run(consume())
+    assert events[-1].startswith("event: done")
+    assert '"confidence_score": 12' in events[-1]
+    assert len(contexts) == 1
+    assert contexts[0]["contest_id"] == "contest-1"
+    assert contexts[0]["purpose"] == "plagiarism_analysis_stream"
+
+
+def test_disconnected_stream_hands_the_job_to_the_queue(mongo, monkeypatch):
+    monkeypatch.setattr(main, "OPENAI_SDK_INSTALLED", True)
+    monkeypatch.setattr(main.llm_service, "api_key", "key")
+    monkeypatch.setattr(main.llm_service, "endpoint", "http://upstream")
+    monkeypatch.setattr(main.llm_service, "api_version", "2024-02-01")
+    streaming = None
+
+    async def stream_chat(messages, usage_context=None, **kwargs):
+        yield '{"is_valid'
+        streaming.set()
+        await asyncio.Event().wait()  # the upstream stalls until the request is cancelled
+
+    async def full_analysis(*args, **kwargs):
+        return {"is_valid_code": True, "plagiarism_detected": False, "confidence_score": 7}
+
+    monkeypatch.setattr(main.llm_service, "stream_chat", stream_chat)
+    monkeypatch.setattr(main, "run_full_analysis", full_analysis)
+    monkeypatch.setattr(main, "analysis_queue", main.AnalysisQueue(main.analysis_store, workers=1, maxsize=10,
+                                                                   service_time=1.0))
+
+    async def scenario():
+        nonlocal streaming
+        streaming = asyncio.Event()
+        events = []
+
+        async def consume():
+            submission = {"submitter_email": "s@example.com", "code_hash": "0" * 64}
+            async for event in main.stream_plagiarism_analysis(submission, "print('bye')", "python"):
+                events.append(event)
+
+        request = asyncio.create_task(consume())
+        await streaming.wait()
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+
+        job_id = json.loads(events[0].split("data: ", 1)[1])["job_id"]
+        job = await main.analysis_queue.wait(job_id, 5)
+        assert job["status"] == main.JOB_COMPLETED
+        assert job["plagiarism_analysis"]["confidence_score"] == 7
+
+    asyncio.run(scenario())
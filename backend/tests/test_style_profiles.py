@@ -0,0 +1,73 @@
+import asyncio
+
+import main
+from main import STYLE_FEATURES, StyleProfiles, style_features
+
+SNAKE = '''def sum_of_values(input_values):
+    running_total = 0
+    for current_value in input_values:
+        running_total += current_value
+    return running_total
+'''
+CAMEL = '''// add them up
+int sumOfValues(int[] inputValues) {
+\tint runningTotal = 0;
+\tfor (int currentValue : inputValues) { runningTotal += currentValue; }
+\treturn runningTotal;
+}
+'''
+
+
+def test_features_describe_naming_indentation_and_shape():
+    snake = style_features(SNAKE, "python")
+    assert set(snake) == set(STYLE_FEATURES)
+    assert snake["identifier_snake_case"] > 0.5 and snake["identifier_camel_case"] == 0
+    assert snake["indent_width"] == 4 and snake["nesting_depth"] == 2 and snake["indent_tabs"] == 0
+    assert snake["shape_function"] == snake["shape_loop"] == snake["shape_return"] == 1 / 5
+    assert snake["comment_density"] == 0
+    assert abs(sum(snake[f"ngram_{i}"] for i in range(main.STYLE_NGRAM_BUCKETS)) - 1) < 1e-9
+
+    camel = style_features(CAMEL, "java")
+    assert camel["identifier_camel_case"] > 0.5 and camel["identifier_snake_case"] == 0
+    assert camel["indent_tabs"] == 1 and camel["comment_density"] > 0
+    assert camel["shape_loop"] > 0 and camel["shape_return"] > 0
+
+
+def test_features_of_empty_or_unparsable_code_are_zero_not_errors():
+    assert set(style_features("", "python").values()) == {0.0}
+    assert style_features("def broken(:\n    pass\n", "python")["shape_function"] > 0
+
+
+def test_drift_is_scored_once_the_profile_has_enough_submissions(mongo):
+    profiles = StyleProfiles(main.style_profiles_collection, min_submissions=3)
+
+    async def scenario():
+        early = [await profiles.add_submission("s@example.com", "python", SNAKE.replace("values", f"values{i}"))
+                 for i in range(3)]
+        assert [d["profile_submissions"] for d in early] == [0, 1, 2]
+        assert all(d["score"] is None for d in early)
+        typical = await profiles.add_submission("s@example.com", "Python", SNAKE)
+        drifted = await profiles.add_submission("s@example.com", "python", CAMEL)
+        # Profiles are per student and language
+        other = await profiles.add_submission("t@example.com", "python", SNAKE)
+        stored = await main.style_profiles_collection.find_one({"student_email": "s@example.com"})
+        return typical, drifted, other, stored
+
+    typical, drifted, other, stored = asyncio.run(scenario())
+    assert typical["profile_submissions"] == 3 and typical["score"] < 25
+    assert drifted["score"] > typical["score"] + 25
+    assert len(drifted["top_features"]) == 3
+    assert {f["feature"] for f in drifted["top_features"]} <= set(STYLE_FEATURES)
+    assert other == {"score": None, "profile_submissions": 0}
+    assert stored["count"] == 5 and stored["language"] == "python"
+    assert stored["version"] == main.STYLE_PROFILE_VERSION
+
+
+def test_score_is_bounded_and_zero_for_the_profile_mean():
+    profiles = StyleProfiles(None, min_submissions=1)
+    features = style_features(SNAKE, "python")
+    profile = {"count": 2, "sum": {k: 2 * v for k, v in features.items()},
+               "sumsq": {k: 2 * v * v for k, v in features.items()}}
+    assert profiles.score(features, profile)["score"] == 0
+    far = dict.fromkeys(STYLE_FEATURES, 1000.0)
+    assert profiles.score(far, profile)["score"] > 95
@@ -0,0 +1,50 @@
+import asyncio
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+TEACHER = {"email": "owner@example.com", "role": "teacher"}
+
+
+def analysis_event(submission_id, job_id):
+    return {"type": main.FEED_ANALYSIS, "cursor": submission_id,
+            "data": {"submission_id": submission_id, "job_id": job_id, "status": main.JOB_COMPLETED}}
+
+
+def submission_event(submission_id):
+    return {"type": main.FEED_SUBMISSION, "cursor": submission_id, "data": {"id": submission_id}}
+
+
+def test_live_events_repeating_the_backfill_are_dropped(mongo, monkeypatch):
+    contest_id = ObjectId()
+    asyncio.run(main.contests_collection.insert_one({"_id": contest_id, "teacher_email": TEACHER["email"]}))
+    old, new = str(ObjectId()), str(ObjectId())
+    channel = main.submission_feed.channel(str(contest_id))
+
+    async def principal(token):
+        return dict(TEACHER)
+
+    async def backfill(contest, cursor):
+        yield submission_event(old)
+        yield analysis_event(old, "job-old")
+        # Written while the backfill ran: both arrive again on the live subscription
+        await main.submission_feed.broker.publish(channel, submission_event(old))
+        await main.submission_feed.broker.publish(channel, analysis_event(old, "job-old"))
+        # Genuinely new: a later analysis of the old submission and a new submission
+        await main.submission_feed.broker.publish(channel, analysis_event(old, "job-retry"))
+        await main.submission_feed.broker.publish(channel, submission_event(new))
+
+    monkeypatch.setattr(main, "resolve_principal", principal)
+    monkeypatch.setattr(main.submission_feed, "backfill", backfill)
+
+    with TestClient(main.app).websocket_connect(f"/submissions/live/{contest_id}?token=t") as ws:
+        received = [ws.receive_json() for _ in range(4)]
+
+    assert [(e["type"], e["cursor"], e["data"].get("job_id")) for e in received] == [
+        (main.FEED_SUBMISSION, old, None),
+        (main.FEED_ANALYSIS, old, "job-old"),
+        (main.FEED_ANALYSIS, old, "job-retry"),
+        (main.FEED_SUBMISSION, new, None),
+    ]
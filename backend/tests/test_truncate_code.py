@@ -0,0 +1,37 @@
+from main import count_tokens, truncate_code
+
+LONG_LINE = "total = " + " + ".join(f"value_{i}" for i in range(2000))
+
+
+def test_code_within_budget_is_unchanged():
+    assert truncate_code("print(1)\n", 100) == ("print(1)\n", 0)
+
+
+def test_whole_lines_are_dropped_from_the_middle():
+    code = "\n".join(f"line_{i} = {i}" for i in range(400))
+    truncated, omitted = truncate_code(code, 200)
+    lines = truncated.splitlines()
+    assert count_tokens(truncated) <= 200
+    assert lines[0] == "line_0 = 0" and lines[-1] == "line_399 = 399"
+    assert f"[{omitted} lines omitted to fit the analysis budget]" in truncated
+    assert len(lines) == 400 - omitted + 1
+
+
+def test_a_single_long_line_is_cut_inside_the_line():
+    truncated, omitted = truncate_code(LONG_LINE, 300)
+    head, marker, tail = truncated.split("\n")
+    assert omitted == 1
+    assert count_tokens(truncated) <= 300
+    assert "[1 lines omitted or cut short" in marker
+    assert LONG_LINE.startswith(head) and LONG_LINE.endswith(tail)
+    # Most of the budget is spent on code rather than on the marker alone
+    assert count_tokens(head + tail) > 200
+
+
+def test_a_long_last_line_is_cut_after_whole_head_lines():
+    code = "import sys\nimport math\n" + LONG_LINE
+    truncated, omitted = truncate_code(code, 300)
+    lines = truncated.split("\n")
+    assert lines[:2] == ["import sys", "import math"]
+    assert omitted == 1 and LONG_LINE.endswith(lines[-1]) and len(lines[-1]) > 100
+    assert count_tokens(truncated) <= 300